@@ -8,9 +8,9 @@ from __future__ import absolute_import
 import numpy as np
 from six.moves import xrange
 from sklearn.utils.validation import check_X_y
-from sklearn.metrics.pairwise import euclidean_distances
 
 from .dml_algorithm import DML_Algorithm
+from .dml_utils import expected_success
 
 
 class ClassNCA(DML_Algorithm):
@@ -68,6 +68,15 @@ class ClassNCA(DML_Algorithm):
 
         Decrease factor for learning rate. Ignored if learning_rate is not 'adaptive'.
 
+    max_memory : int, default=2**27
+
+        Approximate number of bytes of distances held at once when computing the expected success,
+        which is done by blocks of samples.
+
+    n_jobs : int or None, default=None
+
+        Number of threads used to compute the expected success. If -1, the number of processors is used.
+
     References
     ----------
         Jacob Goldberger et al. “Neighbourhood components analysis”. In: Advances in neural
@@ -83,7 +92,9 @@ class ClassNCA(DML_Algorithm):
                  tol=1e-8,
                  eta_thres=1e-14,
                  learn_inc=1.01,
-                 learn_dec=0.5):
+                 learn_dec=0.5,
+                 max_memory=2**27,
+                 n_jobs=None):
         self.max_iter = max_iter
         self.eta = self.eta0 = eta0
         self.learning_rate = learning_rate
@@ -93,6 +104,8 @@ class ClassNCA(DML_Algorithm):
         self.eta_thres = eta_thres
         self.learn_inc = learn_inc
         self.learn_dec = learn_dec
+        self.max_memory = max_memory
+        self.n_jobs = n_jobs
 
         # Metadata initialization
         self.num_its_ = None
@@ -180,11 +193,11 @@ class ClassNCA(DML_Algorithm):
             class_split_inds[cc] = np.where(y == cc)[0]
             matrix_dict[cc] = L.copy()
 
-        self.initial_softmax_ = self._compute_expected_success(matrix_dict, X, y, class_split_inds) / len(y)
+        self.initial_softmax_ = self._compute_expected_success(matrix_dict, X, y, self.max_memory, self.n_jobs) / len(y)
 
         self._SGD_fit(X, y, general_matrix, matrix_dict, class_split_inds)
 
-        self.final_softmax_ = self._compute_expected_success(self.matrix_dict, X, y, class_split_inds) / len(y)
+        self.final_softmax_ = self._compute_expected_success(self.matrix_dict, X, y, self.max_memory, self.n_jobs) / len(y)
         return self
 
     def _SGD_fit(self, X, y, general_matrix, matrix_dict, class_split_inds):
@@ -272,7 +285,7 @@ class ClassNCA(DML_Algorithm):
 
             # calculate objective function
             # not divided by len(y) here, why? doesn't matter not compared to that
-            succ = self._compute_expected_success(matrix_dict, X, y, class_split_inds)
+            succ = self._compute_expected_success(matrix_dict, X, y, self.max_memory, self.n_jobs)
 
             # technical details for SGD loop
             if adaptive:
@@ -304,7 +317,7 @@ class ClassNCA(DML_Algorithm):
         return self
 
     @staticmethod
-    def _compute_expected_success(matrix_dict, X, y, class_split_inds=None):
+    def _compute_expected_success(matrix_dict, X, y, max_memory=2**27, n_jobs=None):
         """
         Computes the sum over all i and j of p_ij.
         Parameters
@@ -312,40 +325,15 @@ class ClassNCA(DML_Algorithm):
         matrix_dict
         X
         y
-        class_split_inds
+        max_memory
+        n_jobs
 
         Returns
         -------
 
         """
-        n, d = X.shape
         transformed_space = ClassNCA.transformX(matrix_dict, X, y)
-        success = 0.0
-
-        dists = euclidean_distances(transformed_space)
-        for i in range(len(y)):
-            softmax = np.empty([n], dtype=float)
-            dists_i = -dists[i, :]
-            dists_i[i] = -np.inf
-            i_max = np.argmax(dists_i)
-            c = dists_i[i_max]
-            for j in xrange(n):
-                if j != i:
-                    if j == i_max:
-                        softmax[j] = 1
-                    else:
-                        pw = min(0, dists_i[j] - c)
-                        softmax[j] = np.exp(pw)
-            softmax[i] = 0
-            softmax /= softmax.sum()
-
-            # Calc p_i
-            yi_mask = np.where(y == y[i])[0] if class_split_inds is None else class_split_inds[y[i]]
-            p_i = softmax[yi_mask].sum()
-
-            success += p_i
-
-        return success
+        return expected_success(transformed_space, y, max_memory, n_jobs)
 
     # works, this is what psi(x) must be
     @staticmethod
@@ -9,6 +9,7 @@ from numpy.linalg import cholesky
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.utils.validation import check_array
 from sklearn.metrics.pairwise import pairwise_kernels
+from sklearn.kernel_approximation import Nystroem, RBFSampler
 from .dml_utils import metric_to_linear
 
 
@@ -111,24 +112,55 @@ class KernelDML_Algorithm(DML_Algorithm):
         .. math:: Lx = A(K(x_1,x),\\dots,K(x_n,x)),
 
         where L is the high dimensional transformer and K is the kernel function.
+
+        If kernel_approx is set, the kernel matrix is replaced by an (n x r) low-rank feature matrix F with
+        .. math:: K \\approx F F^T,
+        obtained from Nystroem landmarks ('nystroem') or random Fourier features ('rff', rbf kernel only).
+        The transformer is then (d' x r), and is applied to the features of x instead of its kernel vector.
     """
 
     def __init__(self):
             raise NotImplementedError('Class KernelDML_Algorithm is abstract and cannot be instantiated.')
 
     def _get_kernel(self, X, Y=None):
-        if callable(self.kernel_):
-            params = self.kernel_params_ or {}
+        if callable(self.kernel):
+            params = self.kernel_params or {}
+        else:
+            params = {'gamma': self.gamma,
+                      'degree': self.degree,
+                      'coef0': self.coef0}
+
+        return pairwise_kernels(X, Y, metric=self.kernel, filter_params=True, **params)
+
+    def _fit_kernel_features(self, X):
+        """
+        Fits the low-rank kernel approximation selected by kernel_approx on X.
+
+        Returns
+        -------
+        F : (N x r) matrix, with F F^T approximating the kernel matrix of X.
+        """
+        if self.kernel_approx == 'nystroem':
+            self.kernel_map_ = Nystroem(kernel=self.kernel,
+                                        gamma=self.gamma,
+                                        degree=self.degree,
+                                        coef0=self.coef0,
+                                        kernel_params=self.kernel_params,
+                                        n_components=min(self.n_components, X.shape[0]),
+                                        random_state=self.random_state)
+        elif self.kernel_approx == 'rff':
+            if self.kernel != 'rbf':
+                raise ValueError("Random Fourier features ('rff') are only available for the 'rbf' kernel.")
+            gamma = self.gamma if self.gamma is not None else 1.0 / X.shape[1]
+            self.kernel_map_ = RBFSampler(gamma=gamma, n_components=self.n_components, random_state=self.random_state)
         else:
-            params = {'gamma': self.gamma_,
-                      'degree': self.degree_,
-                      'coef0': self.coef0_}
+            raise ValueError("'kernel_approx' must be one of the following: None, 'nystroem', 'rff'.")
 
-        return pairwise_kernels(X, Y, metric=self.kernel_, filter_params=True, **params)
+        return self.kernel_map_.fit_transform(X)
 
     @property
     def _pairwise(self):
-        return self.kernel_ == "precomputed"
+        return self.kernel == "precomputed"
 
     def transform(self, X=None):
         """Applies the kernel transformation.
@@ -149,5 +181,8 @@ class KernelDML_Algorithm(DML_Algorithm):
             X = check_array(X, accept_sparse=True)
 
         L = self.transformer()
-        K = self._get_kernel(X, self.X_)
+        if self.kernel_approx is None:
+            K = self._get_kernel(X, self.X_)
+        else:
+            K = self.kernel_map_.transform(X)
         return K.dot(L.T)
\ No newline at end of file
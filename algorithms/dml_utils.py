@@ -5,10 +5,13 @@ Adapted from https://github.com/jlsuarezdiaz/pyDML.
 """
 
 from __future__ import print_function, absolute_import
+import os
 import numpy as np
 import warnings
-from six.moves import xrange
-from sklearn.metrics import pairwise_distances
+from concurrent.futures import ThreadPoolExecutor
+from scipy.sparse import csr_matrix
+from sklearn.metrics import pairwise_distances, euclidean_distances
+from sklearn.neighbors import NearestNeighbors
 
 
 def metric_to_linear(M):
@@ -144,15 +147,10 @@ def calc_outers_i(X, outers, i, Y=None):
     if outers is not None:
         return outers[i, :]
     else:
-        n, d = X.shape
         if Y is None:
             Y = X
-        m, e = Y.shape
-        outers_i = np.empty([n, d, d], dtype=float)
-
-        for j in xrange(m):
-            outers_i[j] = np.outer(X[i, :] - Y[j, :], X[i, :] - Y[j, :])
-        return outers_i
+        diff = X[i, :] - Y
+        return np.einsum('ij,ik->ijk', diff, diff)
 
 
 def calc_outers_ij(X, outers_i, i, j, Y=None):
@@ -238,11 +236,7 @@ def unroll(A):
 
         The vector with the unrolled matrix.
     """
-    n, m = A.shape
-    v = np.empty([n * m, 1])
-    for i in xrange(m):
-        v[(i * n):(i + 1) * n, 0] = A[:, i]
-    return v
+    return np.array(A, dtype=float).reshape([-1, 1], order='F')
 
 
 def matpack(v, n, m):
@@ -271,14 +265,11 @@ def matpack(v, n, m):
 
         The matrix that takes by columns the elements in v.
     """
-    A = np.empty([n, m], dtype=float)
-    for i in xrange(m):
-        A[:, i] = v[(i * n):(i + 1) * n, 0]
-    return A
+    return np.array(v[:n * m, 0], dtype=float).reshape([n, m], order='F')
 
 
 # Pairwise distance for two datasets given their dot products
-def pairwise_sq_distances_from_dot(K):
+def pairwise_sq_distances_from_dot(K, K_x=None, K_y=None):
     """
     Calculates the pairwise squared distance between two datasets given the matrix of dot products.
 
@@ -290,6 +281,16 @@ def pairwise_sq_distances_from_dot(K):
         A matrix with the dot products between two datasets. It verifies
         ..math:: K[i,j] = \\langle x_i, y_j \\rangle
 
+    K_x : 1D-Array, default=None
+
+        The dot products of the elements in the first dataset with themselves.
+        If None, K must be square, and the datasets are taken to be the same, with K_x the diagonal of K.
+
+    K_y : 1D-Array, default=None
+
+        The dot products of the elements in the second dataset with themselves.
+        If None, it is taken as K_x.
+
     Returns
     -------
 
@@ -298,15 +299,57 @@ def pairwise_sq_distances_from_dot(K):
         A matrix with the squared distances between the elements in both datasets. It verifies
         ..math:: dists[i,j] = d(x_i, y_j)
     """
-    n, m = K.shape
-    dists = np.empty([n, m])
-    for i in xrange(n):
-        for j in xrange(m):
-            dists[i, j] = K[i, i] + K[j, j] - 2 * K[i, j]
+    K = np.asarray(K)
+    if K_x is None:
+        if K.shape[0] != K.shape[1]:
+            raise ValueError('The dot products of the elements with themselves are needed for a non-square K.')
+        K_x = np.diagonal(K)
+    K_y = K_x if K_y is None else K_y
+    dists = -2 * K
+    dists += np.asarray(K_x)[:, None]
+    dists += np.asarray(K_y)[None, :]
     return dists
 
 
-def neighbors_affinity_matrix(X, y, k):
+def class_neighbors(X, y, k):
+    """
+    Nearest neighbors of each sample among the other samples of the same class,
+    obtained with a nearest neighbor search per class, so that memory scales with N * k.
+
+    Parameters
+    ----------
+
+    X : array-like, shape (N x d)
+            Training vector, where N is the number of samples, and d is the number of features.
+
+    y : array-like, shape (N)
+        Labels vector, where N is the number of samples.
+
+    k : int
+        The number of neighbors. Each class should have more than k samples.
+
+    Returns
+    -------
+
+    neighbors : 2D-array, shape (N x k)
+        The indices of the k nearest neighbors of the same class of each sample, by increasing distance.
+
+    distances : 2D-array, shape (N x k)
+        The corresponding euclidean distances.
+    """
+    n = X.shape[0]
+    neighbors = np.empty([n, k], dtype=int)
+    distances = np.empty([n, k])
+    for c in np.unique(y):
+        inds, = np.where(y == c)
+        # Without query points, each sample is not considered its own neighbor.
+        dists, neigh_inds = NearestNeighbors(n_neighbors=k).fit(X[inds]).kneighbors()
+        neighbors[inds] = inds[neigh_inds]
+        distances[inds] = dists
+    return neighbors, distances
+
+
+def neighbors_affinity_matrix(X, y, k, sparse=False):
     """
     Neighbors affinity matrix.
 
@@ -325,43 +368,30 @@ def neighbors_affinity_matrix(X, y, k):
     k : int
         The number of neighbors to consider as nearest neighbors.
 
+    sparse : boolean, default=False
+        Whether to return the affinity matrix as a sparse CSR matrix, with N * k stored elements.
+
     Returns
     -------
 
-    A : 2D-array
+    A : 2D-array or CSR matrix
         The affinity matrix.
     """
     n = X.shape[0]
-    # neigh = KNeighborsClassifier(n_neighbors=k)
-    # neigh.fit(X, y)
-    # neigh_list = neigh.kneighbors(return_distance=False)
+    neigh_list, _ = class_neighbors(X, y, k)
+    A = csr_matrix((np.ones(n * k, dtype=int), neigh_list.ravel(), np.arange(0, n * k + 1, k)), shape=(n, n))
+    A.sort_indices()
+    return A if sparse else A.toarray()
 
-    classes = np.unique(y)
-    neigh_list = np.empty([n, k], dtype=int)
-    for c in classes:
-        inds, = np.where(y == c)
-        dists = pairwise_distances(X[inds])
 
-        np.fill_diagonal(dists, np.inf)
-        neigh_inds = np.argsort(dists)[..., :k]
-        neigh_list[inds] = inds[neigh_inds]
-
-    A = np.zeros([n, n], dtype=int)
-
-    for i in xrange(n):
-        for j in neigh_list[i]:
-            A[i, j] = 1
-
-    return A
-
-
-def local_scaling_affinity_matrix(X, y, k):
+def local_scaling_affinity_matrix(X, y, k, sparse=False):
     """
     Local scaling affinity matrix.
 
     Computes a local scaling affinity matrix A for the dataset (X, y), where
     .. math::
-        A[i, j] = exp(-\\|x_i - x_j\\|^2/\\sigma_i \\sigma_j).
+        A[i, j] = exp(-\\|x_i - x_j\\|^2/\\sigma_i \\sigma_j)
+    for all distinct samples x_i and x_j of the same class.
     The sigma values represent the local scaling of the samples around x_i, and are given by
     .. math::
         \\sigma_i = \\|x_i - x_i^{(K)}\\|,
@@ -379,42 +409,100 @@ def local_scaling_affinity_matrix(X, y, k):
     k : int
         The value for the k-th nearest neighbor to consider in the local scaling.
 
+    sparse : boolean, default=False
+        Whether to return a sparse CSR matrix, in which A[i, j] is only stored if x_j is one of the k nearest neighbors
+        of the same class of x_i, or vice versa, and is 0 otherwise. It has at most 2 * N * k stored elements.
+
     Returns
     -------
 
-    A : 2D-array
+    A : 2D-array or CSR matrix
         The affinity matrix.
     """
     n = X.shape[0]
-    # neigh = KNeighborsClassifier(n_neighbors=k)
-    # neigh.fit(X, y)
-    # neigh_list = neigh.kneighbors(return_distance=False)[:, k - 1]
-    A = np.zeros([n, n])
+    neigh_list, neigh_dists = class_neighbors(X, y, k)
+    sigma = neigh_dists[:, k - 1]
+
+    if sparse:
+        rows = np.repeat(np.arange(n), k)
+        cols = neigh_list.ravel()
+        # Symmetric: keep each neighbor pair once, in both directions.
+        pairs = np.unique(np.concatenate([np.stack([rows, cols], axis=1), np.stack([cols, rows], axis=1)]), axis=0)
+        rows, cols = pairs[:, 0], pairs[:, 1]
+        d = np.einsum('ij,ij->i', X[rows] - X[cols], X[rows] - X[cols])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.where(d == 0, 1., np.exp(-d / (sigma[rows] * sigma[cols])))
+        return csr_matrix((values, (rows, cols)), shape=(n, n))
 
-    classes = np.unique(y)
-    neigh_list = np.empty([n], dtype=int)
-    for c in classes:
+    A = np.zeros([n, n])
+    for c in np.unique(y):
         inds, = np.where(y == c)
-        dists = pairwise_distances(X[inds])
+        d = pairwise_distances(X[inds], metric='sqeuclidean')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            block = np.where(d == 0, 1., np.exp(-d / np.outer(sigma[inds], sigma[inds])))
+        np.fill_diagonal(block, 0.)
+        A[np.ix_(inds, inds)] = block
+    return A
 
-        np.fill_diagonal(dists, np.inf)
-        neigh_inds = np.argsort(dists)[..., k - 1]
-        neigh_list[inds] = inds[neigh_inds]
 
-    for i in xrange(n):
-        sigma_i = np.linalg.norm(X[i, :] - X[neigh_list[i], :])
+def expected_success(Z, y, max_memory=2**27, n_jobs=None):
+    """
+    Sum over all samples of the probability that their stochastic nearest neighbor is of the same class,
+    where each sample z_j other than z_i is chosen as neighbor of z_i with probability
+    .. math::
+        p_{ij} = \\frac{\\exp(-\\|z_i - z_j\\|)}{\\sum_{k \\neq i} \\exp(-\\|z_i - z_k\\|)}.
 
-        for j in xrange(i):
-            if y[i] == y[j]:
-                sigma_j = np.linalg.norm(X[j, :] - X[neigh_list[j], :])
-                x_ij = X[i, :] - X[j, :]
-                d_ij = np.inner(x_ij, x_ij)
-                if d_ij == 0 and (sigma_i == 0 or sigma_j == 0):
-                    A[i, j] = A[j, i] = 1
-                else:
-                    A[i, j] = A[j, i] = np.exp(- d_ij / (sigma_i * sigma_j))
+    The samples are processed in blocks of rows, with a stable log-sum-exp, so that memory does not scale with N^2.
 
-    return A
+    Parameters
+    ----------
+
+    Z : array-like, shape (N x d)
+        The (transformed) samples, where N is the number of samples, and d is the number of features.
+
+    y : array-like, shape (N)
+        Labels vector, where N is the number of samples.
+
+    max_memory : int, default=2**27
+
+        Approximate number of bytes used for the distances of each block.
+
+    n_jobs : int or None, default=None
+
+        Number of threads over which to divide the blocks. If None or 1, the blocks are processed sequentially.
+        If -1, the number of processors is used.
+
+    Returns
+    -------
+
+    success : float
+        The sum over all samples of the probability that their neighbor is of the same class.
+    """
+    n = len(y)
+    classes, codes = np.unique(y, return_inverse=True)
+    # With the samples sorted by class, the probability mass of each class is a sum over a range of columns.
+    order = np.argsort(codes, kind='stable')
+    Z = np.asarray(Z, dtype=float)[order]
+    codes = codes[order]
+    class_starts = np.searchsorted(codes, np.arange(len(classes)))
+    block_size = max(max_memory // (8 * max(n, 1)), 1)
+
+    def block_success(start):
+        stop = min(start + block_size, n)
+        rows = np.arange(stop - start)
+        dists = euclidean_distances(Z[start:stop], Z)
+        dists[rows, start + rows] = np.inf
+        dists -= dists.min(axis=1, keepdims=True)
+        np.negative(dists, out=dists)
+        np.exp(dists, out=dists)
+        class_mass = np.add.reduceat(dists, class_starts, axis=1)
+        return np.sum(class_mass[rows, codes[start:stop]] / class_mass.sum(axis=1))
+
+    starts = range(0, n, block_size)
+    if n_jobs is None or n_jobs == 1 or len(starts) == 1:
+        return float(sum(map(block_success, starts)))
+    with ThreadPoolExecutor(max_workers=os.cpu_count() if n_jobs == -1 else n_jobs) as executor:
+        return float(sum(executor.map(block_success, starts)))
 
 
 def calc_regularized_outers(X, Y=None):
@@ -499,17 +587,11 @@ def calc_regularized_outers_i(X, reg_outers, i, Y=None):
     if reg_outers is not None:
         return reg_outers[i, :]
     else:
-        n, d = X.shape
         if Y is None:
             Y = X
-        m, e = Y.shape
-        outers_i = np.empty([n, d, d], dtype=float)
-
-        Id = np.eye(d)
-
-        for j in xrange(m):
-            print(j)
-            outers_i[j] = np.outer(X[i, :] - Y[j, :], X[i, :] - Y[j, :]) + Id
+        diff = X[i, :] - Y
+        outers_i = np.einsum('ij,ik->ijk', diff, diff)
+        outers_i += np.eye(X.shape[1])
         return outers_i
 
 
@@ -6,15 +6,15 @@ Adapted from https://github.com/jlsuarezdiaz/pyDML:
 """
 
 from __future__ import print_function, absolute_import
+
 import numpy as np
 from six.moves import xrange
-from sklearn.metrics import pairwise_distances
+from sklearn.neighbors import NearestNeighbors
 from sklearn.utils.validation import check_X_y
 
 from scipy.linalg import eigh
 
 from .dml_algorithm import DML_Algorithm, KernelDML_Algorithm
-from .dml_utils import pairwise_sq_distances_from_dot
 
 
 class DMLMJ(DML_Algorithm):
@@ -39,6 +39,13 @@ class DMLMJ(DML_Algorithm):
     reg_tol : float, default=1e-10
         Tolerance threshold for applying regularization. The tolerance is compared with the matrix determinant.
 
+    warm_start : boolean, default=False
+        If True, each call to fit updates the scatter matrices of the previous call instead of recomputing them:
+        the contributions of neighbour pairs that are no longer present are subtracted, and those of new neighbour
+        pairs are added. Pairs are identified by the values of both rows, so this gives the same matrices as a
+        cold fit (up to rounding), and is cheapest when consecutive fits share most of their rows, like the folds
+        of a cross validation.
+
     References
     ----------
         Bac Nguyen, Carlos Morell and Bernard De Baets. “Supervised distance metric learning through
@@ -49,11 +56,19 @@ class DMLMJ(DML_Algorithm):
                  num_dims=None,
                  n_neighbors=3,
                  alpha=0.001,
-                 reg_tol=1e-10):
+                 reg_tol=1e-10,
+                 warm_start=False):
         self.num_dims = num_dims
         self.n_neighbors = n_neighbors
         self.alpha = alpha
         self.reg_tol = reg_tol
+        self.warm_start = warm_start
+
+        # Warm start state
+        self.pair_rows_ = None
+        self.hom_pairs_ = None
+        self.het_pairs_ = None
+        self.scatter_sums_ = None
 
         # Metadata
         self.acum_eig_ = None
@@ -111,7 +126,10 @@ class DMLMJ(DML_Algorithm):
         else:
             num_dims = min(self.num_dims, self.d_)
 
-        S, D = DMLMJ._compute_matrices(X, het_neighs, hom_neighs)
+        if self.warm_start:
+            S, D = self._update_matrices(X, het_neighs, hom_neighs)
+        else:
+            S, D = DMLMJ._compute_matrices(X, het_neighs, hom_neighs)
 
         # Regularization
         Id = np.eye(self.d_)
@@ -142,32 +160,27 @@ class DMLMJ(DML_Algorithm):
 
     @staticmethod
     def _compute_neighborhoods(X, y, k):
-        n, d = X.shape  # n = nr of samples, d = nr of features
-        het_neighs = np.empty([n, k], dtype=int)  # k = nr of elements in the neighbourhood
-        hom_neighs = np.empty([n, k], dtype=int)
-        distance_matrix = pairwise_distances(X=X, n_jobs=-1)
-        for i, x in enumerate(X):
-            cur_class = y[i]
-            mask_het = np.flatnonzero(y != cur_class)
-            mask_hom = np.concatenate([np.flatnonzero(y[:i] == cur_class), (i + 1) + np.flatnonzero(y[i + 1:] == cur_class)])
-
-            enemy_dists = [(m, distance_matrix[i, m]) for m in mask_het]
-            enemy_dists = sorted(enemy_dists, key=lambda v: v[1])
-
-
-            friend_dists = [(m, distance_matrix[i, m]) for m in mask_hom]
-            friend_dists = sorted(friend_dists, key=lambda v: v[1])
-            if len(friend_dists) < k:
-                print(friend_dists)
-
-            for j, p in enumerate(enemy_dists[:k]):
-                het_neighs[i, j] = p[0]
-
-            for j, p in enumerate(friend_dists[:k]):
-                # if p[0] > n:
-                # print(p[0])
-                hom_neighs[i, j] = p[0]
-
+        """
+        Returns the indices of the k nearest neighbors of each sample among the samples of the other classes
+        (heterogeneous) and among the other samples of its own class (homogeneous), by increasing distance,
+        obtained with a nearest neighbor search per class. If there are fewer than k such samples,
+        the remaining entries hold the sample itself, which does not contribute to the scatter matrices.
+        """
+        n = X.shape[0]
+        het_neighs = np.repeat(np.arange(n)[:, None], k, axis=1)
+        hom_neighs = het_neighs.copy()
+        for c in np.unique(y):
+            inds, = np.where(y == c)
+            out_inds, = np.where(y != c)
+            k_het = min(k, len(out_inds))
+            if k_het > 0:
+                neighs = NearestNeighbors(n_neighbors=k_het).fit(X[out_inds]).kneighbors(X[inds], return_distance=False)
+                het_neighs[inds, :k_het] = out_inds[neighs]
+            k_hom = min(k, len(inds) - 1)
+            if k_hom > 0:
+                # Without query points, each sample is not considered its own neighbor.
+                neighs = NearestNeighbors(n_neighbors=k_hom).fit(X[inds]).kneighbors(return_distance=False)
+                hom_neighs[inds, :k_hom] = inds[neighs]
         return het_neighs, hom_neighs
 
     @staticmethod
@@ -191,6 +204,73 @@ class DMLMJ(DML_Algorithm):
 
         return S, D
 
+    def _update_matrices(self, X, het_neighs, hom_neighs):
+        # Updates the unnormalised scatter matrices of the previous fit with the neighbour pairs that changed,
+        # falling back to computing them from scratch when there is no previous fit or most pairs changed.
+        n, d = X.shape
+        dsize = n * self.n_neighbors
+        rows, ids = np.unique(X, axis=0, return_inverse=True)
+        ids = ids.reshape(-1)
+        hom_pairs = DMLMJ._neighbour_pairs(ids, len(rows), hom_neighs)
+        het_pairs = DMLMJ._neighbour_pairs(ids, len(rows), het_neighs)
+
+        if self.scatter_sums_ is None or self.scatter_sums_[0].shape != (d, d):
+            changed = None
+        else:
+            # Number the distinct rows of both fits in common, so that their pairs can be compared.
+            common, common_ids = np.unique(np.concatenate([self.pair_rows_, rows]), axis=0, return_inverse=True)
+            common_ids = common_ids.reshape(-1)
+            old_ids, new_ids = common_ids[:len(self.pair_rows_)], common_ids[len(self.pair_rows_):]
+            hom_changes = DMLMJ._pairs_changes(self.hom_pairs_, hom_pairs, old_ids, new_ids, len(common))
+            het_changes = DMLMJ._pairs_changes(self.het_pairs_, het_pairs, old_ids, new_ids, len(common))
+            changed = len(hom_changes[0]) + len(het_changes[0])
+
+        if changed is None or changed >= len(hom_pairs[0]) + len(het_pairs[0]):
+            S, D = DMLMJ._compute_matrices(X, het_neighs, hom_neighs)
+            S_sum, D_sum = S * dsize, D * dsize
+        else:
+            S_sum, D_sum = self.scatter_sums_
+            S_sum = S_sum + DMLMJ._pairs_scatter(common, *hom_changes)
+            D_sum = D_sum + DMLMJ._pairs_scatter(common, *het_changes)
+
+        self.pair_rows_ = rows
+        self.hom_pairs_, self.het_pairs_ = hom_pairs, het_pairs
+        self.scatter_sums_ = (S_sum, D_sum)
+        return S_sum / dsize, D_sum / dsize
+
+    @staticmethod
+    def _neighbour_pairs(ids, n_ids, neighs):
+        # Counts the (row, neighbour) pairs of a neighbourhood matrix, as the distinct int64 keys `a * n_ids + b`,
+        # where a and b are the ids of the distinct values of both rows, and the number of times each occurs.
+        n, k = neighs.shape
+        i, j = np.repeat(np.arange(n), k), neighs.reshape(-1)
+        valid = (0 <= j) & (j < n)
+        keys = ids[i[valid]].astype(np.int64) * n_ids + ids[j[valid]]
+        return np.unique(keys, return_counts=True)
+
+    @staticmethod
+    def _pairs_changes(old_pairs, new_pairs, old_ids, new_ids, n_common):
+        # The pairs whose count differs between two results of _neighbour_pairs, as keys on the common ids
+        # and the differences of their counts (positive for added pairs, negative for removed pairs).
+        old_keys, old_counts = old_pairs
+        new_keys, new_counts = new_pairs
+        keys = np.concatenate([
+            old_ids[old_keys // len(old_ids)] * n_common + old_ids[old_keys % len(old_ids)],
+            new_ids[new_keys // len(new_ids)] * n_common + new_ids[new_keys % len(new_ids)],
+        ])
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1), weights=np.concatenate([-old_counts, new_counts]),
+                             minlength=len(keys))
+        changed = counts != 0
+        return keys[changed], counts[changed]
+
+    @staticmethod
+    def _pairs_scatter(rows, keys, counts):
+        # Sum of the outer products of the differences of pairs of rows, keyed as returned by _pairs_changes,
+        # weighted by their counts.
+        diffs = rows[keys // len(rows)] - rows[keys % len(rows)]
+        return (diffs * counts[:, None]).T.dot(diffs)
+
 
 class KDMLMJ(KernelDML_Algorithm):
     """
@@ -228,6 +308,17 @@ class KDMLMJ(KernelDML_Algorithm):
         Parameters (keyword arguments) and values for kernel passed as
         callable object. Ignored by other kernels.
 
+    kernel_approx : None | "nystroem" | "rff", default=None
+        Low-rank kernel approximation. If None, the full N x N kernel matrix is used. Otherwise an N x r feature
+        matrix from Nystroem landmarks or random Fourier features (rbf kernel only) takes its place, so that
+        memory is O(N r) instead of O(N^2), and the transformer is d' x r.
+
+    n_components : int, default=100
+        Rank r of the kernel approximation. Ignored if kernel_approx is None.
+
+    random_state : int, RandomState instance or None, default=None
+        Seed for sampling the Nystroem landmarks or the random Fourier features. Ignored if kernel_approx is None.
+
     References
     ----------
         Bac Nguyen, Carlos Morell and Bernard De Baets. “Supervised distance metric learning through
@@ -243,7 +334,10 @@ class KDMLMJ(KernelDML_Algorithm):
                  gamma=None,
                  degree=3,
                  coef0=1,
-                 kernel_params=None):
+                 kernel_params=None,
+                 kernel_approx=None,
+                 n_components=100,
+                 random_state=None):
         self.num_dims = num_dims
         self.n_neighbors = n_neighbors
         self.alpha = alpha
@@ -254,6 +348,9 @@ class KDMLMJ(KernelDML_Algorithm):
         self.degree = degree
         self.coef0 = coef0
         self.kernel_params = kernel_params
+        self.kernel_approx = kernel_approx
+        self.n_components = n_components
+        self.random_state = random_state
 
         # Metadata
         self.acum_eig_ = None
@@ -268,6 +365,7 @@ class KDMLMJ(KernelDML_Algorithm):
         A : (d'x N) matrix, where d' is the desired output dimension, and N is the number of samples.
             To apply A to a new sample x, A must be multiplied by the kernel vector of dimension N
             obtained by taking the kernels between x and each training sample.
+            If kernel_approx is set, A is (d'x r) and must be multiplied by the r low-rank kernel features of x.
         """
         return self.L_
 
@@ -304,7 +402,10 @@ class KDMLMJ(KernelDML_Algorithm):
         X, y = check_X_y(X, y)
         self.X_, self.y_ = X, y
 
-        K = self._get_kernel(X)
+        if self.kernel_approx is None:
+            K = self._get_kernel(X)
+        else:
+            K = self._fit_kernel_features(X)
 
         self.n_, self.d_ = X.shape
 
@@ -318,7 +419,7 @@ class KDMLMJ(KernelDML_Algorithm):
         U, V = DMLMJ._compute_matrices(K, het_neighs, hom_neighs)
 
         # Regularization
-        Id = np.eye(self.n_)
+        Id = np.eye(K.shape[1])
         if np.abs(np.linalg.det(U) < self.reg_tol):
             U = (1 - self.alpha) * U + self.alpha * Id
         if np.abs(np.linalg.det(V) < self.reg_tol):
@@ -343,32 +444,6 @@ class KDMLMJ(KernelDML_Algorithm):
 
         return self
 
-    @staticmethod
-    def _compute_neighborhoods(K, X, y, k):
-        n, d = X.shape
-        het_neighs = np.empty([n, k], dtype=int)
-        hom_neighs = np.empty([n, k], dtype=int)
-        distance_matrix = pairwise_sq_distances_from_dot(K)
-        for i in xrange(n):
-            cur_class = y[i]
-            mask_het = np.flatnonzero(y != cur_class)
-            mask_hom = np.concatenate([np.flatnonzero(y[:i] == cur_class),
-                                       (i + 1) + np.flatnonzero(y[i + 1:] == cur_class)])
-
-            enemy_dists = [(m, distance_matrix[i, m]) for m in mask_het]
-            enemy_dists = sorted(enemy_dists, key=lambda v: v[1])
-
-            friend_dists = [(m, distance_matrix[i, m]) for m in mask_hom]
-            friend_dists = sorted(friend_dists, key=lambda v: v[1])
-
-            for j, p in enumerate(enemy_dists[:k]):
-                het_neighs[i, j] = p[0]
-
-            for j, p in enumerate(friend_dists[:k]):
-                hom_neighs[i, j] = p[0]
-
-        return het_neighs, hom_neighs
-
     @staticmethod
     def _compute_matrices(K, het_neighs, hom_neighs):
         k = het_neighs.shape[1]
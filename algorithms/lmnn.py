@@ -8,6 +8,7 @@ from __future__ import print_function, absolute_import
 import numpy as np
 from six.moves import xrange
 from sklearn.metrics import pairwise_distances
+from sklearn.neighbors import KDTree
 from sklearn.utils.validation import check_X_y
 from sklearn.base import ClassifierMixin
 
@@ -100,6 +101,12 @@ class LMNN(DML_Algorithm, ClassifierMixin):
 
         - 'SGD' : stochastic gradient descent. It learns a linear transformer.
 
+    warm_start : boolean, default=False
+
+        If True, each call to fit starts from the metric (SDP) or linear map (SGD) learned by the previous call, instead of
+        from initial_metric. This is useful when fitting on overlapping data, like the folds of a cross validation.
+        The first fit, and any fit whose dimensions differ from the previous one, still uses initial_metric.
+
     References
     ----------
         Kilian Q Weinberger and Lawrence K Saul. “Distance metric learning for large margin nearest
@@ -120,7 +127,8 @@ class LMNN(DML_Algorithm, ClassifierMixin):
                  learn_inc=1.01,
                  learn_dec=0.5,
                  eta_thres=1e-14,
-                 solver="SDP"):
+                 solver="SDP",
+                 warm_start=False):
         self.num_dims = num_dims
         self.initial_metric = initial_metric
         self.max_iter = max_iter
@@ -137,6 +145,7 @@ class LMNN(DML_Algorithm, ClassifierMixin):
         self.learn_dec = learn_dec
         self.eta_thres = eta_thres
         self.solver = solver
+        self.warm_start = warm_start
 
         # Metadata
         self.num_its_ = None
@@ -278,14 +287,16 @@ class LMNN(DML_Algorithm, ClassifierMixin):
         else:
             self.nd_ = self.d_
 
-        self.L_ = self.initial_metric
-
-        if self.L_ is None or self.L_ == "euclidean":
+        if self.warm_start and np.shape(getattr(self, 'L_', None)) == (self.nd_, self.d_):
+            self.L_ = np.array(self.L_, dtype=float)  # Continue from the previous fit
+        elif self.initial_metric is None or isinstance(self.initial_metric, str) and self.initial_metric == "euclidean":
             self.L_ = np.zeros([self.nd_, self.d_])
             np.fill_diagonal(self.L_, 1.0)  # Euclidean distance
-        elif self.L_ == "scale":
+        elif isinstance(self.initial_metric, str) and self.initial_metric == "scale":
             self.L_ = np.zeros([self.nd_, self.d_])
             np.fill_diagonal(self.L_, 1. / (np.maximum(X.max(axis=0) - X.min(axis=0), 1e-16)))
+        else:
+            self.L_ = np.array(self.initial_metric, dtype=float)
 
         self.X_ = X
         self.y_ = y
@@ -422,14 +433,16 @@ class LMNN(DML_Algorithm, ClassifierMixin):
         else:
             self.nd_ = self.d_
 
-        self.M_ = self.initial_metric
-
-        if self.M_ is None or self.M_ == "euclidean":
+        if self.warm_start and np.shape(getattr(self, 'M_', None)) == (self.d_, self.d_):
+            self.M_ = np.array(self.M_, dtype=float)  # Continue from the previous fit
+        elif self.initial_metric is None or isinstance(self.initial_metric, str) and self.initial_metric == "euclidean":
             self.M_ = np.zeros([self.d_, self.d_])  # TODO reduce dimension with PCA in case of SDP (at the moment num_dims is ignored)
             np.fill_diagonal(self.M_, 1.0)  # Euclidean distance
-        elif self.M_ == "scale":
+        elif isinstance(self.initial_metric, str) and self.initial_metric == "scale":
             self.M_ = np.zeros([self.d_, self.d_])  # TODO reduce dimension with PCA in case of SDP
             np.fill_diagonal(self.M_, 1. / (np.maximum(X.max(axis=0) - X.min(axis=0), 1e-16)))  # Scaled eculidean distance
+        else:
+            self.M_ = np.array(self.initial_metric, dtype=float)
 
         X, y = check_X_y(X, y)
         self.X_ = X
@@ -485,26 +498,36 @@ class LMNN(DML_Algorithm, ClassifierMixin):
         return impostors
 
     def _euc_impostors(self, X, y, target_neighbors):
-        impostors = []
-        for i, yi in enumerate(y):
-            out_inds, = np.where(y != yi)
-            target_inds = target_neighbors[i, :]
-            inds = np.concatenate([target_inds, out_inds])
-            target_len = len(target_inds)
-            impostors_i = []
+        target_limit = np.sqrt(np.max(np.sum((X[:, None, :] - X[target_neighbors]) ** 2, axis=2), axis=1))
+        return self._radius_impostors(X, y, 1 + target_limit)
 
-            xi = X[i, :].reshape(1, -1)
-            dists = pairwise_distances(xi, X[inds, :])
-            target_limit = np.amax(dists[0, 0:target_len])
-            margin = (1 + target_limit)
-
-            for l in xrange(len(out_inds)):
-                ldist = dists[0, target_len + l]
-                if ldist < margin:
-                    impostors_i.append(out_inds[l])
-
-            impostors.append(impostors_i)
+    def _impostor_candidates(self, Lkx, y, target_neighbors):
+        """
+        Returns, for each data index, the indexes of the data of other classes that are impostors
+        in the projection Lkx, or that are less than half a margin away from becoming one.
+        The projection changes during an epoch, so the candidates are checked again before they are used.
+        """
+        margin = 1 + np.max(np.sum((Lkx[:, None, :] - Lkx[target_neighbors]) ** 2, axis=2), axis=1)
+        return self._radius_impostors(Lkx, y, 1.5 * np.sqrt(margin))
 
+    @staticmethod
+    def _radius_impostors(X, y, radii):
+        """
+        Returns, for each data index i, the sorted indexes of the data of other classes closer than radii[i] to X[i],
+        searched with a KD-tree for each class, so that the cost grows with the number of impostors
+        rather than with the square of the amount of data.
+        """
+        impostors = [None] * len(y)
+        for label in np.unique(y):
+            inds, = np.where(y == label)
+            out_inds, = np.where(y != label)
+            if len(out_inds) == 0:
+                for i in inds:
+                    impostors[i] = out_inds
+                continue
+            found, dists = KDTree(X[out_inds]).query_radius(X[inds], r=radii[inds], return_distance=True)
+            for i, f, d in zip(inds, found, dists):
+                impostors[i] = out_inds[np.sort(f[d < radii[i]])]
         return impostors
 
     def _pairwise_metric_distances(self, xi, X, M):
@@ -697,6 +720,21 @@ class KLMNN(KernelDML_Algorithm):
 
         - 'original' : using the euclidean distance in the original space.
 
+    kernel_approx : None | "nystroem" | "rff", default=None
+
+        Low-rank kernel approximation. If None, the full N x N kernel matrix is used. Otherwise an N x r feature
+        matrix from Nystroem landmarks or random Fourier features (rbf kernel only) takes its place, so that
+        memory is O(N r) instead of O(N^2), and the transformer is d' x r. Impostors are then only checked among
+        candidates that are found with a KD-tree in the projected space at the start of each epoch.
+
+    n_components : int, default=100
+
+        Rank r of the kernel approximation. Ignored if kernel_approx is None.
+
+    random_state : int, RandomState instance or None, default=None
+
+        Seed for sampling the Nystroem landmarks or the random Fourier features. Ignored if kernel_approx is None.
+
     References
     ----------
         Kilian Q Weinberger and Lawrence K Saul. “Distance metric learning for large margin nearest
@@ -723,7 +761,10 @@ class KLMNN(KernelDML_Algorithm):
                  degree=3,
                  coef0=1,
                  kernel_params=None,
-                 target_selection="kernel"):
+                 target_selection="kernel",
+                 kernel_approx=None,
+                 n_components=100,
+                 random_state=None):
 
         self.num_dims = num_dims
         self.initial_metric = initial_metric
@@ -747,6 +788,9 @@ class KLMNN(KernelDML_Algorithm):
         self.degree = degree
         self.coef0 = coef0
         self.kernel_params = kernel_params
+        self.kernel_approx = kernel_approx
+        self.n_components = n_components
+        self.random_state = random_state
 
         # Metadata
         self.num_its_ = None
@@ -762,6 +806,7 @@ class KLMNN(KernelDML_Algorithm):
         A : (d'x N) matrix, where d' is the desired output dimension, and N is the number of samples.
             To apply A to a new sample x, A must be multiplied by the kernel vector of dimension N
             obtained by taking the kernels between x and each training sample.
+            If kernel_approx is set, A is (d'x r) and must be multiplied by the r low-rank kernel features of x.
         """
         return self.L_
 
@@ -806,7 +851,13 @@ class KLMNN(KernelDML_Algorithm):
         n, d = X.shape
         self.n_, self.d_ = n, d
 
-        K = self._get_kernel(X)
+        # With a low-rank approximation, K holds the (n x r) kernel features instead of the (n x n) kernel matrix
+        low_rank = self.kernel_approx is not None
+        if low_rank:
+            K = self._fit_kernel_features(X)
+        else:
+            K = self._get_kernel(X)
+        m = K.shape[1]
 
         if self.num_dims is not None:
             self.nd_ = min(self.d_, self.num_dims)
@@ -815,12 +866,14 @@ class KLMNN(KernelDML_Algorithm):
 
         self.L_ = self.initial_metric
 
-        if self.L_ is None or self.L_ == "euclidean":
-            self.L_ = np.zeros([self.nd_, self.n_])
+        if self.L_ is None or isinstance(self.L_, str) and self.L_ == "euclidean":
+            self.L_ = np.zeros([self.nd_, m])
             np.fill_diagonal(self.L_, 1.0)  # Euclidean distance
-        elif self.L_ == "scale":
-            self.L_ = np.zeros([self.nd_, self.n_])
+        elif isinstance(self.L_, str) and self.L_ == "scale":
+            self.L_ = np.zeros([self.nd_, m])
             np.fill_diagonal(self.L_, 1. / (np.maximum(X.max(axis=0) - X.min(axis=0), 1e-16)))
+        else:
+            self.L_ = np.array(self.L_, dtype=float)
 
         self.X_ = X
         self.y_ = y
@@ -832,6 +885,8 @@ class KLMNN(KernelDML_Algorithm):
         # outers = calc_outers(X)
         if self.target_selection == "original":
             target_neighbors = self._target_neighbors(X, y)
+        elif self.target_selection == "kernel" and low_rank:
+            target_neighbors = self._target_neighbors(K, y)
         elif self.target_selection == "kernel":
             target_neighbors = self._kernel_target_neighbors(X, y, K)
         else:
@@ -847,27 +902,39 @@ class KLMNN(KernelDML_Algorithm):
         stop = False
 
         while not stop:
+            if low_rank:
+                # Active set of impostor candidates for this epoch, searched in the projected space
+                candidates = self._impostor_candidates(Lkx, y, target_neighbors)
             rnd = np.random.permutation(len(y))
             for i in rnd:
-                non_imp_grad = np.zeros([n, n])
-                imp_grad = np.zeros([n, n])
+                non_imp_grad = np.zeros([m, m])
+                imp_grad = np.zeros([m, m])
+                out_inds = candidates[i] if low_rank else np.flatnonzero(y != y[i])
+                out_dists = np.sum((Lkx[i] - Lkx[out_inds]) ** 2, axis=1)
 
                 for j in target_neighbors[i]:
                     lxij = Lkx[i] - Lkx[j]
                     margin = 1 + np.inner(lxij, lxij)
                     kij = K[i, :] - K[j, :]
-                    Eij = np.zeros([n, n])
-                    Eij[:, i] = kij
-                    Eij[:, j] = -kij
+                    if low_rank:
+                        Eij = np.outer(kij, kij)
+                    else:
+                        Eij = np.zeros([n, n])
+                        Eij[:, i] = kij
+                        Eij[:, j] = -kij
                     non_imp_grad += Eij
 
-                    for l, yl in enumerate(y):
-                        if y[i] != yl and margin > np.inner(Lkx[i] - Lkx[l], Lkx[i] - Lkx[l]):
-                            kil = K[i, :] - K[l, :]
-                            Eil = np.zeros([n, n])
-                            Eil[:, i] = kil
-                            Eil[:, l] = -kil
-                            imp_grad += (Eij - Eil)
+                    imp_inds = out_inds[margin > out_dists]
+                    if len(imp_inds) == 0:
+                        continue
+                    kil = K[i, :] - K[imp_inds, :]
+                    if low_rank:
+                        Eil = kil.T.dot(kil)
+                    else:
+                        Eil = np.zeros([n, n])
+                        Eil[:, i] = kil.sum(axis=0)
+                        Eil[:, imp_inds] = -kil.T
+                    imp_grad += len(imp_inds) * Eij - Eil
 
                 grad = (1 - self.mu) * non_imp_grad + self.mu * imp_grad
                 grad = 2 * L.dot(grad)
@@ -945,40 +1012,47 @@ class KLMNN(KernelDML_Algorithm):
         return target_neighbors
 
     def _euc_impostors(self, X, y, target_neighbors):
-        impostors = []
-        for i, yi in enumerate(y):
-            out_inds, = np.where(y != yi)
-            target_inds = target_neighbors[i, :]
-            inds = np.concatenate([target_inds, out_inds])
-            target_len = len(target_inds)
-            impostors_i = []
+        target_limit = np.sqrt(np.max(np.sum((X[:, None, :] - X[target_neighbors]) ** 2, axis=2), axis=1))
+        return self._radius_impostors(X, y, 1 + target_limit)
 
-            xi = X[i, :].reshape(1, -1)
-            dists = pairwise_distances(xi, X[inds, :])
-            target_limit = np.amax(dists[0, 0:target_len])
-            margin = (1 + target_limit)
-
-            for l in xrange(len(out_inds)):
-                ldist = dists[0, target_len + l]
-                if ldist < margin:
-                    impostors_i.append(out_inds[l])
-
-            impostors.append(impostors_i)
+    def _impostor_candidates(self, Lkx, y, target_neighbors):
+        """
+        Returns, for each data index, the indexes of the data of other classes that are impostors
+        in the projection Lkx, or that are less than half a margin away from becoming one.
+        The projection changes during an epoch, so the candidates are checked again before they are used.
+        """
+        margin = 1 + np.max(np.sum((Lkx[:, None, :] - Lkx[target_neighbors]) ** 2, axis=2), axis=1)
+        return self._radius_impostors(Lkx, y, 1.5 * np.sqrt(margin))
 
+    @staticmethod
+    def _radius_impostors(X, y, radii):
+        """
+        Returns, for each data index i, the sorted indexes of the data of other classes closer than radii[i] to X[i],
+        searched with a KD-tree for each class, so that the cost grows with the number of impostors
+        rather than with the square of the amount of data.
+        """
+        impostors = [None] * len(y)
+        for label in np.unique(y):
+            inds, = np.where(y == label)
+            out_inds, = np.where(y != label)
+            if len(out_inds) == 0:
+                for i in inds:
+                    impostors[i] = out_inds
+                continue
+            found, dists = KDTree(X[out_inds]).query_radius(X[inds], r=radii[inds], return_distance=True)
+            for i, f, d in zip(inds, found, dists):
+                impostors[i] = out_inds[np.sort(f[d < radii[i]])]
         return impostors
 
     def _compute_euc_error(self, mu, X, y, target_neighbors, impostors):
-        n, d = X.shape
-        non_imposter_err = 0.0
-        imposter_err = 0.0
-        for i in xrange(n):
-            for j in target_neighbors[i, :]:
-                xij = X[i, :] - X[j, :]
-                non_imposter_err += np.linalg.norm(xij)
-                for l in impostors[i]:
-                    i_err = (1 + np.inner(xij, xij) - np.inner(X[i, :] - X[l, :], X[i, :] - X[l, :]))
-                    if(i_err > 0):
-                        imposter_err += i_err
+        target_sq_dists = np.sum((X[:, None, :] - X[target_neighbors]) ** 2, axis=2)
+        non_imposter_err = np.sum(np.sqrt(target_sq_dists))
+
+        # All (i, l) pairs of data and their impostors, compared with each target neighbor of i
+        inds = np.repeat(np.arange(len(impostors)), [len(imp) for imp in impostors])
+        imp_inds = np.concatenate([np.asarray(imp, dtype=int) for imp in impostors]) if len(impostors) else np.empty(0, dtype=int)
+        imp_sq_dists = np.sum((X[inds] - X[imp_inds]) ** 2, axis=1)
+        imposter_err = np.sum(np.maximum(1 + target_sq_dists[inds] - imp_sq_dists[:, None], 0))
 
         return (1 - mu) * non_imposter_err + mu * imposter_err
 
@@ -8,9 +8,8 @@ from __future__ import absolute_import
 import numpy as np
 from six.moves import xrange
 from sklearn.utils.validation import check_X_y
-from sklearn.metrics.pairwise import euclidean_distances
 
-from .dml_utils import calc_outers, calc_outers_i
+from .dml_utils import calc_outers, calc_outers_i, expected_success
 from .dml_algorithm import DML_Algorithm
 
 
@@ -81,6 +80,21 @@ class NCA(DML_Algorithm):
 
         Decrease factor for learning rate. Ignored if learning_rate is not 'adaptive'.
 
+    warm_start : boolean, default=False
+
+        If True, each call to fit starts gradient descent from the transform learned by the previous call, instead of
+        from initial_transform. This is useful when fitting on overlapping data, like the folds of a cross validation.
+        The first fit, and any fit whose dimensions differ from the previous one, still uses initial_transform.
+
+    max_memory : int, default=2**27
+
+        Approximate number of bytes of distances held at once when computing the expected success,
+        which is done by blocks of samples.
+
+    n_jobs : int or None, default=None
+
+        Number of threads used to compute the expected success. If -1, the number of processors is used.
+
     References
     ----------
         Jacob Goldberger et al. “Neighbourhood components analysis”. In: Advances in neural
@@ -99,7 +113,10 @@ class NCA(DML_Algorithm):
                  descent_method="SGD",
                  eta_thres=1e-14,
                  learn_inc=1.01,
-                 learn_dec=0.5):
+                 learn_dec=0.5,
+                 warm_start=False,
+                 max_memory=2**27,
+                 n_jobs=None):
         self.num_dims = num_dims
         self.initial_transform = initial_transform
         self.max_iter = max_iter
@@ -112,6 +129,9 @@ class NCA(DML_Algorithm):
         self.eta_thres = eta_thres
         self.learn_inc = learn_inc
         self.learn_dec = learn_dec
+        self.warm_start = warm_start
+        self.max_memory = max_memory
+        self.n_jobs = n_jobs
 
         # Metadata initialization
         self.num_its_ = None
@@ -168,27 +188,30 @@ class NCA(DML_Algorithm):
         else:
             self.nd_ = self.d_
 
-        self.L_ = self.initial_transform
         self.eta = self.eta0
         X, y = check_X_y(X, y)
         self.X_ = X
         self.y_ = y
 
-        if self.L_ is None or self.L_ == "euclidean":
+        if self.warm_start and np.shape(getattr(self, 'L_', None)) == (self.nd_, self.d_):
+            self.L_ = np.array(self.L_, dtype=float)  # Continue from the previous fit
+        elif self.initial_transform is None or isinstance(self.initial_transform, str) and self.initial_transform == "euclidean":
             self.L_ = np.zeros([self.nd_, self.d_])
             np.fill_diagonal(self.L_, 1.0)  # Euclidean distance
-        elif self.L_ == "scale":
+        elif isinstance(self.initial_transform, str) and self.initial_transform == "scale":
             self.L_ = np.zeros([self.nd_, self.d_])
             np.fill_diagonal(self.L_, 1. / (np.maximum(X.max(axis=0) - X.min(axis=0), 1e-16)))  # Scaled eculidean distance
+        else:
+            self.L_ = np.array(self.initial_transform, dtype=float)
 
-        self.initial_softmax_ = self._compute_expected_success(self.L_, X, y) / len(y)
+        self.initial_softmax_ = self._compute_expected_success(self.L_, X, y, self.max_memory, self.n_jobs) / len(y)
 
         if self.descent_method == "SGD":  # Stochastic Gradient Descent
             self._SGD_fit(X, y)
         elif self.descent_method == "BGD":  # Batch Gradient Descent
             self._BGD_fit(X, y)
 
-        self.final_softmax_ = self._compute_expected_success(self.L_, X, y) / len(y)
+        self.final_softmax_ = self._compute_expected_success(self.L_, X, y, self.max_memory, self.n_jobs) / len(y)
         return self
 
     def _SGD_fit(self, X, y):
@@ -287,7 +310,7 @@ class NCA(DML_Algorithm):
                 grad = 2 * L.dot(grad)
                 L += eta * grad
 
-            succ = self._compute_expected_success(L, X, y, class_split_inds)
+            succ = self._compute_expected_success(L, X, y, self.max_memory, self.n_jobs)
             # print(succ / len(y))
 
             if adaptive:
@@ -423,37 +446,6 @@ class NCA(DML_Algorithm):
         return X, y, outers
 
     @staticmethod
-    def _compute_expected_success(L, X, y, class_split_inds=None):
-        n, d = X.shape
-        Lx = L.dot(X.T).T # todo not sure about this
-        success = 0.0
-        # cdef int i, j, i_max
-        # cdef np.ndarray softmax, Lxi, dists, dists_i, yi_mask, Lxij
-        # cdef float c, pw, p_i
-        dists = euclidean_distances(Lx)
-        for i in range(len(y)):
-            softmax = np.empty([n], dtype=float)
-            Lxi = Lx[i]
-            # Ldiff = Lxi - Lx
-            dists_i = -dists[i, :]  # -np.diag(Ldiff.dot(Ldiff.T))  # TODO improve efficiency of dists_i
-            dists_i[i] = -np.inf
-            i_max = np.argmax(dists_i)
-            c = dists_i[i_max]          # TODO all distances can reach -inf
-            for j in xrange(n):
-                if j != i:
-                    if j == i_max:
-                        softmax[j] = 1
-                    else:
-                        pw = min(0, dists_i[j] - c)
-                        softmax[j] = np.exp(pw)
-            softmax[i] = 0
-
-            softmax /= softmax.sum()
-
-            # Calc p_i
-            yi_mask = np.where(y == y[i])[0] if class_split_inds is None else class_split_inds[y[i]]
-            p_i = softmax[yi_mask].sum()
-
-            success += p_i
-
-        return success
+    def _compute_expected_success(L, X, y, max_memory=2**27, n_jobs=None):
+        Lx = X.dot(L.T)
+        return expected_success(Lx, y, max_memory, n_jobs)
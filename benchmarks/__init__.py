@@ -0,0 +1,18 @@
+"""
+Performance benchmarks for fuzzy-rough-learn.
+
+Measures the construction and query throughput and the peak memory use of the algorithms in `frlearn`
+and of the distance measures in `relations`, on synthetic datasets of increasing size,
+and compares them against stored baselines. Run with::
+
+    python -m benchmarks --profile quick --compare benchmarks/baselines/quick.json
+
+The `scaling` profile increases the number of instances and features. Its baseline,
+`benchmarks/baselines/scaling.json`, only covers the `frlearn` cases, since the `relations` cases
+are truncated to 500 instances and are already covered by the `quick` profile::
+
+    python -m benchmarks --profile scaling --cases '^(?!relations\\.)' --compare benchmarks/baselines/scaling.json
+
+Use `--save` to store the results of a run as a new baseline. Timings depend on the machine,
+so baselines should be recorded on the machine on which they are compared.
+"""
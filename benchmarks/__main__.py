@@ -0,0 +1,159 @@
+"""
+Run the benchmarks from the command line, store the results and compare them against a baseline.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import platform
+import re
+import sys
+import time
+import traceback
+import tracemalloc
+
+import numpy as np
+
+from .suite import PROFILES, get_cases, make_dataset, truncate
+
+
+def measure(setup, dataset, repeat: int) -> dict:
+    """
+    Median wall time over `repeat` runs of construction and of querying,
+    and peak memory over a separate run with `tracemalloc`, which would otherwise inflate the wall times.
+    """
+    construct, query = setup(dataset)
+    construct_times, query_times = [], []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        model = construct()
+        construct_times.append(time.perf_counter() - start)
+        if query is not None:
+            start = time.perf_counter()
+            query(model)
+            query_times.append(time.perf_counter() - start)
+        del model
+
+    gc.collect()
+    tracemalloc.start()
+    model = construct()
+    construct_peak = tracemalloc.get_traced_memory()[1]
+    if query is not None:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        query(model)
+        query_peak = tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    construct_time = float(np.median(construct_times))
+    result = {
+        'construct_time': construct_time,
+        'construct_throughput': len(dataset.X) / construct_time,
+        'construct_peak_bytes': construct_peak,
+    }
+    if query is not None:
+        query_time = float(np.median(query_times))
+        result.update({
+            'query_time': query_time,
+            'query_throughput': len(dataset.X_query) / query_time,
+            'query_peak_bytes': query_peak,
+        })
+    return result
+
+
+def run(profile: str, pattern: str, repeat: int, verbose: bool = True) -> dict:
+    results = {}
+    cases = [case for case in get_cases() if re.search(pattern, case.name)]
+    for n, m, n_classes in PROFILES[profile]:
+        dataset = make_dataset(n, m, n_classes)
+        for case in cases:
+            data = dataset if case.max_n is None else truncate(dataset, case.max_n)
+            key = f'{case.name}[{data.name}]'
+            if key in results:
+                continue
+            try:
+                results[key] = measure(case.setup, data, repeat)
+            except Exception as e:
+                results[key] = {'error': f'{type(e).__name__}: {e}'}
+                if verbose:
+                    traceback.print_exc()
+            if verbose:
+                print(format_result(key, results[key]), flush=True)
+    return results
+
+
+def format_result(key: str, result: dict) -> str:
+    if 'error' in result:
+        return f'{key:<70} ERROR {result["error"]}'
+    line = f'{key:<70} construct {result["construct_time"]:>9.4f}s {result["construct_peak_bytes"] / 2**20:>8.1f}MiB'
+    if 'query_time' in result:
+        line += f'  query {result["query_time"]:>9.4f}s {result["query_peak_bytes"] / 2**20:>8.1f}MiB'
+    return line
+
+
+def compare(results: dict, baseline: dict, time_tolerance: float, memory_tolerance: float) -> list[str]:
+    """
+    Descriptions of the results that are slower than `time_tolerance` times their baseline (plus 5 ms),
+    use more than `memory_tolerance` times the baseline peak memory (plus 1 MiB), or fail where the baseline did not.
+    The absolute margins keep timer noise and small allocations of the fastest cases from being reported.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        if 'error' in result:
+            if 'error' not in reference:
+                regressions.append(f'{key}: {result["error"]}')
+            continue
+        if 'error' in reference:
+            continue
+        for stage in ['construct', 'query']:
+            if f'{stage}_time' not in result:
+                continue
+            ratio = result[f'{stage}_time'] / reference[f'{stage}_time']
+            if result[f'{stage}_time'] > time_tolerance * reference[f'{stage}_time'] + 0.005:
+                regressions.append(f'{key}: {stage} time {ratio:.2f} times baseline')
+            peak, reference_peak = result[f'{stage}_peak_bytes'], reference[f'{stage}_peak_bytes']
+            if peak > memory_tolerance * reference_peak + 2**20:
+                regressions.append(f'{key}: {stage} peak memory {peak / 2**20:.1f}MiB, baseline {reference_peak / 2**20:.1f}MiB')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='quick', help='datasets to run on')
+    parser.add_argument('--cases', default='', help='regular expression that selects cases by name')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs, of which the median counts')
+    parser.add_argument('--save', metavar='PATH', help='store the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare the results against a baseline')
+    parser.add_argument('--time-tolerance', type=float, default=1.5, help='allowed ratio of time to baseline time')
+    parser.add_argument('--memory-tolerance', type=float, default=1.2, help='allowed ratio of peak memory to baseline')
+    args = parser.parse_args(argv)
+
+    results = run(args.profile, args.cases, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'profile': args.profile,
+                'repeat': args.repeat,
+                'machine': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform()},
+                'results': results,
+            }, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            return 1
+        print(f'No regressions against {args.compare}.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
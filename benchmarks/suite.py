@@ -0,0 +1,148 @@
+"""
+Benchmark cases and synthetic datasets.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, NamedTuple
+
+import numpy as np
+from sklearn.datasets import make_classification
+
+
+class Dataset(NamedTuple):
+    name: str
+    X: np.array
+    y: np.array
+    Y: np.array
+    y_reg: np.array
+    X_query: np.array
+
+
+class Case(NamedTuple):
+    name: str
+    # Function that takes a dataset and returns the construction function and the query function.
+    # The query function takes the result of the construction function, and is None if there is no query.
+    setup: Callable[[Dataset], tuple[Callable, Callable | None]]
+    # Largest number of construction and query instances, for cases that scale badly.
+    # Larger datasets are truncated to this size.
+    max_n: int | None = None
+
+
+# Number of instances, number of features, number of classes.
+PROFILES = {
+    'quick': [(300, 10, 2), (300, 10, 4), ],
+    'scaling': [(1000, 10, 2), (4000, 10, 2), (4000, 50, 2), ],
+    'full': [(1000, 10, 2), (4000, 10, 2), (4000, 50, 2), (4000, 10, 10), (16000, 20, 5), ],
+}
+
+
+def make_dataset(n: int, m: int, n_classes: int, n_query: int = 1000, random_state: int = 0) -> Dataset:
+    """
+    Synthetic classification dataset with `n` construction and `n_query` query instances,
+    `m` features and `n_classes` classes, together with multilabel and regression targets.
+    """
+    n_query = min(n_query, n)
+    X, y = make_classification(
+        n_samples=n + n_query, n_features=m, n_informative=min(m, 8), n_redundant=0,
+        n_classes=n_classes, n_clusters_per_class=1, random_state=random_state,
+    )
+    rng = np.random.default_rng(random_state)
+    X_query, X, y = X[n:], X[:n], y[:n]
+    # Each instance has its own class as a label, and each other class with small probability.
+    Y = (np.arange(n_classes) == y[:, None]) | (rng.random((n, n_classes)) < 0.1)
+    y_reg = X[:, 0] - 2 * X[:, 1] + rng.normal(scale=0.1, size=n)
+    return Dataset(f'n={n},m={m},c={n_classes}', X, y, Y.astype(int), y_reg, X_query)
+
+
+def truncate(dataset: Dataset, n: int) -> Dataset:
+    """The first `n` construction and query instances of `dataset`."""
+    m, n_classes = dataset.X.shape[1], dataset.Y.shape[1]
+    return dataset._replace(
+        name=f'n={min(n, len(dataset.X))},m={m},c={n_classes}',
+        **{field: getattr(dataset, field)[:n] for field in ['X', 'y', 'Y', 'y_reg', 'X_query']},
+    )
+
+
+def _frlearn_cases() -> list[Case]:
+    from frlearn import classifiers, data_descriptors, regressors
+    from frlearn.feature_preprocessors import FRFS
+    from frlearn.instance_preprocessors import FRPS
+
+    cases = [
+        Case('classifiers.FRNN', lambda d: (lambda: classifiers.FRNN()(d.X, d.y), lambda model: model(d.X_query))),
+        Case('classifiers.FROVOCO', lambda d: (lambda: classifiers.FROVOCO()(d.X, d.y), lambda model: model(d.X_query))),
+        Case('classifiers.FRONEC', lambda d: (lambda: classifiers.FRONEC()(d.X, d.Y), lambda model: model(d.X_query))),
+        Case('regressors.FRNN', lambda d: (lambda: regressors.FRNN()(d.X, d.y_reg), lambda model: model(d.X_query))),
+        # FRFS holds the pairwise feature relations of all training instances, of size n * n * m.
+        Case('feature_preprocessors.FRFS', lambda d: (lambda: FRFS()(d.X, d.y), lambda model: model(d.X_query)), max_n=1000),
+        # FRPS evaluates each candidate threshold on all training instances, which takes cubic time.
+        Case('instance_preprocessors.FRPS', lambda d: (lambda: FRPS()(d.X, d.y), None), max_n=1000),
+    ]
+    for name in data_descriptors.__all__:
+        cls = getattr(data_descriptors, name)
+        cases.append(Case(
+            f'data_descriptors.{name}',
+            lambda d, cls=cls: (lambda: cls()(d.X), lambda model: model(d.X_query)),
+        ))
+    # Approximate mode of SVM, to compare against the exact mode above.
+    cases.append(Case(
+        'data_descriptors.SVM(approximation=nystroem)',
+        lambda d: (lambda: data_descriptors.SVM(approximation='nystroem', random_state=0)(d.X), lambda model: model(d.X_query)),
+    ))
+    return cases
+
+
+def _relations_cases() -> list[Case]:
+    from frlearn.classifiers import FRNN
+    from frlearn.neighbour_search_methods import BallTree
+    from relations import distances, kernels, mahalanobis
+
+    factories = [
+        (distances.ManhattanDistanceFactory, {}),
+        (distances.EuclideanDistanceFactory, {}),
+        (distances.ChebyshevDistanceFactory, {}),
+        (distances.CorrelationFactory, {'euclidean_search': True}),
+        (distances.CosineMeasureFactory, {'euclidean_search': True}),
+        (distances.CanberraFactory, {}),
+        (distances.COMBOFactory, {'folds': 2}),
+        (mahalanobis.MahalanobisCorrelationDistanceFactory, {}),
+        (mahalanobis.ClassMahalanobisDistanceFactory, {}),
+        (mahalanobis.NCAFactory, {}),
+        (mahalanobis.LMNNFactory, {'k': 3}),
+        (mahalanobis.DMLMJFactory, {'n_neighbors': 3}),
+        (kernels.GaussianKernelFactory, {}),
+        (kernels.ExponentialKernelFactory, {}),
+        (kernels.RationalQuadraticKernelFactory, {}),
+        (kernels.CircularKernelFactory, {}),
+        (kernels.SphericalKernelFactory, {}),
+        (kernels.GaussianGradientKernelFactory, {}),
+        (kernels.ExponentialGradientKernelFactory, {}),
+        (kernels.RationalGradientKernelFactory, {}),
+        (kernels.CircularGradientKernelFactory, {}),
+        (kernels.SphericalGradientKernelFactory, {}),
+    ]
+
+    def setup(d, factory_cls, kwargs):
+        # As in `relations.experiment_help.compare_measures`: fit the measure, then construct and query FRNN with it.
+        def construct():
+            factory = factory_cls(**kwargs)
+            factory.fit(d.X, d.y)
+            clf = FRNN(preprocessors=(), nn_search=BallTree(), dissimilarity=factory.get_metric(), lower_k=3, upper_k=3)
+            return clf(d.X, d.y)
+        return construct, lambda model: model(d.X_query)
+
+    # Most measures are Python callables that are evaluated for each pair of instances.
+    return [
+        Case(
+            f'relations.{factory_cls.__name__}',
+            lambda d, factory_cls=factory_cls, kwargs=kwargs: setup(d, factory_cls, kwargs),
+            max_n=500,
+        )
+        for factory_cls, kwargs in factories
+    ]
+
+
+def get_cases() -> list[Case]:
+    """All benchmark cases, for the algorithms in `frlearn` and the distance measures in `relations`."""
+    return _frlearn_cases() + _relations_cases()
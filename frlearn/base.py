@@ -2,14 +2,301 @@
 
 from __future__ import annotations
 
+import os
+import pickle
+import threading
+import time
+import tracemalloc
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import wraps
 from inspect import signature
+from typing import Callable
 
 import numpy as np
 
 from sklearn.base import BaseEstimator, ClassifierMixin
 
 
+_precision = None
+
+
+def get_precision():
+    """
+    Get the floating point precision in which models are constructed and queried.
+
+    Returns
+    -------
+    precision : np.dtype or None
+        Either `np.float32` or `np.float64`, or None if data is used in the precision in which it is passed.
+    """
+    return _precision
+
+
+def set_precision(precision):
+    """
+    Set the floating point precision in which models are constructed and queried.
+
+    With `np.float32`, construction and query data are converted to single precision before preprocessing,
+    and kept in single precision through the nearest neighbour searches (with `np.int32` indices)
+    and the aggregation of the scores. This halves memory use and bandwidth.
+    Models remember the precision in which they were constructed, and use it when they are queried.
+    Algorithms that wrap other libraries compute internally in the precision of those libraries.
+    The results of the scikit-learn neighbour searches are converted,
+    those of `SVM`, `IF` and `EIF` are not.
+
+    Parameters
+    ----------
+    precision : dtype-like or None
+        Either `np.float32` or `np.float64`, or None (the default), in which case data is not converted.
+    """
+    global _precision
+    if precision is not None:
+        precision = np.dtype(precision)
+        if precision not in (np.float32, np.float64):
+            raise ValueError(f'Precision should be float32 or float64, got {precision}.')
+    _precision = precision
+
+
+@contextmanager
+def using_precision(precision):
+    """
+    Context manager that sets the floating point precision with `set_precision`,
+    and restores the previous precision on exit.
+
+    Parameters
+    ----------
+    precision : dtype-like or None
+        Either `np.float32` or `np.float64`, or None.
+    """
+    previous = get_precision()
+    set_precision(precision)
+    try:
+        yield
+    finally:
+        set_precision(previous)
+
+
+def index_dtype(dtype, n: int):
+    """
+    Integer dtype for indices into `n` instances that accompany values of the floating point `dtype`:
+    `np.int32` for single precision if `n` permits, `np.intp` otherwise.
+    """
+    return np.int32 if dtype == np.float32 and n < 2**31 else np.intp
+
+
+class Stage:
+    """
+    Statistics of a stage of the construction or querying of models, recorded by `instrument`.
+    Stages that are called from within a stage are recorded as its children,
+    and are aggregated over all calls with the same name within the same parent stage.
+
+    Attributes
+    ----------
+    name : str
+        Name of the stage, e.g. `'construct FRNN'` or `'query FRNN.Model'`.
+
+    calls : int
+        Number of calls.
+
+    time : float
+        Total wall time in seconds.
+
+    bytes : int
+        Largest amount of memory allocated during a single call, in bytes, on top of what was allocated at its start.
+        Only recorded if `memory` is True.
+
+    shapes : list of tuples
+        Distinct shapes of the data the stage was called with.
+
+    children : dict of str -> Stage
+        Stages called from within this stage.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.time = 0.
+        self.bytes = 0
+        self.shapes = []
+        self.children = {}
+
+    @property
+    def self_time(self) -> float:
+        """Wall time in seconds not spent in child stages."""
+        return self.time - sum(child.time for child in self.children.values())
+
+    def to_dict(self) -> dict:
+        """
+        Nested report of this stage and its children, as a dict with keys
+        `'name'`, `'calls'`, `'time'`, `'self_time'`, `'bytes'`, `'shapes'` and `'children'`,
+        the latter a list of such dicts.
+        """
+        return {
+            'name': self.name, 'calls': self.calls, 'time': self.time, 'self_time': self.self_time,
+            'bytes': self.bytes, 'shapes': list(self.shapes),
+            'children': [child.to_dict() for child in self.children.values()],
+        }
+
+    def __str__(self):
+        lines = []
+
+        def add(stage, depth):
+            shapes = ', '.join('x'.join(map(str, shape)) for shape in stage.shapes[:3])
+            if len(stage.shapes) > 3:
+                shapes += ', ...'
+            lines.append(
+                f'{"  " * depth + stage.name:<60} {stage.calls:>7} {stage.time:>10.4f} {stage.self_time:>10.4f} '
+                f'{stage.bytes / 2**20:>10.1f}  {shapes}'
+            )
+            for child in stage.children.values():
+                add(child, depth + 1)
+
+        lines.append(f'{"stage":<60} {"calls":>7} {"time (s)":>10} {"self (s)":>10} {"peak (MiB)":>10}  shapes')
+        for child in self.children.values():
+            add(child, 0)
+        return '\n'.join(lines)
+
+
+class _Frame:
+
+    __slots__ = ('stage', 'key', 'start', 'start_bytes', 'peak_bytes')
+
+    def __init__(self, stage, key, start, start_bytes):
+        self.stage = stage
+        self.key = key
+        self.start = start
+        self.start_bytes = self.peak_bytes = start_bytes
+
+
+class _Recorder:
+
+    def __init__(self, memory: bool, callback):
+        self.memory = memory
+        self.callback = callback
+        self.root = Stage('total')
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def stack(self):
+        # Threads started from within a stage, e.g. by `parallel_map`, record their stages at the top level.
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = [_Frame(self.root, None, 0., 0)]
+        return stack
+
+    def enter(self, name, key, X):
+        stack = self.stack()
+        if key is not None and stack[-1].key == key:
+            # Call of an overridden method through `super()`, which is part of the same stage.
+            return None
+        with self.lock:
+            stage = stack[-1].stage.children.get(name)
+            if stage is None:
+                stage = stack[-1].stage.children[name] = Stage(name)
+            shape = getattr(X, 'shape', None)
+            if shape is not None and shape not in stage.shapes:
+                stage.shapes.append(shape)
+        current = 0
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stack[-1].peak_bytes = max(stack[-1].peak_bytes, peak)
+            tracemalloc.reset_peak()
+        stack.append(_Frame(stage, key, time.perf_counter(), current))
+        return stack
+
+    def exit(self, stack):
+        frame = stack.pop()
+        elapsed = time.perf_counter() - frame.start
+        allocated = 0
+        if self.memory:
+            peak = max(frame.peak_bytes, tracemalloc.get_traced_memory()[1])
+            allocated = peak - frame.start_bytes
+            stack[-1].peak_bytes = max(stack[-1].peak_bytes, peak)
+        stage = frame.stage
+        with self.lock:
+            stage.calls += 1
+            stage.time += elapsed
+            stage.bytes = max(stage.bytes, allocated)
+        if self.callback is not None:
+            self.callback(tuple(f.stage.name for f in stack[1:]) + (stage.name, ), elapsed, allocated)
+
+
+_recorder = None
+
+
+@contextmanager
+def instrument(memory: bool = True, callback: Callable[[tuple, float, int], None] | None = None):
+    """
+    Context manager that records the wall time, allocated memory, data shapes and number of calls
+    of each stage of the construction and querying of models within its scope,
+    and yields a `Stage` that collects these as its children.
+    Stages are the calls of algorithms (construct), of models (query) and of their preprocessing models,
+    including those of the neighbour search methods and other models that algorithms use internally.
+    Time spent in a stage but not in its children, like the aggregation of neighbour distances,
+    is reported as its self time.
+    Outside of this context, instrumentation costs a single check per call.
+
+    Parameters
+    ----------
+    memory : bool = True
+        Whether to record allocated memory, with `tracemalloc`.
+        This slows down the allocation of Python objects, but not the computations of numpy.
+        With multithreaded construction or querying (`n_jobs`), allocations by concurrent stages are not separated.
+
+    callback : ((tuple of str, float, int) -> None) or None = None
+        Function that is called at the end of each call of a stage with the names of the enclosing stages
+        and of the stage itself, the wall time in seconds and the allocated memory in bytes,
+        e.g. to forward measurements to a monitoring system.
+
+    Yields
+    ------
+    report : Stage
+        Root of the recorded stages. Can be exported with `to_dict` or printed as a table.
+    """
+    global _recorder
+    if _recorder is not None:
+        raise RuntimeError('Instrumentation is already enabled.')
+    _recorder = _Recorder(memory, callback)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        yield _recorder.root
+    finally:
+        _recorder = None
+        if started:
+            tracemalloc.stop()
+
+
+def _instrumented(phase: str):
+    # Decorator that records calls of a method of a `SoftMachine` or a `SoftMachine.Model` as a stage.
+    def decorator(f):
+        @wraps(f)
+        def wrapper(self, *args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return f(self, *args, **kwargs)
+            X = args[0] if args else kwargs.get('X')
+            stack = recorder.enter(f'{phase} {type(self).__qualname__}', (id(self), phase), X)
+            if stack is None:
+                return f(self, *args, **kwargs)
+            try:
+                return f(self, *args, **kwargs)
+            finally:
+                recorder.exit(stack)
+        wrapper._instrumented = True
+        return wrapper
+    return decorator
+
+
+def _instrument_call(cls, phase: str):
+    # Instrument `__call__` where a subclass overrides it, so that every algorithm and model is covered.
+    f = cls.__dict__.get('__call__')
+    if f is not None and not getattr(f, '_instrumented', False):
+        cls.__call__ = _instrumented(phase)(f)
+
+
 class SoftMachine(ABC):
     """
     Abstract base class for machine learning algorithms.
@@ -21,8 +308,16 @@ class SoftMachine(ABC):
     def __init__(self, preprocessors=()):
         self.preprocessors = preprocessors
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _instrument_call(cls, 'construct')
+
     @abstractmethod
+    @_instrumented('construct')
     def __call__(self, X, **kwargs) -> SoftMachine.Model:
+        dtype = get_precision()
+        if dtype is not None:
+            X = np.asarray(X, dtype=dtype)
         preprocessing_models = []
         for preprocessor in self.preprocessors:
             extra_kwargs = {k: v for k, v in kwargs.items() if k in signature(preprocessor.__call__).parameters}
@@ -30,7 +325,7 @@ class SoftMachine(ABC):
             X = preprocessing_model(X)
             preprocessing_models.append(preprocessing_model)
         model = self._construct(X, **kwargs)
-        model.preprocessing_models = preprocessing_models
+        model.preprocessing_models = fuse_preprocessing_models(preprocessing_models)
         return model
 
     @property
@@ -41,6 +336,7 @@ class SoftMachine(ABC):
     def _construct(self, X, **kwargs) -> SoftMachine.Model:
         model = self.Model.__new__(self.Model)
         model.n, model.m = model.shape = X.shape
+        model.dtype = get_precision()
         return model
 
     class Model(ABC):
@@ -49,23 +345,157 @@ class SoftMachine(ABC):
         m: int
         shape: tuple[int, ...]
         preprocessing_models: list
+        dtype: np.dtype or None
+
+        def __init_subclass__(cls, **kwargs):
+            super().__init_subclass__(**kwargs)
+            _instrument_call(cls, 'query')
 
         def __len__(self):
             return self.n
 
         @abstractmethod
+        @_instrumented('query')
         def __call__(self, X, *args, **kwargs):
-            for preprocessing_model in self.preprocessing_models:
-                X = preprocessing_model(X)
+            X = self._preprocess(X)
+            return self._query_preprocessed(X, *args, **kwargs)
+
+        @_instrumented('query')
+        def _query_batch(self, X, buffers: dict, *args, **kwargs):
+            # Query a batch of `query_batched`, like `__call__`, with preprocessing buffers that are reused between batches.
+            X = self._preprocess(X, buffers)
+            return self._query_preprocessed(X, *args, **kwargs)
+
+        def _preprocess(self, X, buffers: dict | None = None):
+            # Query data in the precision of the model, transformed by the preprocessing models.
+            # If `buffers` is given, affine preprocessing models write into a buffer in it, by their position,
+            # which is allocated if it does not yet exist or is too small.
+            if getattr(self, 'dtype', None) is not None:
+                X = np.asarray(X, dtype=self.dtype)
+            for i, preprocessing_model in enumerate(self.preprocessing_models):
+                affine = getattr(preprocessing_model, '_affine', lambda: None)() if buffers is not None else None
+                if affine is None or getattr(preprocessing_model, 'preprocessing_models', ()):
+                    X = preprocessing_model(X)
+                    continue
+                if getattr(preprocessing_model, 'dtype', None) is not None:
+                    X = np.asarray(X, dtype=preprocessing_model.dtype)
+                dtype, n_features = _affine_output(X, preprocessing_model.m, *affine)
+                buffer = buffers.get(i)
+                if buffer is None or buffer.dtype != dtype or buffer.shape[1] != n_features or len(buffer) < len(X):
+                    buffer = buffers[i] = np.empty((len(X), n_features), dtype=dtype)
+                X = preprocessing_model(X, out=buffer[:len(X)])
+            return X
+
+        def _query_preprocessed(self, X, *args, **kwargs):
+            # Query with data that has already been preprocessed.
+            # Models that do more than `_query` when queried can override this rather than `__call__`.
             return self._query(X, *args, **kwargs)
 
         @abstractmethod
         def _query(self, X, *args, **kwargs):
             pass
 
+        def query_batches(self, X, *args, batch_size: int | None = None, max_memory: int | None = None, **kwargs):
+            """
+            Query the model with consecutive batches of the rows of `X`, and yield the result for each batch.
+            Working memory is bounded by the batch size rather than by the size of `X`,
+            which may for instance be a `np.memmap` that does not fit in memory.
+
+            Parameters
+            ----------
+            X : array shape=(q, m, )
+                Query instances.
+
+            batch_size : int or None = None
+                Number of query instances per batch.
+
+            max_memory : int or None = None
+                Memory budget in bytes, from which the batch size is derived if `batch_size` is None,
+                using the per-instance estimate of `_query_row_bytes`.
+                If both are None, `X` is queried in a single batch.
+
+            All other positional and keyword arguments are passed on with each query.
+
+            Yields
+            ------
+            result
+                Query result for each batch of `X`, in order.
+            """
+            batch_size = self._batch_size(len(X), batch_size, max_memory)
+            for i in range(0, len(X), batch_size):
+                yield self(X[i:i + batch_size], *args, **kwargs)
+
+        def query_batched(self, X, *args, batch_size: int | None = None, max_memory: int | None = None, out=None, **kwargs):
+            """
+            Query the model with consecutive batches of the rows of `X`, like `query_batches`,
+            and write the results into a single preallocated output.
+            Preprocessing models that are affine transformations (see `fuse_preprocessing_models`)
+            write each batch into a buffer that is allocated once and reused for all batches.
+            Other intermediate arrays are allocated by the model for each batch.
+
+            Parameters
+            ----------
+            X : array shape=(q, m, )
+                Query instances.
+
+            batch_size : int or None = None
+                Number of query instances per batch.
+
+            max_memory : int or None = None
+                Memory budget in bytes, from which the batch size is derived if `batch_size` is None.
+
+            out : array or tuple of arrays or None = None
+                Output to write the results into, with the same structure as the result of querying the model,
+                e.g. a `np.memmap`. If None, output arrays are allocated when the first batch has been queried.
+
+            All other positional and keyword arguments are passed on with each query.
+
+            Returns
+            -------
+            result
+                Query result for `X`, equal to that of querying the model with `X` in one go.
+            """
+            if len(X) == 0:
+                return self(X, *args, **kwargs)
+            is_tuple = isinstance(out, tuple)
+            out = out if out is None or is_tuple else (out, )
+            batch_size = self._batch_size(len(X), batch_size, max_memory)
+            buffers = {}
+            for i in range(0, len(X), batch_size):
+                result = self._query_batch(X[i:i + batch_size], buffers, *args, **kwargs)
+                if out is None:
+                    is_tuple = isinstance(result, tuple)
+                    arrays = result if is_tuple else (result, )
+                    out = tuple(np.empty((len(X), *a.shape[1:]), dtype=a.dtype) for a in arrays)
+                arrays = result if is_tuple else (result, )
+                for o, a in zip(out, arrays):
+                    o[i:i + len(a)] = a
+            return out if is_tuple else out[0]
+
+        def _batch_size(self, q: int, batch_size: int | None, max_memory: int | None) -> int:
+            if batch_size is None:
+                if max_memory is None:
+                    return max(q, 1)
+                batch_size = max_memory // self._query_row_bytes()
+            return max(int(batch_size), 1)
+
+        def _query_row_bytes(self) -> int:
+            """
+            Estimate of the memory needed to query a single instance, used to derive batch sizes from a memory budget.
+            The default assumes a copy of the instance for each preprocessing model,
+            and an intermediate row of values for each construction instance (e.g. distances),
+            in the precision of the model.
+            Models with substantially different memory requirements can override this.
+            """
+            itemsize = np.dtype(getattr(self, 'dtype', None) or np.float64).itemsize
+            return itemsize * (self.m * (1 + len(getattr(self, 'preprocessing_models', ()))) + self.n)
+
 
 class Unsupervised(SoftMachine):
 
+    # Whether `_construct_streaming` is implemented.
+    _streaming = False
+
     def __call__(self, X) -> Unsupervised.Model:
         return super().__call__(X, )
 
@@ -73,10 +503,109 @@ class Unsupervised(SoftMachine):
         model = super()._construct(X)
         return model
 
+    def construct_streaming(self, X, chunk_size: int = 2**16) -> Unsupervised.Model:
+        """
+        Construct the model from construction data that is processed in chunks of rows,
+        so that it does not have to fit in memory. This is supported by machines that can summarise their construction data
+        with mergeable statistics, like the statistical normalisers and data descriptors, if their preprocessors can too.
+        Machines that approximate quantiles document their error bounds.
+
+        Parameters
+        ----------
+        X : array shape=(n, m, ) or iterable of arrays or (() -> iterable of arrays)
+            Construction instances: an array, e.g. a `np.memmap`, that is read in chunks of `chunk_size` rows,
+            or an iterable of chunks, or a function that returns a new iterable of chunks with each call.
+            The chunks are read once for each preprocessor and once for the machine itself.
+            An iterator can only be read once, so it can only be used if there are no preprocessors.
+
+        chunk_size : int = 2**16
+            Number of rows per chunk, if `X` is an array.
+
+        Returns
+        -------
+        M: Model
+            Constructed model.
+
+        Raises
+        ------
+        NotImplementedError
+            If the machine or one of its preprocessors does not support construction from chunks.
+        ValueError
+            If `X` is an iterator that has to be read more than once.
+        """
+        chunks = X if isinstance(X, _Chunks) else _Chunks(X, chunk_size)
+        preprocessing_models = []
+        for preprocessor in self.preprocessors:
+            if not isinstance(preprocessor, Unsupervised):
+                raise NotImplementedError(f'{type(preprocessor).__name__} cannot be constructed from chunks.')
+            preprocessing_model = preprocessor.construct_streaming(chunks)
+            chunks = _Chunks(chunks, chunk_size, transform=preprocessing_model)
+            preprocessing_models.append(preprocessing_model)
+        if not self._streaming:
+            raise NotImplementedError(f'{type(self).__name__} cannot be constructed from chunks.')
+        model = self._construct_streaming(chunks)
+        model.preprocessing_models = fuse_preprocessing_models(preprocessing_models)
+        return model
+
+    def _construct_streaming(self, chunks: _Chunks) -> Unsupervised.Model:
+        """
+        Construct the model from `chunks` of preprocessed construction data.
+        Subclasses that set `_streaming` override this, summarise the chunks, and then call this,
+        which creates the model once the shape of the construction data is known.
+        """
+        if chunks.shape is None:
+            for _ in chunks:
+                pass
+        model = self.Model.__new__(self.Model)
+        model.n, model.m = model.shape = chunks.shape
+        model.dtype = get_precision()
+        return model
+
     class Model(SoftMachine.Model):
         pass
 
 
+class _Chunks:
+    """
+    Construction data as a sequence of chunks of rows that can be read repeatedly,
+    in the precision set with `set_precision`, and optionally transformed by a preprocessing model.
+    `shape` is the shape of the data, once it has been read completely.
+    """
+
+    def __init__(self, X, chunk_size: int, transform: Callable[[np.array], np.array] | None = None):
+        self.X = X
+        self.chunk_size = chunk_size
+        self.transform = transform
+        self.shape = (len(X), X.shape[1]) if hasattr(X, 'shape') and transform is None else None
+        self._read = False
+
+    def _source(self):
+        X = self.X
+        if isinstance(X, _Chunks) or not hasattr(X, 'shape'):
+            if callable(X) and not isinstance(X, _Chunks):
+                return iter(X())
+            chunks = iter(X)
+            if chunks is X:
+                if self._read:
+                    raise ValueError('Chunks from an iterator can only be read once; use an array, '
+                                     'a list of chunks, or a function that returns an iterable of chunks instead.')
+                self._read = True
+            return chunks
+        return (X[i:i + self.chunk_size] for i in range(0, len(X), self.chunk_size))
+
+    def __iter__(self):
+        dtype = get_precision()
+        n, m = 0, None
+        for chunk in self._source():
+            chunk = np.asarray(chunk, dtype=dtype)
+            if self.transform is not None:
+                chunk = self.transform(chunk)
+            n, m = n + len(chunk), chunk.shape[1]
+            yield chunk
+        if m is not None:
+            self.shape = (n, m)
+
+
 class ClassSupervised(SoftMachine):
 
     def __call__(self, X, y) -> ClassSupervised.Model:
@@ -167,13 +696,37 @@ class FeaturePreprocessor(SoftMachine):
 
     class Model(SoftMachine.Model):
 
-        def __call__(self, X):
-            return super().__call__(X)
+        def __call__(self, X, out=None):
+            """
+            Transform `X`.
+
+            Parameters
+            ----------
+            X : array shape=(q, m, )
+                Instances to transform.
+
+            out : array shape=(q, m_out, ) or None = None
+                Array to write the result into, for models that are affine transformations (see `_affine`).
+                If None, a new array is allocated.
+            """
+            if out is None:
+                return super().__call__(X)
+            X = self._preprocess(X)
+            return _apply_affine(X, *self._affine(), out=out)
 
         @property
         def transform(self):
             return self.__call__
 
+        def _affine(self):
+            """
+            Description of the transformation as a selection of features followed by an affine transformation,
+            `(X[:, selection] - subtrahend)/divisor`, as a tuple `(selection, subtrahend, divisor)`,
+            or None if the transformation is not of this form.
+            The selection can be None, and the subtrahend and divisor scalars.
+            """
+            return None
+
 
 class FeatureSelector(FeaturePreprocessor):
 
@@ -184,6 +737,132 @@ class FeatureSelector(FeaturePreprocessor):
         def _query(self, X):
             return X[:, self.selection]
 
+        def _affine(self):
+            return self.selection, 0, 1
+
+
+class AffinePreprocessor(FeaturePreprocessor.Model):
+    """
+    Preprocessing model that composes consecutive preprocessing models
+    that select features and transform them affinely.
+    Rather than being constructed by a preprocessor, it is obtained with `fuse_preprocessing_models`.
+    """
+
+    models: list
+    selection: np.array or None
+    subtrahend: np.array
+    divisor: np.array
+
+    def __call__(self, X, out=None):
+        """
+        Transform `X`.
+
+        Parameters
+        ----------
+        X : array shape=(q, m, )
+            Instances to transform.
+
+        out : array shape=(q, m_out, ) or None = None
+            Array to write the result into. If None, a new array is allocated.
+            Only this array is written to, without any further intermediate arrays.
+        """
+        X = self._preprocess(X)
+        return self._query(X, out=out)
+
+    def _query(self, X, out=None):
+        return _apply_affine(X, self.selection, self.subtrahend, self.divisor, out=out)
+
+    def _affine(self):
+        return self.selection, self.subtrahend, self.divisor
+
+
+def _affine_output(X, m: int, selection, subtrahend, divisor) -> tuple[np.dtype, int]:
+    # dtype and number of features of `(X[:, selection] - subtrahend)/divisor`
+    dtype = np.result_type(X, subtrahend, divisor)
+    if not np.issubdtype(dtype, np.inexact):
+        dtype = np.float64
+    if selection is None:
+        return dtype, m
+    return dtype, int(np.count_nonzero(selection)) if np.asarray(selection).dtype == bool else len(selection)
+
+
+def _apply_affine(X, selection, subtrahend, divisor, out=None):
+    # `(X[:, selection] - subtrahend)/divisor`, written into `out` without any further intermediate arrays
+    if out is None:
+        dtype, n_features = _affine_output(X, X.shape[1], selection, subtrahend, divisor)
+        out = np.empty((len(X), n_features), dtype=dtype)
+    if selection is None:
+        np.subtract(X, subtrahend, out=out)
+    else:
+        if np.asarray(selection).dtype == bool:
+            selection = np.flatnonzero(selection)
+        np.take(X, selection, axis=1, out=out)
+        np.subtract(out, subtrahend, out=out)
+    return np.divide(out, divisor, out=out)
+
+
+def fuse_preprocessing_models(models: list) -> list:
+    """
+    Replace each run of two or more consecutive preprocessing models that describe themselves
+    as a selection of features followed by an affine transformation with a single `AffinePreprocessor`.
+    This avoids the allocation of an intermediate array for each model when data is transformed.
+    The fused models can be found in the `models` attribute of the `AffinePreprocessor`.
+    Its parameters are in the precision of those of the fused models.
+
+    Parameters
+    ----------
+    models : list
+        Preprocessing models, in the order in which they are applied.
+
+    Returns
+    -------
+    models : list
+        Preprocessing models with the same effect.
+    """
+    fused = []
+    run = []
+    for model in list(models) + [None]:
+        affine = getattr(model, '_affine', lambda: None)() if model is not None else None
+        if affine is not None and not getattr(model, 'preprocessing_models', ()):
+            run.append((model, affine))
+            continue
+        if len(run) == 1:
+            fused.append(run[0][0])
+        elif len(run) > 1:
+            fused.append(_fuse_affine(run))
+        run = []
+        if model is not None:
+            fused.append(model)
+    return fused
+
+
+def _fuse_affine(run: list) -> AffinePreprocessor:
+    # `((X[:, s] - a)/b)[:, t] = (X[:, s[t]] - a[t])/b[t]` and `((X - a)/b - c)/d = (X - (a + c*b))/(b*d)`.
+    first = run[0][0]
+    selection, subtrahend, divisor = None, np.zeros(first.m), np.ones(first.m)
+    for _, (s, a, b) in run:
+        if s is not None:
+            s = np.flatnonzero(s) if np.asarray(s).dtype == bool else np.asarray(s)
+            selection = s if selection is None else selection[s]
+            subtrahend, divisor = subtrahend[s], divisor[s]
+        subtrahend = subtrahend + a * divisor
+        divisor = divisor * b
+    model = AffinePreprocessor.__new__(AffinePreprocessor)
+    model.n, model.m = model.shape = first.shape
+    model.dtype = first.dtype
+    model.preprocessing_models = []
+    model.models = [m for m, _ in run]
+    model.selection = selection
+    # Keep the precision of the parameters of the fused models, which may differ from that of the model.
+    dtypes = [
+        p.dtype for _, (_, a, b) in run for p in (a, b)
+        if isinstance(p, np.ndarray) and np.issubdtype(p.dtype, np.inexact)
+    ]
+    dtype = np.result_type(*dtypes) if dtypes else first.dtype
+    model.subtrahend = subtrahend if dtype is None else subtrahend.astype(dtype)
+    model.divisor = divisor if dtype is None else divisor.astype(dtype)
+    return model
+
 
 class SupervisedInstancePreprocessor(ABC):
 
@@ -269,6 +948,96 @@ def probabilities_from_scores(scores):
     return scores/np.sum(scores, axis=1, keepdims=True)
 
 
+class _ArrayPickler(pickle.Pickler):
+    # Writes large arrays to separate `.npy` files, and pickles references to them instead.
+
+    def __init__(self, file, path: str, min_array_bytes: int):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.path = path
+        self.min_array_bytes = min_array_bytes
+        # Arrays are kept alive while pickling, so that their ids identify them.
+        self.arrays = {}
+
+    def persistent_id(self, obj):
+        if type(obj) not in (np.ndarray, np.memmap) or obj.dtype.hasobject or obj.nbytes < self.min_array_bytes:
+            return None
+        if id(obj) not in self.arrays:
+            self.arrays[id(obj)] = (len(self.arrays), obj)
+            np.save(os.path.join(self.path, f'{len(self.arrays) - 1}.npy'), obj, allow_pickle=False)
+        return 'ndarray', self.arrays[id(obj)][0]
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, path: str, mmap_mode: str | None):
+        super().__init__(file)
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.arrays = {}
+
+    def persistent_load(self, pid):
+        kind, i = pid
+        if kind != 'ndarray':
+            raise pickle.UnpicklingError(f'Unsupported persistent id {pid}.')
+        if i not in self.arrays:
+            array = np.load(os.path.join(self.path, f'{i}.npy'), mmap_mode=self.mmap_mode, allow_pickle=False)
+            # A plain array view of the memory map, so that results computed from it are plain arrays.
+            self.arrays[i] = array.view(np.ndarray) if isinstance(array, np.memmap) else array
+        return self.arrays[i]
+
+
+def save_model(model: SoftMachine.Model, path: str, min_array_bytes: int = 2**16):
+    """
+    Save a constructed model to a directory, from which it can be loaded with `load_model`.
+
+    Arrays of at least `min_array_bytes` anywhere in the model, including its preprocessing models,
+    nearest neighbour search models and their index structures, are written as separate `.npy` files,
+    which store their data as an aligned raw buffer. Everything else is pickled into `model.pickle`.
+    Arrays that are shared by different parts of the model are written once.
+
+    Parameters
+    ----------
+    model : SoftMachine.Model
+        Constructed model.
+
+    path : str
+        Directory to save the model in. Created if it does not exist.
+
+    min_array_bytes : int = 2**16
+        Minimum size in bytes of the arrays that are written as separate files.
+    """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'model.pickle'), 'wb') as f:
+        _ArrayPickler(f, path, min_array_bytes).dump(model)
+
+
+def load_model(path: str, mmap_mode: str | None = 'r') -> SoftMachine.Model:
+    """
+    Load a model saved with `save_model`.
+
+    With memory mapping, arrays are not read when the model is loaded,
+    but paged in from disk as they are used. Processes that load the same model share these pages,
+    so that loading is fast and does not duplicate memory use.
+
+    Parameters
+    ----------
+    path : str
+        Directory in which the model was saved.
+
+    mmap_mode : str or None = 'r'
+        Memory-map mode for the arrays stored as separate files, as in `np.load`.
+        With the default `'r'`, the arrays of the model are read-only.
+        `'c'` gives writeable copy-on-write arrays, while None reads the arrays into memory.
+
+    Returns
+    -------
+    model : SoftMachine.Model
+        The loaded model.
+    """
+    with open(os.path.join(path, 'model.pickle'), 'rb') as f:
+        return _ArrayUnpickler(f, path, mmap_mode).load()
+
+
 class FitPredictClassifier(BaseEstimator, ClassifierMixin, ):
     """
     Convenience class for using any classifier as a scikit-learn-style classifier with fit and predict methods.
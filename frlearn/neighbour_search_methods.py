@@ -2,6 +2,10 @@
 Nearest neighbour search methods in fuzzy-rough-learn.
 """
 
-from .neighbours.neighbour_search_methods import NeighbourSearchMethod, BallTree, KDTree
+from .neighbours.neighbour_search_methods import NeighbourSearchMethod, BallTree, BruteForce, KDTree, RPForest, \
+    DistanceCache, NeighbourGraphCache, PrecomputedDissimilarity, pairwise_dissimilarities
 
-__all__ = ['NeighbourSearchMethod', 'BallTree', 'KDTree', ]
+__all__ = [
+    'NeighbourSearchMethod', 'BallTree', 'BruteForce', 'KDTree', 'RPForest',
+    'DistanceCache', 'NeighbourGraphCache', 'PrecomputedDissimilarity', 'pairwise_dissimilarities',
+]
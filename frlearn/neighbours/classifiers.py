@@ -8,7 +8,7 @@ import numpy as np
 from frlearn.base import DataDescriptor, MultiClassClassifier, MultiLabelClassifier
 from frlearn.data_descriptors import NND
 from frlearn.neighbour_search_methods import NeighbourSearchMethod, KDTree
-from frlearn.neighbours.utilities import resolve_k
+from frlearn.neighbours.utilities import parallel_map, resolve_k
 from frlearn.statistics.feature_preprocessors import RangeNormaliser
 from frlearn.array_functions import div_or, soft_max, soft_min
 from frlearn.parametrisations import at_most, multiple
@@ -22,32 +22,120 @@ class FuzzyRoughEnsemble(MultiClassClassifier):
             self,
             upper_approximator: DataDescriptor | None,
             lower_approximator: DataDescriptor | None,
-            preprocessors=()
+            preprocessors=(),
+            n_jobs: int | None = None,
+            updatable: bool = False,
     ):
         super().__init__(preprocessors=preprocessors)
         self.upper_approximator = upper_approximator
         self.lower_approximator = lower_approximator
+        self.n_jobs = n_jobs
+        self.updatable = updatable
 
     def _construct(self, X, y) -> Model:
         model: FuzzyRoughEnsemble.Model = super()._construct(X, y)
-        Cs = [X[np.where(y == c)] for c in model.classes]
-        model.upper_approximations = self.upper_approximator and [self.upper_approximator(C) for C in Cs]
-        co_Cs = [X[np.where(y != c)] for c in model.classes]
-        model.lower_approximations = self.lower_approximator and [self.lower_approximator(co_C) for co_C in co_Cs]
+        model.n_jobs = self.n_jobs
+        # The class labels of the training instances are only needed to update the model.
+        model.y = y if self.updatable else None
+        jobs = []
+        if self.upper_approximator:
+            jobs += [(self.upper_approximator, X[np.where(y == c)]) for c in model.classes]
+        if self.lower_approximator:
+            jobs += [(self.lower_approximator, X[np.where(y != c)]) for c in model.classes]
+        approximations = parallel_map(lambda job: job[0](job[1]), jobs, self.n_jobs)
+        model.upper_approximations = self.upper_approximator and approximations[:model.n_classes]
+        model.lower_approximations = self.lower_approximator and approximations[-model.n_classes:]
         return model
 
     class Model(MultiClassClassifier.Model):
 
         upper_approximations: List[DataDescriptor.Model] | None
         lower_approximations: List[DataDescriptor.Model] | None
+        n_jobs: int | None
+        y: np.array | None
+
+        def insert(self, X, y):
+            """
+            Insert training instances into the model,
+            by inserting them into the approximations of their own class and the complements of the other classes.
+            The preprocessing models are not updated.
+
+            Parameters
+            ----------
+            X: array shape=(q, m, )
+                Training instances to insert.
+
+            y: array shape=(q, )
+                Class labels of the training instances to insert. Should be classes of the model.
+
+            Raises
+            ------
+            ValueError
+                If the model was not constructed with `updatable=True`.
+            """
+            self._check_updatable()
+            if not np.all(np.isin(y, self.classes)):
+                raise ValueError('Instances can only be inserted for the classes of the model.')
+            X = self._preprocess(X)
+            jobs = []
+            for i, c in enumerate(self.classes):
+                if self.upper_approximations and np.any(y == c):
+                    jobs.append((self.upper_approximations[i].insert, X[y == c]))
+                if self.lower_approximations and np.any(y != c):
+                    jobs.append((self.lower_approximations[i].insert, X[y != c]))
+            parallel_map(lambda job: job[0](job[1]), jobs, self.n_jobs)
+            self.y = np.concatenate([self.y, y])
+            self.n = len(self.y)
+            self.shape = (self.n, self.m)
+
+        def delete(self, indices):
+            """
+            Delete training instances from the model, by deleting them from the affected approximations.
+            The indices of the remaining instances are decreased accordingly, as with `np.delete`.
+
+            Parameters
+            ----------
+            indices: int or array of ints or array of bools
+                Indices of the training instances to delete.
+
+            Raises
+            ------
+            ValueError
+                If the model was not constructed with `updatable=True`.
+            """
+            self._check_updatable()
+            deleted = np.zeros(self.n, dtype=bool)
+            deleted[indices] = True
+            jobs = []
+            for i, c in enumerate(self.classes):
+                if self.upper_approximations and np.any(deleted[self.y == c]):
+                    jobs.append((self.upper_approximations[i].delete, deleted[self.y == c]))
+                if self.lower_approximations and np.any(deleted[self.y != c]):
+                    jobs.append((self.lower_approximations[i].delete, deleted[self.y != c]))
+            parallel_map(lambda job: job[0](job[1]), jobs, self.n_jobs)
+            self.y = self.y[~deleted]
+            self.n = len(self.y)
+            self.shape = (self.n, self.m)
+
+        def _check_updatable(self):
+            if self.y is None:
+                raise ValueError('Model can only be updated if it was constructed with `updatable=True`.')
 
         def _query(self, X):
             vals = []
-            if self.upper_approximations:
-                vals.append(np.stack([approximation(X) for approximation in self.upper_approximations], axis=1))
+            jobs = []
+            for approximations in [self.upper_approximations, self.lower_approximations]:
+                if approximations:
+                    vals.append(np.empty((len(X), self.n_classes), dtype=self.dtype or np.float64))
+                    jobs += [(vals[-1], i, approximation) for i, approximation in enumerate(approximations)]
+
+            def query(job):
+                out, i, approximation = job
+                out[:, i] = approximation(X)
+
+            parallel_map(query, jobs, self.n_jobs)
             if self.lower_approximations:
-                vals.append(
-                    1 - np.stack([approximation(X) for approximation in self.lower_approximations], axis=1))
+                vals[-1] = 1 - vals[-1]
             if len(vals) == 2:
                 return sum(vals) / 2
             return vals[0]
@@ -107,6 +195,14 @@ class FRNN(FuzzyRoughEnsemble):
     preprocessors : iterable = (RangeNormaliser(), )
         Preprocessors to apply. The default range normaliser ensures that all features have range 1.
 
+    n_jobs : int or None = None
+        Number of threads with which to construct and query the per-class approximations.
+        If None, they are processed sequentially. If -1, the number of processors is used.
+
+    updatable : bool = False
+        Whether models keep the class labels of the training instances,
+        which they need in order to support `insert` and `delete`.
+
     Notes
     -----
     If `upper_weights = lower_weights = None` and `upper_k = lower_k = 1`,
@@ -142,7 +238,9 @@ class FRNN(FuzzyRoughEnsemble):
             lower_k: int or Callable[[int], float] or None = at_most(20),
             dissimilarity: str or float or Callable[[np.array], float] or Callable[[np.array, np.array], float] = 'boscovich',
             nn_search: NeighbourSearchMethod = KDTree(),
-            preprocessors=(RangeNormaliser(), )
+            preprocessors=(RangeNormaliser(), ),
+            n_jobs: int | None = None,
+            updatable: bool = False,
     ):
         dissimilarity = resolve_dissimilarity(dissimilarity, scale_by_dimensionality=True)
         upper_approximator = upper_k != 0 and NND(
@@ -151,7 +249,7 @@ class FRNN(FuzzyRoughEnsemble):
         lower_approximator = lower_k != 0 and NND(
             weights=lower_weights, k=lower_k, proximity=truncated_complement, dissimilarity=dissimilarity, nn_search=nn_search, preprocessors=()
         )
-        super().__init__(upper_approximator, lower_approximator, preprocessors=preprocessors, )
+        super().__init__(upper_approximator, lower_approximator, preprocessors=preprocessors, n_jobs=n_jobs, updatable=updatable, )
 
     def _construct(self, X, y) -> Model:
         model = super()._construct(X, y)
@@ -225,6 +323,10 @@ class FROVOCO(MultiClassClassifier):
     preprocessors : iterable = (RangeNormaliser(), )
         Preprocessors to apply. The default range normaliser ensures that all features have range 1.
 
+    n_jobs : int or None = None
+        Number of threads with which to construct and query the per-class approximations.
+        If None, they are processed sequentially. If -1, the number of processors is used.
+
     Notes
     -----
     The original proposal uses full length exponential weight vectors,
@@ -258,11 +360,13 @@ class FROVOCO(MultiClassClassifier):
             ir_threshold: float or None = 9,
             dissimilarity: str or float or Callable[[np.array], float] or Callable[[np.array, np.array], float] = 'boscovich',
             nn_search: NeighbourSearchMethod = KDTree(),
-            preprocessors=(RangeNormaliser(), )
+            preprocessors=(RangeNormaliser(), ),
+            n_jobs: int | None = None,
     ):
         super().__init__(preprocessors=preprocessors)
         dissimilarity = resolve_dissimilarity(dissimilarity, scale_by_dimensionality=True)
         self.ir_threshold = ir_threshold if ir_threshold is not None else np.inf
+        self.n_jobs = n_jobs
         self.balanced_approximator = NND(
             dissimilarity=dissimilarity, k=balanced_k, weights=balanced_weights, proximity=truncated_complement,
             nn_search=nn_search, preprocessors=()
@@ -275,6 +379,7 @@ class FROVOCO(MultiClassClassifier):
     def _construct(self, X, y) -> Model:
         model: FROVOCO.Model = super()._construct(X, y)
         model.ir_threshold = self.ir_threshold
+        model.n_jobs = self.n_jobs
 
         Cs = [X[np.where(y == c)] for c in model.classes]
         co_Cs = [X[np.where(y != c)] for c in model.classes]
@@ -284,18 +389,23 @@ class FROVOCO(MultiClassClassifier):
         model.ovr_ir = np.array([c_n / (len(X) - c_n) for c_n in class_sizes])
         max_ir = np.max(model.ovo_ir, axis=1)
 
-        model.imb_approxs = [
-            self.imbalanced_approximator(C) if ir > self.ir_threshold else None for ir, C in zip(max_ir, Cs)
-        ]
-        model.bal_approxs = [
-            self.balanced_approximator(C) if ir <= self.ir_threshold else None for ir, C in zip(model.ovr_ir, Cs)
-        ]
-        model.co_approxs = [
-            (self.imbalanced_approximator if 1 / ir > self.ir_threshold else self.balanced_approximator)(co_C)
-            for ir, co_C in zip(model.ovr_ir, co_Cs)
+        approximators = [
+            self.imbalanced_approximator if ir > self.ir_threshold else None for ir in max_ir
+        ] + [
+            self.balanced_approximator if ir <= self.ir_threshold else None for ir in model.ovr_ir
+        ] + [
+            self.imbalanced_approximator if 1 / ir > self.ir_threshold else self.balanced_approximator
+            for ir in model.ovr_ir
         ]
+        approxs = parallel_map(
+            lambda job: job[0] and job[0](job[1]), zip(approximators, Cs + Cs + co_Cs), self.n_jobs
+        )
+        n_classes = model.n_classes
+        model.imb_approxs = approxs[:n_classes]
+        model.bal_approxs = approxs[n_classes:2 * n_classes]
+        model.co_approxs = approxs[2 * n_classes:]
 
-        model.sig = np.array([model._sig(C) for C in Cs])
+        model.sig = np.array(parallel_map(model._sig, Cs, self.n_jobs))
         return model
 
 
@@ -308,6 +418,7 @@ class FROVOCO(MultiClassClassifier):
         bal_approxs: List[DataDescriptor.Model or None]
         co_approxs: List[DataDescriptor.Model]
         sig: np.array
+        n_jobs: int | None
 
         def _sig(self, C):
             approxs = [
@@ -319,12 +430,24 @@ class FROVOCO(MultiClassClassifier):
             return (vals_C + 1 - co_vals_C)/2
 
         def _query(self, X):
-            # The values in the else clause are just placeholders. But we can't use `None`, because that will force
-            # the dtype of the resulting array to become `object`, which will in turn lead to 0/0 producing
+            # Columns without an approximation keep -np.inf as placeholder. But we can't use `None`, because that will
+            # force the dtype of the resulting array to become `object`, which will in turn lead to 0/0 producing
             # ZeroDivisionError rather than np.nan
-            imb_vals_X = np.stack(np.broadcast_arrays(*[a(X) if a else -np.inf for a in self.imb_approxs])).transpose()
-            bal_vals_X = np.stack(np.broadcast_arrays(*[a(X) if a else -np.inf for a in self.bal_approxs])).transpose()
-            co_vals_X = np.array([a(X) for a in self.co_approxs]).transpose()
+            dtype = self.dtype or np.float64
+            imb_vals_X = np.full((len(X), self.n_classes), -np.inf, dtype=dtype)
+            bal_vals_X = np.full((len(X), self.n_classes), -np.inf, dtype=dtype)
+            co_vals_X = np.empty((len(X), self.n_classes), dtype=dtype)
+            jobs = [
+                (out, i, a)
+                for out, approxs in [(imb_vals_X, self.imb_approxs), (bal_vals_X, self.bal_approxs), (co_vals_X, self.co_approxs)]
+                for i, a in enumerate(approxs) if a
+            ]
+
+            def query(job):
+                out, i, a = job
+                out[:, i] = a(X)
+
+            parallel_map(query, jobs, self.n_jobs)
 
             mem = self._mem(imb_vals_X, bal_vals_X, co_vals_X)
 
@@ -422,7 +545,10 @@ class FRONEC(MultiLabelClassifier):
     def _construct(self, X, Y) -> Model:
         model: FRONEC.Model = super()._construct(X, Y)
         model.Q_type = self.Q_type
-        model.R_d = model._R_d_2(Y) if self.R_d_type == 2 else model._R_d_1(Y)
+        if model.dtype is not None:
+            Y = np.asarray(Y, dtype=model.dtype)
+        R_d = model._R_d_2(Y) if self.R_d_type == 2 else model._R_d_1(Y)
+        model.R_d = R_d if model.dtype is None else R_d.astype(model.dtype, copy=False)
         model.k = resolve_k(self.k, len(X))
         model.owa_weights = self.owa_weights
         model.nn_model = self.nn_search(X, dissimilarity=self.dissimilarity)
@@ -465,7 +591,7 @@ class FRONEC(MultiLabelClassifier):
             else:
                 Q = self._Q_1(neighbours, R) + self._Q_2(neighbours, R)
             Q_max = np.max(Q, axis=-1, keepdims=True)
-            Q = Q == Q_max
+            Q = (Q == Q_max).astype(self.Y.dtype)
             return np.sum(np.minimum(self.Y, Q[..., None]), axis=1) / np.sum(Q, axis=-1, keepdims=True)
 
         def _Q_1(self, neighbours, R):
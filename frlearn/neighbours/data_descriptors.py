@@ -6,7 +6,7 @@ from typing import Callable
 
 import numpy as np
 
-from frlearn.array_functions import div_or, soft_head, soft_max
+from frlearn.array_functions import div_or, soft_max
 from frlearn.base import DataDescriptor
 from frlearn.feature_preprocessors import IQRNormaliser
 from frlearn.neighbour_search_methods import NeighbourSearchMethod, KDTree
@@ -51,10 +51,100 @@ class NNDataDescriptor(DataDescriptor):
         nn_model: NeighbourSearchMethod.Model
         k: int
 
-        def __call__(self, X):
-            # TODO: inherit from super
-            for preprocessing_model in self.preprocessing_models:
-                X = preprocessing_model(X)
+        # Nearest neighbours of the target instances among the other target instances,
+        # for models that depend on these.
+        self_neighbours: np.ndarray or None = None
+        self_distances: np.ndarray or None = None
+
+        def insert(self, X):
+            """
+            Insert target instances into the model.
+            Only the nearest neighbours of target instances that are closer to an inserted instance
+            than to their current `k`th nearest neighbour are recalculated.
+            The number of neighbours `k` is not resolved again, and the preprocessing models are not updated.
+
+            Parameters
+            ----------
+            X: array shape=(q, m, )
+                Target instances to insert.
+            """
+            X = self._preprocess(X)
+            n = self.n
+            self.nn_model.insert(X)
+            self.n = len(self.nn_model)
+            self.shape = (self.n, self.m)
+            changed = np.arange(n, self.n)
+            if self.self_neighbours is not None and len(X) > 0:
+                Y = self.nn_model._X
+                _, distances = self.nn_model._search_model(Y[n:])(Y[:n], 1)
+                changed = np.concatenate([np.flatnonzero(distances[:, 0] < self.self_distances[:, -1]), changed])
+                self.self_neighbours = np.concatenate([self.self_neighbours, np.empty((len(X), self.k), dtype=self.self_neighbours.dtype)])
+                self.self_distances = np.concatenate([self.self_distances, np.empty((len(X), self.k), dtype=self.self_distances.dtype)])
+                self._update_self_neighbours(changed)
+            self._update(changed, np.concatenate([np.arange(n), np.full(len(X), -1)]))
+
+        def delete(self, indices):
+            """
+            Delete target instances from the model. The indices of the remaining instances are decreased accordingly,
+            as with `np.delete`. Only the nearest neighbours of target instances that had a deleted instance
+            among their `k` nearest neighbours are recalculated.
+
+            Parameters
+            ----------
+            indices: int or array of ints or array of bools
+                Indices of the target instances to delete.
+
+            Raises
+            ------
+            ValueError
+                If fewer target instances would remain than the model requires.
+            """
+            deleted = np.zeros(self.n, dtype=bool)
+            deleted[indices] = True
+            previous = np.flatnonzero(~deleted)
+            if len(previous) < self._required_size():
+                raise ValueError(f'Model requires at least {self._required_size()} target instances.')
+            self.nn_model.delete(deleted)
+            self.n = len(previous)
+            self.shape = (self.n, self.m)
+            changed = np.empty(0, dtype=np.intp)
+            if self.self_neighbours is not None:
+                changed = np.flatnonzero(np.any(deleted[self.self_neighbours[previous]], axis=1))
+                positions = np.cumsum(~deleted) - 1
+                self.self_neighbours = positions[self.self_neighbours[previous]].astype(self.self_neighbours.dtype)
+                self.self_distances = self.self_distances[previous]
+                self._update_self_neighbours(changed)
+            self._update(changed, previous)
+
+        def _required_size(self) -> int:
+            return self.k + (self.self_neighbours is not None)
+
+        def _update_self_neighbours(self, rows):
+            # Nearest neighbours of the target instances in `rows`, excluding the instances themselves.
+            if len(rows) == 0:
+                return
+            neighbours, distances = self.nn_model(self.nn_model._X[rows], self.k + 1)
+            own = neighbours == rows[:, None]
+            own[~np.any(own, axis=1), -1] = True
+            self.self_neighbours[rows] = neighbours[~own].reshape(len(rows), self.k)
+            self.self_distances[rows] = distances[~own].reshape(len(rows), self.k)
+
+        def _update(self, changed, previous):
+            """
+            Update anything derived from the nearest neighbours of the target instances
+            after inserting or deleting target instances.
+
+            Parameters
+            ----------
+            changed: array of ints
+                Target instances whose nearest neighbours have changed or are new.
+
+            previous: array of ints
+                Previous index of each target instance, or -1 for inserted instances.
+            """
+            pass
+
+        def _query_preprocessed(self, X):
             q_neighbours, q_distances = self.nn_model(X, self.k)
             return self._query(q_neighbours, q_distances)
 
@@ -143,11 +233,10 @@ class ALP(NNDataDescriptor):
         Determines to which extent nearer neighbours dominate.
 
     max_array_size : int = 2**26
-        Maximum array size to use. For a query set of size `q`,
-        calculating local distances requires an array of size `[q, l, k]`,
-        which can be too large to fit in memory. If the size of this array is larger than `max_array_size`,
-        a query set is batch-processed, which is slower.
-        TODO: determine maximum array size dynamically, investigate lowering float precision
+        Maximum size of the intermediate arrays with which local distances are calculated.
+        For a query set of size `q`, these have size `[q, k]`, since the local distances are accumulated
+        one neighbour at a time, rather than from an array of size `[q, l, k]`.
+        If they would be larger than `max_array_size`, a query set is processed in batches.
 
     preprocessors : iterable = (IQRNormaliser(), )
         Preprocessors to apply. The default interquartile range normaliser rescales all features
@@ -188,9 +277,11 @@ class ALP(NNDataDescriptor):
         model: ALP.Model = super()._construct(X)
         model.l = model._resolve_k(self.l, localised=False)
         model._kl = max(model.k, model.l)
-        _, model.distances = model.nn_model.query_self(model.k)
+        model.self_neighbours, model.self_distances = model.nn_model.query_self(model.k)
+        model.distances = model.self_distances
         model.scale_weights = self.scale_weights
         model.localisation_weights = self.localisation_weights
+        model.max_array_size = self.max_array_size
         return model
 
     class Model(NNDataDescriptor.Model):
@@ -200,25 +291,38 @@ class ALP(NNDataDescriptor):
         distances: np.ndarray
         scale_weights: Callable[[int], np.array]
         localisation_weights: Callable[[int], np.array]
+        max_array_size: int
 
-        def __call__(self, X):
-            # TODO: inherit from super
-            for preprocessing_model in self.preprocessing_models:
-                X = preprocessing_model(X)
+        def _query_preprocessed(self, X):
             q_neighbours, q_distances = self.nn_model(X, self._kl)
             return self._query(q_neighbours[..., :self.l], q_distances[..., :self.k])
 
+        def _required_size(self) -> int:
+            return max(super()._required_size(), self.l)
+
+        def _update(self, changed, previous):
+            self.distances = self.self_distances
+
+        def _local_distances(self, q_neighbours):
+            # Soft head over the `l` nearest neighbours of each query instance of their `k` nearest neighbour distances,
+            # accumulated one neighbour at a time into a preallocated array,
+            # rather than gathering all neighbour distances into an array of size `[q, l, k]`.
+            if self.localisation_weights is None:
+                return self.distances[q_neighbours[:, self.l - 1]]
+            weights = np.asarray(self.localisation_weights(self.l), dtype=self.distances.dtype)
+            local_distances = np.empty((len(q_neighbours), self.k), dtype=self.distances.dtype)
+            batch_size = max(self.max_array_size // self.k, 1)
+            for start in range(0, len(q_neighbours), batch_size):
+                batch = q_neighbours[start:start + batch_size]
+                out = local_distances[start:start + batch_size]
+                np.multiply(self.distances[batch[:, 0]], weights[0], out=out)
+                for i in range(1, self.l):
+                    out += weights[i] * self.distances[batch[:, i]]
+            return local_distances
+
         def _query(self, q_neighbours, q_distances):
-            batch_size = 2**26 // (self.k * self.l)
-            local_distances = []
-            for i in range(0, q_neighbours.shape[0], batch_size):
-                local_distances.append(soft_head(
-                    self.distances[q_neighbours[i:i+batch_size]],
-                    self.localisation_weights,
-                    self.l, axis=-2
-                ))
-            local_distances = np.concatenate(local_distances, axis=0)
-            
+            local_distances = self._local_distances(q_neighbours)
+
             # if both distances are zero, default to 1
             localised_distances = div_or(q_distances, local_distances, 1)
             localised_proximities = shifted_reciprocal(localised_distances)
@@ -288,14 +392,17 @@ class LNND(NNDataDescriptor):
 
     def _construct(self, X) -> Model:
         model: LNND.Model = super()._construct(X)
-        _, distances = model.nn_model.query_self(model.k)
-        model.distances = distances[:, -1]
+        model.self_neighbours, model.self_distances = model.nn_model.query_self(model.k)
+        model.distances = model.self_distances[:, -1]
         return model
 
     class Model(NNDataDescriptor.Model):
 
         distances: np.ndarray
 
+        def _update(self, changed, previous):
+            self.distances = self.self_distances[:, -1]
+
         def _query(self, q_neighbours, q_distances):
             # if both distances are zero, default to 1
             l_distances = div_or(q_distances[:, self.k-1], self.distances[q_neighbours[:, self.k-1]], 1)
@@ -362,9 +469,9 @@ class LOF(NNDataDescriptor):
 
     def _construct(self, X) -> Model:
         model: LOF.Model = super()._construct(X)
-        neighbours, distances = model.nn_model.query_self(model.k)
-        model.distances = distances[:, -1]
-        model.lrd = model._get_lrd(neighbours, distances)
+        model.self_neighbours, model.self_distances = model.nn_model.query_self(model.k)
+        model.distances = model.self_distances[:, -1]
+        model.lrd = model._get_lrd(model.self_neighbours, model.self_distances)
         return model
 
     class Model(NNDataDescriptor.Model):
@@ -372,6 +479,15 @@ class LOF(NNDataDescriptor):
         distances: np.ndarray
         lrd: np.ndarray
 
+        def _update(self, changed, previous):
+            self.distances = self.self_distances[:, -1]
+            lrd = np.empty(self.n, dtype=self.lrd.dtype)
+            lrd[previous >= 0] = self.lrd[previous[previous >= 0]]
+            # The local reachability density also depends on the k-distances of the nearest neighbours.
+            changed = np.union1d(changed, np.flatnonzero(np.any(np.isin(self.self_neighbours, changed), axis=1)))
+            lrd[changed] = self._get_lrd(self.self_neighbours[changed], self.self_distances[changed])
+            self.lrd = lrd
+
         def _get_lrd(self, q_neighbours, q_distances):
             r_distances = np.maximum(q_distances, self.distances[q_neighbours])
             return 1/np.mean(r_distances, axis=-1)
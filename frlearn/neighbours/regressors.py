@@ -82,6 +82,8 @@ class FRNN(Regressor):
         model.k = resolve_k(self.k, model.n)
         model.dissimilarity = self.dissimilarity
         model.X = X
+        if model.dtype is not None:
+            y = np.asarray(y, dtype=model.dtype)
         model.y_range = np.max(y) - np.min(y)
         model.y = y
         return model
@@ -1,10 +1,19 @@
+import pickle
+
 import pytest
 
+import numpy as np
 from sklearn.datasets import load_iris
 
+from frlearn.base import using_precision
+from frlearn.neighbour_search_methods import BallTree, BruteForce, DistanceCache, KDTree, NeighbourGraphCache, \
+    PrecomputedDissimilarity, RPForest, pairwise_dissimilarities
+from frlearn.neighbours.classifiers import FRNN, FROVOCO
 from frlearn.neighbours.data_descriptors import ALP, LNND, LOF, NND
 from frlearn.neighbours.utilities import resolve_k
 from frlearn.parametrisations import log_multiple, multiple
+from frlearn.uncategorised.utilities import apply_dissimilarity
+from frlearn.vector_size_measures import MinkowskiSize
 
 @pytest.fixture
 def multiclass_data():
@@ -67,3 +76,301 @@ def test_unlocalised_l(multiclass_data, cls):
     model = descriptor(X[y == 0])
     assert model.l == 50
     scores = model(X)
+
+
+class _UnitCosineDistance:
+
+    def __call__(self, a, b):
+        return (1 - np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))) / 2
+
+    def embed(self, X):
+        return X / np.linalg.norm(X, axis=-1, keepdims=True)
+
+    def from_euclidean(self, distances):
+        return distances ** 2 / 4
+
+
+@pytest.mark.parametrize(
+    'cls',
+    [BallTree, BruteForce, KDTree, ],
+)
+def test_euclidean_embedding(multiclass_data, cls):
+    X, y = multiclass_data
+    dissimilarity = _UnitCosineDistance()
+    model = cls()(X[::2], dissimilarity=dissimilarity)
+    neighbours, distances = model(X[1::2], k=5)
+    all_distances = apply_dissimilarity(X[1::2], X[::2], dissimilarity)
+    assert np.allclose(distances, np.sort(all_distances, axis=-1)[:, :5])
+    assert np.allclose(np.take_along_axis(all_distances, neighbours, axis=-1), distances)
+
+
+class _HalfCanberraDistance:
+
+    def __call__(self, a, b):
+        denominator = np.abs(a) + np.abs(b)
+        return np.sum(np.abs(a - b) / np.where(denominator == 0, 1, denominator)) / 2
+
+    def native_metric(self, m):
+        return 'canberra', None, 1 / 2
+
+
+@pytest.mark.parametrize(
+    'cls',
+    [BallTree, BruteForce, ],
+)
+def test_native_metric(multiclass_data, cls):
+    X, y = multiclass_data
+    dissimilarity = _HalfCanberraDistance()
+    model = cls()(X[::2], dissimilarity=dissimilarity)
+    assert model.scale == 1 / 2
+    neighbours, distances = model(X[1::2], k=5)
+    all_distances = apply_dissimilarity(X[1::2], X[::2], dissimilarity)
+    assert np.allclose(distances, np.sort(all_distances, axis=-1)[:, :5])
+    assert np.allclose(np.take_along_axis(all_distances, neighbours, axis=-1), distances)
+
+
+class _BatchedManhattanDistance:
+    # Manhattan distance that counts the calls to its batch method.
+
+    def __init__(self):
+        self.batches = 0
+
+    def __call__(self, a, b):
+        return np.sum(np.abs(a - b), axis=-1)
+
+    def pairwise(self, A, B):
+        self.batches += 1
+        return np.sum(np.abs(A[:, None, :] - B[None, :, :]), axis=-1)
+
+
+def test_pairwise_dissimilarity(multiclass_data, tmp_path):
+    X, y = multiclass_data
+    dissimilarity = _BatchedManhattanDistance()
+    expected = apply_dissimilarity(X, X[:75], MinkowskiSize(p=1))
+    assert np.allclose(pairwise_dissimilarities(X, X[:75], dissimilarity), expected)
+    assert np.allclose(DistanceCache(tmp_path)(dissimilarity, X, n=75).D[:, :75], expected)
+    neighbours, distances = BruteForce()(X[:75], dissimilarity=dissimilarity)(X, k=5)
+    assert np.allclose(distances, np.sort(expected, axis=-1)[:, :5])
+    assert dissimilarity.batches == 3
+
+
+@pytest.mark.parametrize(
+    'cls',
+    [BallTree, BruteForce, KDTree, ],
+)
+def test_precomputed_dissimilarity(multiclass_data, cls, tmp_path):
+    X, y = multiclass_data
+    X = np.concatenate([X[::2], X[1::2]])
+    cache = DistanceCache(tmp_path, max_memory=2**12)
+    dissimilarity = cache(MinkowskiSize(p=2), X, n=75)
+    assert cache(MinkowskiSize(p=2), X, n=75).D.filename == dissimilarity.D.filename
+    assert cache(MinkowskiSize(p=1), X, n=75).D.filename != dissimilarity.D.filename
+
+    model = cls()(dissimilarity.indices(0, 75), dissimilarity=dissimilarity)
+    neighbours, distances = model(dissimilarity.indices(75), k=5)
+    all_distances = dissimilarity.lookup(dissimilarity.indices(75), dissimilarity.indices(0, 75))
+    assert np.allclose(all_distances, apply_dissimilarity(X[75:], X[:75], MinkowskiSize(p=2)))
+    assert np.allclose(distances, np.sort(all_distances, axis=-1)[:, :5])
+    assert np.allclose(np.take_along_axis(all_distances, neighbours, axis=-1), distances)
+
+    y = np.concatenate([y[::2], y[1::2]])
+    clf = FRNN(preprocessors=(), nn_search=cls(), dissimilarity=MinkowskiSize(p=2, scale_by_dimensionality=True))
+    scores = clf(X[:75], y[:75])(X[75:])
+    dissimilarity = PrecomputedDissimilarity(cache(MinkowskiSize(p=2, scale_by_dimensionality=True), X, n=75).D.filename)
+    clf = FRNN(preprocessors=(), nn_search=cls(), dissimilarity=dissimilarity)
+    assert np.allclose(clf(dissimilarity.indices(0, 75), y[:75])(dissimilarity.indices(75)), scores)
+
+
+@pytest.mark.parametrize(
+    'dissimilarity',
+    [MinkowskiSize(p=2), MinkowskiSize(p=2, unrooted=True, scale_by_dimensionality=True),
+     MinkowskiSize(p=1, scale_by_dimensionality=True), MinkowskiSize(p=3, unrooted=True), MinkowskiSize(p=np.inf), ],
+)
+def test_brute_force(multiclass_data, dissimilarity):
+    X, y = multiclass_data
+    # Break ties, which the search methods may order differently.
+    X = X + np.random.default_rng(0).uniform(0, 1e-3, X.shape)
+    tree_neighbours, tree_distances = KDTree()(X[::2], dissimilarity=dissimilarity)(X[1::2], k=5)
+    for brute_force in [BruteForce(), BruteForce(max_memory=2**10, n_jobs=2)]:
+        neighbours, distances = brute_force(X[::2], dissimilarity=dissimilarity)(X[1::2], k=5)
+        assert np.array_equal(neighbours, tree_neighbours)
+        assert np.allclose(distances, tree_distances)
+    neighbours, distances = BruteForce()(X, dissimilarity=dissimilarity)(X[:0], k=5)
+    assert neighbours.shape == distances.shape == (0, 5)
+
+
+@pytest.mark.parametrize(
+    'dissimilarity',
+    [MinkowskiSize(p=0, unrooted=True), MinkowskiSize(p=0, unrooted=True, scale_by_dimensionality=True), ],
+)
+def test_hamming_size(multiclass_data, dissimilarity):
+    X, y = multiclass_data
+    X = np.round(X)
+    all_distances = apply_dissimilarity(X[1::2], X[::2], dissimilarity)
+    for nn_search in [BallTree(), BruteForce()]:
+        neighbours, distances = nn_search(X[::2], dissimilarity=dissimilarity)(X[1::2], k=5)
+        # Neighbours with the same number of differing features may be ordered differently.
+        assert np.array_equal(distances, np.sort(all_distances, axis=-1)[:, :5])
+        assert np.array_equal(np.take_along_axis(all_distances, neighbours, axis=-1), distances)
+
+
+@pytest.mark.parametrize(
+    'dissimilarity',
+    [MinkowskiSize(p=2), MinkowskiSize(p=1, scale_by_dimensionality=True), _UnitCosineDistance(), ],
+)
+def test_rp_forest(multiclass_data, dissimilarity):
+    X, y = multiclass_data
+    X = X + np.random.default_rng(0).uniform(0, 1e-3, X.shape)
+    exact = BruteForce()(X[::2], dissimilarity=dissimilarity)
+    exact_neighbours, _ = exact(X[1::2], k=5)
+    model = RPForest(leaf_size=8, graph_k=5, max_memory=2**12, random_state=0)(X[::2], dissimilarity=dissimilarity)
+    neighbours, distances = model(X[1::2], k=5)
+    all_distances = apply_dissimilarity(X[1::2], X[::2], dissimilarity)
+    assert np.allclose(np.take_along_axis(all_distances, neighbours, axis=-1), distances)
+    assert np.all(np.diff(distances, axis=-1) >= 0)
+    recall = np.mean([len(np.intersect1d(a, b)) for a, b in zip(neighbours, exact_neighbours)]) / 5
+    assert recall > 0.9
+    self_neighbours, self_distances = model.query_self(k=5)
+    assert self_neighbours.shape == (len(X[::2]), 5)
+    assert not np.any(self_neighbours == np.arange(len(X[::2]))[:, None])
+    assert len(np.unique(self_neighbours[0])) == 5
+
+
+@pytest.mark.parametrize(
+    'cls',
+    [BallTree, BruteForce, KDTree, RPForest, ],
+)
+def test_float32_precision(multiclass_data, cls):
+    X, y = multiclass_data
+    X = X + np.random.default_rng(0).uniform(0, 1e-3, X.shape)
+    neighbours, distances = cls()(X[::2])(X[1::2], k=5)
+    with using_precision(np.float32):
+        model = cls()(X[::2])
+    single_neighbours, single_distances = model(X[1::2], k=5)
+    assert single_neighbours.dtype == np.int32
+    assert single_distances.dtype == np.float32
+    assert np.array_equal(single_neighbours, neighbours)
+    assert np.allclose(single_distances, distances, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    'cls',
+    [BallTree, BruteForce, KDTree, RPForest, ],
+)
+@pytest.mark.parametrize('merge_fraction', [0.1, 10])
+def test_search_insert_delete(multiclass_data, cls, merge_fraction):
+    X, y = multiclass_data
+    X = X + np.random.default_rng(0).uniform(0, 1e-3, X.shape)
+    model = cls()(X[:100])
+    model.merge_fraction = merge_fraction
+    model.insert(X[100:120])
+    model.delete(np.arange(0, 100, 7))
+    model.insert(X[120:])
+    current = np.concatenate([np.delete(X[:100], np.arange(0, 100, 7), axis=0), X[100:]])
+    assert len(model) == len(current)
+    neighbours, distances = model(current, k=3)
+    assert np.array_equal(neighbours[:, 0], np.arange(len(current)))
+    all_distances = apply_dissimilarity(current, current, model.dissimilarity)
+    assert np.allclose(np.take_along_axis(all_distances, neighbours, axis=-1), distances)
+
+
+@pytest.mark.parametrize('merge_fraction', [0.1, 10])
+def test_search_insert_delete_ties(multiclass_data, merge_fraction):
+    # Iris has many instances at the same distance, and some duplicates.
+    X, y = multiclass_data
+    search = BruteForce(max_memory=2**12)
+    model = search(X[:100])
+    model.merge_fraction = merge_fraction
+    model.insert(X[100:120])
+    model.delete(np.arange(0, 100, 7))
+    model.insert(X[120:])
+    current = np.concatenate([np.delete(X[:100], np.arange(0, 100, 7), axis=0), X[100:]])
+    neighbours, distances = model(X, k=10)
+    rebuilt_neighbours, rebuilt_distances = search(current)(X, k=10)
+    assert np.array_equal(neighbours, rebuilt_neighbours)
+    assert np.array_equal(distances, rebuilt_distances)
+    all_distances = apply_dissimilarity(X, current, model.dissimilarity)
+    expected = np.lexsort((np.broadcast_to(np.arange(len(current)), all_distances.shape), all_distances), axis=1)
+    assert np.array_equal(neighbours, expected[:, :10])
+
+
+@pytest.mark.parametrize(
+    'cls',
+    [ALP, LNND, LOF, NND, ],
+)
+def test_data_descriptor_insert_delete(multiclass_data, cls):
+    X, y = multiclass_data
+    X = X + np.random.default_rng(0).uniform(0, 1e-3, X.shape)
+    descriptor = cls(k=5, l=5, preprocessors=()) if cls is ALP else cls(k=5, preprocessors=())
+    model = descriptor(X[::2])
+    model.insert(X[1::2])
+    model.delete(np.arange(0, len(X), 5))
+    current = np.delete(np.concatenate([X[::2], X[1::2]]), np.arange(0, len(X), 5), axis=0)
+    assert np.allclose(model(X), descriptor(current)(X))
+
+    # Without jitter, iris has many ties, which BruteForce breaks by index, like a rebuilt model.
+    X, _ = multiclass_data
+    descriptor.nn_search = BruteForce()
+    model = descriptor(X[::2])
+    model.insert(X[1::2])
+    model.delete(np.arange(0, len(X), 5))
+    current = np.delete(np.concatenate([X[::2], X[1::2]]), np.arange(0, len(X), 5), axis=0)
+    assert np.array_equal(model(X), descriptor(current)(X))
+
+
+def test_neighbour_graph_cache(multiclass_data):
+    X, y = multiclass_data
+    X = X + np.random.default_rng(0).uniform(0, 1e-3, X.shape)
+    descriptors = [ALP(k=7, l=5, preprocessors=()), LNND(k=4, preprocessors=()), LOF(k=6, preprocessors=()), NND(k=2, preprocessors=())]
+    scores = [descriptor(X[::2])(X[1::2]) for descriptor in descriptors]
+
+    graph = NeighbourGraphCache(KDTree())
+    models = []
+    for descriptor in descriptors:
+        descriptor.nn_search = graph
+        models.append(descriptor(X[::2]))
+    entry = models[0].nn_model._entry
+    assert all(model.nn_model._entry is entry for model in models)
+    assert entry.self_neighbours.shape == (75, 7)
+    assert np.allclose(pickle.loads(pickle.dumps(models[3]))(X[1::2]), scores[3])
+
+    queries = []
+    query = entry.model._query
+    entry.model._query = lambda X, k: queries.append(k) or query(X, k)
+    assert all(np.allclose(model(X[1::2]), s) for model, s in zip(models, scores))
+    assert queries == [7]
+    # Query instances are identified by their memory, not by their contents.
+    assert np.allclose(models[3](X[1::2].copy()), scores[3])
+    assert queries == [7, 2]
+
+    models[0].insert(X[1::2])
+    models[0].delete(np.arange(0, len(X), 5))
+    current = np.delete(np.concatenate([X[::2], X[1::2]]), np.arange(0, len(X), 5), axis=0)
+    assert np.allclose(models[0](X), ALP(k=7, l=5, preprocessors=())(current)(X))
+    assert np.allclose(models[2](X[1::2]), scores[2])
+
+
+def test_classifier_insert_delete(multiclass_data):
+    X, y = multiclass_data
+    model = FRNN()(X, y)
+    assert model.y is None
+    with pytest.raises(ValueError):
+        model.delete(0)
+
+    clf = FRNN(preprocessors=(), updatable=True)
+    model = clf(X[::2], y[::2])
+    model.insert(X[1::2], y[1::2])
+    model.delete(np.arange(0, len(X), 5))
+    current = np.delete(np.concatenate([X[::2], X[1::2]]), np.arange(0, len(X), 5), axis=0)
+    current_y = np.delete(np.concatenate([y[::2], y[1::2]]), np.arange(0, len(X), 5))
+    assert np.allclose(model(X), clf(current, current_y)(X))
+
+
+@pytest.mark.parametrize(
+    'cls',
+    [FRNN, FROVOCO, ],
+)
+def test_n_jobs(multiclass_data, cls):
+    X, y = multiclass_data
+    scores = cls()(X, y)(X)
+    assert np.array_equal(cls(n_jobs=4)(X, y)(X), scores)
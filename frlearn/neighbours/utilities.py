@@ -1,4 +1,6 @@
-from typing import Callable
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
 
 
 def resolve_k(k: float or Callable[[int], float] or None, n: int, k_max: int = None):
@@ -44,3 +46,36 @@ def resolve_k(k: float or Callable[[int], float] or None, n: int, k_max: int = N
     elif not 1 <= k <= k_max:
         raise ValueError(f'{k} is too many nearest neighbours, number has to be between 1 and {k_max}.')
     return min(max(1, round(k)), k_max)
+
+
+def parallel_map(f: Callable, items: Iterable, n_jobs: int or None = None) -> list:
+    """
+    Helper method to apply `f` to each of `items` on a thread pool.
+    This only speeds things up if `f` spends most of its time in code that releases the GIL,
+    like the nearest neighbour searches of scikit-learn trees.
+
+    Parameters
+    ----------
+    f: callable
+        Function to apply.
+
+    items: iterable
+        Arguments to apply `f` to.
+
+    n_jobs: int or None = None
+        Number of threads to use. If None or 1, `f` is applied sequentially in the current thread.
+        If -1, the number of processors is used.
+
+    Returns
+    -------
+    results: list
+        The results of `f`, in the order of `items`.
+
+    """
+    items = list(items)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs is None or n_jobs == 1 or len(items) <= 1:
+        return [f(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(n_jobs, len(items))) as executor:
+        return list(executor.map(f, items))
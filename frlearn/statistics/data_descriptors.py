@@ -9,6 +9,7 @@ from scipy.stats import chi2
 
 from frlearn.base import DataDescriptor
 from frlearn.feature_preprocessors import Standardiser
+from frlearn.statistics.streaming import QuantileSketch, RunningMoments
 from frlearn.transformations import shifted_reciprocal
 from frlearn.uncategorised.utilities import resolve_dissimilarity
 
@@ -42,8 +43,15 @@ class CD(DataDescriptor):
     preprocessors : iterable = (Standardiser(), )
         Preprocessors to apply. The default standardiser places the centroid of the data at the origin,
         and ensures that all features have the same standard deviation.
+
+    Notes
+    -----
+    With `construct_streaming`, the threshold percentile is approximated with a `QuantileSketch`,
+    with a rank error that is in practice below 1% of the number of target instances.
     """
 
+    _streaming = True
+
     def __init__(
             self,
             measure: str or float or Callable[[np.array], float] = 'euclidean',
@@ -65,6 +73,21 @@ class CD(DataDescriptor):
             model.threshold = 1
         return model
 
+    def _construct_streaming(self, chunks) -> Model:
+        sketch = QuantileSketch()
+        dtype = None
+        for chunk in chunks if self.threshold_perc else ():
+            distances = self.measure(chunk)
+            sketch.update(distances)
+            dtype = distances.dtype
+        model: CD.Model = super()._construct_streaming(chunks)
+        model.measure = self.measure
+        if self.threshold_perc:
+            model.threshold = sketch.quantiles(self.threshold_perc)[0].astype(dtype)
+        else:
+            model.threshold = 1
+        return model
+
     class Model(DataDescriptor.Model):
 
         measure: Callable[[np.array], float]
@@ -89,6 +112,10 @@ class MD(DataDescriptor):
     preprocessors : iterable = ()
         Preprocessors to apply.
 
+    Notes
+    -----
+    With `construct_streaming`, the mean and covariance matrix are calculated exactly with `RunningMoments`.
+
     References
     ----------
 
@@ -98,13 +125,26 @@ class MD(DataDescriptor):
        <http://insa.nic.in/writereaddata/UpLoadedFiles/PINSA/Vol02_1936_1_Art05.pdf>`_
     """
 
+    _streaming = True
+
     def __init__(self, preprocessors=()):
         super().__init__(preprocessors=preprocessors)
 
     def _construct(self, X) -> Model:
         model: MD.Model = super()._construct(X)
         model.mean = X.mean(axis=0)
-        model.covar_inv = linalg.pinvh(np.cov(X.T, bias=True))
+        model.covar_inv = linalg.pinvh(np.cov(X.T, bias=True)).astype(model.mean.dtype, copy=False)
+        return model
+
+    def _construct_streaming(self, chunks) -> Model:
+        moments = RunningMoments(covariance=True)
+        dtype = None
+        for chunk in chunks:
+            moments.update(chunk)
+            dtype = np.result_type(chunk.dtype, np.float16)
+        model: MD.Model = super()._construct_streaming(chunks)
+        model.mean = moments.mean.astype(dtype, copy=False)
+        model.covar_inv = linalg.pinvh(moments.covariance_matrix()).astype(dtype, copy=False)
         return model
 
     class Model(DataDescriptor.Model):
@@ -115,4 +155,4 @@ class MD(DataDescriptor):
         def _query(self, X):
             d = X - self.mean
             D2 = (d[..., None, :] @ self.covar_inv @ d[..., None]).squeeze(axis=(-2, -1))
-            return 1 - chi2.cdf(D2, df=self.m)
+            return (1 - chi2.cdf(D2, df=self.m)).astype(D2.dtype, copy=False)
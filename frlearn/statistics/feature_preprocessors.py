@@ -5,7 +5,24 @@ import numpy as np
 
 from frlearn.base import FeaturePreprocessor, Unsupervised
 from frlearn.dispersion_measures import interquartile_range, maximum_absolute_value, standard_deviation, total_range
-from frlearn.location_measures import mean, midhinge, midrange, minimum
+from frlearn.location_measures import maximum, mean, median, midhinge, midrange, minimum
+from frlearn.statistics.streaming import QuantileSketch, RunningMoments
+
+# Measures of dispersion and location that can be calculated from running moments or from a quantile sketch.
+_moment_measures = {
+    mean: lambda moments: moments.mean,
+    standard_deviation: lambda moments: moments.standard_deviation(),
+}
+_sketch_measures = {
+    interquartile_range: lambda sketch: np.subtract(*sketch.quantiles([75, 25])),
+    maximum: lambda sketch: sketch.maximum,
+    maximum_absolute_value: lambda sketch: np.fmax(np.abs(sketch.minimum), np.abs(sketch.maximum)),
+    median: lambda sketch: sketch.quantiles(50),
+    midhinge: lambda sketch: np.nansum(sketch.quantiles([25, 75]), axis=0)/2,
+    midrange: lambda sketch: (sketch.maximum + sketch.minimum)/2,
+    minimum: lambda sketch: sketch.minimum,
+    total_range: lambda sketch: sketch.maximum - sketch.minimum,
+}
 
 
 class LinearNormaliser(Unsupervised, FeaturePreprocessor):
@@ -25,8 +42,16 @@ class LinearNormaliser(Unsupervised, FeaturePreprocessor):
     -----
     If the measure of dispersion is 0 for some feature, it will be left unnormalised.
 
+    With `construct_streaming`, the mean and standard deviation are exact,
+    and so are the measures based on the minimum and maximum. Measures based on quantiles
+    (interquartile range, median and midhinge) are approximated with a `QuantileSketch`,
+    with a rank error that is in practice below 1% of the number of instances.
+    Other measures are not supported.
+
     """
 
+    _streaming = True
+
     def __init__(self, dispersion=None, location=None, ):
         super().__init__()
         self.dispersion = dispersion
@@ -34,19 +59,53 @@ class LinearNormaliser(Unsupervised, FeaturePreprocessor):
 
     def _construct(self, X, ) -> Model:
         model = super()._construct(X)
-        if self.dispersion is not None:
-            divisor = self.dispersion(X)
+        divisor = self.dispersion(X) if self.dispersion is not None else None
+        subtrahend = self.location(X) if self.location is not None else None
+        self._set_transformation(model, divisor, subtrahend, X.dtype)
+        return model
+
+    def _construct_streaming(self, chunks) -> Model:
+        measures = [measure for measure in (self.dispersion, self.location) if measure is not None]
+        for measure in measures:
+            if measure not in _moment_measures and measure not in _sketch_measures:
+                raise NotImplementedError(f'{getattr(measure, "__name__", measure)} cannot be calculated from chunks.')
+        moments = RunningMoments() if any(measure in _moment_measures for measure in measures) else None
+        sketch = QuantileSketch() if any(measure in _sketch_measures for measure in measures) else None
+        dtype = None
+        for chunk in chunks if measures else ():
+            dtype = chunk.dtype
+            if moments is not None:
+                moments.update(chunk)
+            if sketch is not None:
+                sketch.update(chunk)
+        model = super()._construct_streaming(chunks)
+
+        def summarise(measure):
+            if measure is None:
+                return None
+            if measure in _moment_measures:
+                return _moment_measures[measure](moments)
+            return _sketch_measures[measure](sketch)
+
+        self._set_transformation(model, summarise(self.dispersion), summarise(self.location), dtype)
+        return model
+
+    @staticmethod
+    def _set_transformation(model, divisor, subtrahend, dtype):
+        if divisor is not None:
             divisor = np.where(divisor == 0 | np.isnan(divisor), 1, divisor)
         else:
             divisor = 1
-        if self.location is not None:
-            subtrahend = self.location(X)
+        if subtrahend is not None:
             subtrahend = np.where(np.isnan(subtrahend), 0, subtrahend)
         else:
             subtrahend = 0
+        if dtype is not None and np.issubdtype(dtype, np.floating):
+            # Keep queries in the precision of the construction data.
+            divisor = np.asarray(divisor, dtype=dtype)
+            subtrahend = np.asarray(subtrahend, dtype=dtype)
         model.divisor = divisor
         model.subtrahend = subtrahend
-        return model
 
     class Model(Unsupervised.Model, FeaturePreprocessor.Model):
 
@@ -54,7 +113,11 @@ class LinearNormaliser(Unsupervised, FeaturePreprocessor):
         subtrahend: np.array
 
         def _query(self, X):
-            return (X - self.subtrahend)/self.divisor
+            X = np.subtract(X, self.subtrahend)
+            return np.divide(X, self.divisor, out=X if np.issubdtype(X.dtype, np.inexact) else None)
+
+        def _affine(self):
+            return None, self.subtrahend, self.divisor
 
 
 class IQRNormaliser(LinearNormaliser):
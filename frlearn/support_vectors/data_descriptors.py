@@ -3,6 +3,8 @@ from __future__ import annotations
 
 from typing import Callable
 
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.linear_model import SGDOneClassSVM
 from sklearn.svm import OneClassSVM
 
 from frlearn.base import DataDescriptor
@@ -29,18 +31,37 @@ class SVM(DataDescriptor):
         Should be either a positive float
         or a function that takes the dimensionality of the target class and returns such a float.
 
+    approximation : str or None = None
+        If None, the exact kernel SVM is fitted, which takes time between quadratic and cubic in the size of the target class,
+        and queried in time linear in the number of support vectors.
+        Otherwise, the target data is mapped to `n_components` features that approximate the gaussian kernel,
+        with either the Nyström method (`'nystroem'`) or random Fourier features (`'fourier'`),
+        and a linear SVM is fitted to it with stochastic gradient descent (scikit-learn's SGDOneClassSVM).
+        This takes time linear in the size of the target class, and queries take time independent of it.
+        The Nyström method is generally the more accurate approximation for the same number of components.
+
+    n_components : int = 300
+        Number of features of the kernel approximation. Ignored if `approximation` is None.
+
+    random_state : int or None = None
+        Random state for the kernel approximation and stochastic gradient descent. Ignored if `approximation` is None.
+
     preprocessors : iterable = (IQRNormaliser(), )
         Preprocessors to apply. The default interquartile range normaliser rescales all features
         to ensure that they all have the same interquartile range.
 
     sklearn_params
-        Additional keyword parameters will be passed on as-is to scikit-learn's OneClassSVM constructor.
+        Additional keyword parameters will be passed on as-is to scikit-learn's OneClassSVM constructor,
+        or to its SGDOneClassSVM constructor if `approximation` is not None.
 
     Notes
     -----
     `nu` and `c` are the two principal hyperparameters that can be tuned to increase performance.
     Its default values are based on the empirical evaluation in [2]_.
 
+    The signed distances of the approximate SVM are multiplied by `nu` times the size of the target class,
+    which puts them on the same scale as those of the exact SVM, before they are scaled to `[0, 1]`.
+
     References
     ----------
     .. [1] `Schölkopf B, Platt JC, Shawe-Taylor J, Smola AJ, Williamson RC (1999).
@@ -58,29 +79,53 @@ class SVM(DataDescriptor):
             self,
             nu: float = 0.20,
             c: float | Callable[[int], float] = multiple(0.25),
+            approximation: str | None = None,
+            n_components: int = 300,
+            random_state: int | None = None,
             preprocessors=(IQRNormaliser(), ),
             **sklearn_params,
     ):
         super().__init__(preprocessors=preprocessors)
+        if approximation not in (None, 'nystroem', 'fourier'):
+            raise ValueError(f"approximation should be None, 'nystroem' or 'fourier', got {approximation!r}.")
         self.nu = nu
         self.c = c
+        self.approximation = approximation
+        self.n_components = n_components
+        self.random_state = random_state
         self.sklearn_params = sklearn_params
 
     def _construct(self, X, ):
         model = super()._construct(X)
         model.nu = self.nu
         model.c = self.c(X.shape[1]) if callable(self.c) else self.c
-        model.svm = OneClassSVM(nu=model.nu, gamma=1/model.c, **self.sklearn_params).fit(X)
+        if self.approximation is None:
+            model.feature_map = None
+            model.scale = 1
+            model.svm = OneClassSVM(nu=model.nu, gamma=1/model.c, **self.sklearn_params).fit(X)
+            return model
+        if self.approximation == 'nystroem':
+            feature_map = Nystroem(gamma=1/model.c, n_components=min(self.n_components, len(X)), random_state=self.random_state)
+        else:
+            feature_map = RBFSampler(gamma=1/model.c, n_components=self.n_components, random_state=self.random_state)
+        model.feature_map = feature_map.fit(X)
+        model.scale = model.nu * len(X)
+        sklearn_params = {'random_state': self.random_state, **self.sklearn_params}
+        model.svm = SGDOneClassSVM(nu=model.nu, **sklearn_params).fit(model.feature_map.transform(X))
         return model
 
     class Model(DataDescriptor.Model):
 
         nu: float
         c: float
-        svm: OneClassSVM
+        feature_map: Nystroem or RBFSampler or None
+        scale: float
+        svm: OneClassSVM or SGDOneClassSVM
 
         def _query(self, X):
-            signed_distance = self.svm.decision_function(X)
+            if self.feature_map is not None:
+                X = self.feature_map.transform(X)
+            signed_distance = self.scale * self.svm.decision_function(X)
             # scale signed distance from [-∞, ∞] to (0, 1)
             score = contract(signed_distance)
             return score
@@ -1,10 +1,11 @@
 import importlib
+import multiprocessing
 import pytest
 
 import numpy as np
 from sklearn.datasets import load_diabetes, load_iris
 
-from frlearn.base import ClassSupervised, FeatureSelector, FeaturePreprocessor, MultiClassClassifier, MultiLabelClassifier, Unsupervised
+from frlearn.base import AffinePreprocessor, ClassSupervised, FeatureSelector, FeaturePreprocessor, MultiClassClassifier, MultiLabelClassifier, Unsupervised, fuse_preprocessing_models, instrument, load_model, save_model, using_precision
 
 
 algorithm_types = [
@@ -117,6 +118,206 @@ def test_unsupervised_feature_preprocessor(multiclass_data, cls):
 # TODO: add test for SAE (but SAE takes a long time to run)
 
 
+@pytest.mark.parametrize(
+    'cls',
+    algorithms['data_descriptors'] + [a for a in algorithms['classifiers'] if issubclass(a, MultiClassClassifier)],
+)
+def test_batched_query(multiclass_data, cls):
+    X, y = multiclass_data
+    model = cls()(X, y) if issubclass(cls, MultiClassClassifier) else cls()(X[y == 0])
+
+    scores = model(X)
+    assert np.allclose(model.query_batched(X, batch_size=16), scores)
+    assert np.allclose(model.query_batched(X, max_memory=2**12), scores)
+    assert np.allclose(np.concatenate(list(model.query_batches(X, batch_size=64))), scores)
+
+
+def test_batched_query_buffers(multiclass_data):
+    from frlearn.data_descriptors import NND
+    from frlearn.feature_preprocessors import RangeNormaliser, Standardiser
+
+    X, y = multiclass_data
+    model = NND(preprocessors=(RangeNormaliser(), Standardiser()))(X)
+    scores = model(X)
+    nn_model = model.nn_model
+    batches = []
+    model.nn_model = lambda Z, k: batches.append(Z) or nn_model(Z, k)
+    assert np.array_equal(model.query_batched(X, batch_size=30), scores)
+    # The preprocessed batches are written into the same buffer.
+    assert len(batches) == 5 and all(np.shares_memory(batch, batches[0]) for batch in batches)
+    # Preprocessing is reported as part of each batched query.
+    with instrument(memory=False) as report:
+        model.query_batched(X, batch_size=30)
+    query = report.children['query NND.Model']
+    assert query.calls == 5 and query.children['query AffinePreprocessor'].calls == 5
+    # A single affine preprocessing model, which is not fused, also writes into a buffer.
+    model = NND(preprocessors=(RangeNormaliser(), ))(X)
+    scores = model(X)
+    nn_model = model.nn_model
+    batches.clear()
+    model.nn_model = lambda Z, k: batches.append(Z) or nn_model(Z, k)
+    assert np.array_equal(model.query_batched(X, batch_size=30), scores)
+    assert all(np.shares_memory(batch, batches[0]) for batch in batches)
+
+
+@pytest.mark.parametrize(
+    'cls',
+    algorithms['data_descriptors'] + [a for a in algorithms['classifiers'] if issubclass(a, MultiClassClassifier)],
+)
+def test_float32_precision(multiclass_data, cls):
+    X, y = multiclass_data
+    # Break ties, which may be resolved differently in single precision.
+    X = X + np.random.default_rng(0).uniform(0, 1e-3, X.shape)
+    construct = (lambda: cls()(X, y)) if issubclass(cls, MultiClassClassifier) else (lambda: cls()(X[y == 0]))
+
+    scores = construct()(X)
+    with using_precision(np.float32):
+        model = construct()
+    single_scores = model(X)
+    assert np.allclose(single_scores, scores, rtol=1e-4, atol=1e-5)
+    # Algorithms that wrap other libraries compute in the precision of those libraries.
+    if cls.__module__.startswith(('frlearn.neighbours', 'frlearn.statistics')):
+        assert single_scores.dtype == np.float32
+
+
+@pytest.mark.parametrize(
+    'cls',
+    algorithms['data_descriptors'] + [a for a in algorithms['classifiers'] if issubclass(a, MultiClassClassifier)],
+)
+def test_save_load(multiclass_data, cls, tmp_path):
+    X, y = multiclass_data
+    model = cls()(X, y) if issubclass(cls, MultiClassClassifier) else cls()(X[y == 0])
+
+    scores = model(X)
+    save_model(model, tmp_path, min_array_bytes=0)
+    assert np.array_equal(load_model(tmp_path)(X), scores)
+    assert np.array_equal(load_model(tmp_path, mmap_mode=None)(X), scores)
+
+
+def test_fuse_preprocessing_models(multiclass_data):
+    from frlearn.feature_preprocessors import FRFS, IQRNormaliser, RangeNormaliser
+
+    X, y = multiclass_data
+    models = []
+    Z = X
+    for preprocessor in [IQRNormaliser(), FRFS(), RangeNormaliser()]:
+        model = preprocessor(Z, y) if isinstance(preprocessor, ClassSupervised) else preprocessor(Z)
+        models.append(model)
+        Z = model(Z)
+
+    fused = fuse_preprocessing_models(models)
+    assert len(fused) == 1 and isinstance(fused[0], AffinePreprocessor)
+    assert fused[0].models == models
+    assert np.allclose(fused[0](X), Z)
+    out = np.empty_like(Z)
+    assert fused[0](X, out=out) is out
+    assert np.allclose(out, Z)
+
+    # The fused parameters keep the precision of those of the fused models.
+    from frlearn.data_descriptors import NND
+    from frlearn.feature_preprocessors import Standardiser
+    X = X.astype(np.float32)
+    model = NND(preprocessors=(RangeNormaliser(), Standardiser()))(X)
+    assert model.preprocessing_models[0](X).dtype == np.float32
+
+
+def test_instrument(multiclass_data):
+    from frlearn.classifiers import FRNN
+
+    X, y = multiclass_data
+    calls = []
+    with instrument(callback=lambda *args: calls.append(args)) as report:
+        model = FRNN()(X, y)
+        model(X)
+        model(X[:10])
+        with pytest.raises(RuntimeError):
+            with instrument():
+                pass
+
+    construct = report.children['construct FRNN']
+    query = report.children['query FRNN.Model']
+    assert construct.calls == 1 and construct.shapes == [X.shape]
+    assert construct.children['construct NND'].calls == 2 * len(np.unique(y))
+    assert query.calls == 2 and query.shapes == [X.shape, (10, X.shape[1])]
+    assert query.bytes > 0 and 0 <= query.self_time <= query.time
+    assert calls[-1][0] == ('query FRNN.Model', )
+    assert report.to_dict()['children'][0]['name'] == 'construct FRNN'
+    assert 'query NND.Model' in str(report)
+
+    model(X)
+    assert query.calls == 2
+
+
+@pytest.mark.parametrize(
+    'cls',
+    [a for a in algorithms['feature_preprocessors'] + algorithms['data_descriptors'] if getattr(a, '_streaming', False)],
+)
+def test_construct_streaming(multiclass_data, cls):
+    X, y = multiclass_data
+    scores = cls()(X)(X)
+    # Few enough instances for the quantile sketches to be exact.
+    assert np.allclose(cls().construct_streaming(X, chunk_size=17)(X), scores)
+    assert np.allclose(cls().construct_streaming(lambda: (X[i:i + 40] for i in range(0, len(X), 40)))(X), scores)
+
+
+@pytest.mark.parametrize('approximation', ['nystroem', 'fourier'])
+def test_svm_approximation(multiclass_data, approximation):
+    from frlearn.data_descriptors import SVM
+
+    X, y = multiclass_data
+    exact = SVM()(X[y == 1])(X)
+    scores = SVM(approximation=approximation, random_state=0)(X[y == 1])(X)
+    assert np.all((scores >= 0) & (scores <= 1))
+    assert np.corrcoef(scores, exact)[0, 1] > 0.8
+    with pytest.raises(ValueError):
+        SVM(approximation='linear')
+
+
+def test_if_parallel(multiclass_data, tmp_path):
+    from frlearn.data_descriptors import IF
+
+    X, y = multiclass_data
+    expected = IF(t=20)(X[y == 1])(X)
+    model = IF(t=20, n_jobs=2, chunk_size=40)(X[y == 1])
+    np.testing.assert_array_equal(model(X), expected)
+    np.testing.assert_array_equal(model(X), expected)
+    save_model(model, tmp_path / 'model')
+    np.testing.assert_array_equal(load_model(tmp_path / 'model')(X), expected)
+    # the worker processes do not outlive the construction and the queries
+    assert not multiprocessing.active_children()
+
+
+def test_eif_parallel(multiclass_data, tmp_path):
+    eif = pytest.importorskip('eif')
+    from frlearn.data_descriptors import EIF
+
+    X, y = multiclass_data
+    expected = 1 - eif.iForest(X[y == 1], ntrees=20, sample_size=50, seed=0, ExtensionLevel=3).compute_paths(X_in=X)
+    np.testing.assert_array_equal(EIF(t=20)(X[y == 1])(X), expected)
+    model = EIF(t=20, n_jobs=3)(X[y == 1])
+    np.testing.assert_allclose(model(X), expected)
+    save_model(model, tmp_path / 'model')
+    np.testing.assert_allclose(load_model(tmp_path / 'model')(X), expected)
+    assert not multiprocessing.active_children()
+
+
+def test_quantile_sketch():
+    from frlearn.statistics.streaming import QuantileSketch, RunningMoments
+
+    X = np.random.default_rng(0).standard_t(3, size=(100000, 3))
+    sketch = QuantileSketch()
+    moments = RunningMoments(covariance=True)
+    for i in range(0, len(X), 3001):
+        sketch.update(X[i:i + 3001])
+        moments.update(X[i:i + 3001])
+    q = np.array([5, 25, 50, 75, 95])
+    ranks = np.mean(X[:, None, :] <= sketch.quantiles(q)[None, :, :], axis=0)
+    assert np.all(np.abs(ranks - q[:, None]/100) < 0.01)
+    assert np.array_equal(sketch.minimum, X.min(axis=0)) and np.array_equal(sketch.maximum, X.max(axis=0))
+    assert np.allclose(moments.mean, X.mean(axis=0))
+    assert np.allclose(moments.covariance_matrix(), np.cov(X.T, bias=True))
+
+
 @pytest.mark.parametrize(
     'cls',
     algorithms['instance_preprocessors'],
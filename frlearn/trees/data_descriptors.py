@@ -3,9 +3,15 @@ from __future__ import annotations
 
 from typing import Callable
 
+import numpy as np
 from sklearn.ensemble import IsolationForest
+from sklearn.utils import check_random_state
 
 from frlearn.base import DataDescriptor
+from frlearn.trees.utilities import chunked_process_map, process_map, resolve_n_jobs
+
+# Number of trees of IF that are grown together, with one seed.
+_group_size = 10
 
 
 class EIF(DataDescriptor):
@@ -29,6 +35,13 @@ class EIF(DataDescriptor):
     random_state : int = 0
         Random state to use.
 
+    n_jobs : int = 1
+        Number of processes with which to score queries. -1 means using all processors.
+        With more than one process, the model does not grow a forest itself.
+        Instead, each query is scored by `n_jobs` worker processes,
+        each of which grows a consecutive block of the `t` trees and computes their path lengths.
+        Since eif seeds the `i`-th tree with `random_state + i`, these are the same trees as with one process.
+
     eif_params
         additional keyword parameters will be passed on as-is to eif's iForest constructor.
 
@@ -41,6 +54,11 @@ class EIF(DataDescriptor):
     `psi` and `t` are two hyperparameters that can potentially be tuned,
     but the default values should be good enough [2]_.
 
+    eif's forests cannot be pickled, so they cannot be shipped to worker processes or saved.
+    Instead, the model keeps the target data, from which worker processes and loaded copies of the model
+    grow the same trees. With more than one process, this means that the trees are grown again for each query,
+    in parallel. This takes much less time than scoring a large query.
+
     References
     ----------
     .. [1] `Hariri S, Carrasco Kind M, Brunner RJ (2021).
@@ -61,6 +79,7 @@ class EIF(DataDescriptor):
             psi: int | Callable[[int], int] = 256,
             t: int = 100,
             random_state: int = 0,
+            n_jobs: int = 1,
             preprocessors=(),
             **eif_params
     ):
@@ -72,19 +91,18 @@ class EIF(DataDescriptor):
         self.psi = psi
         self.t = t
         self.random_state = random_state
+        self.n_jobs = n_jobs
         self.eif_params = eif_params
 
     def _construct(self, X):
-        import eif
         model = super()._construct(X)
         model.psi = min(self.psi, X.shape[0])
         model.t = self.t
         model.random_state = self.random_state
-        model.forest = eif.iForest(
-            X,
-            ntrees=model.t, sample_size=model.psi, seed=model.random_state,
-            ExtensionLevel=X.shape[1] - 1, **self.eif_params
-        )
+        model.n_jobs = self.n_jobs
+        model.eif_params = self.eif_params
+        model.X = np.require(X, dtype=np.float64, requirements=['C', 'W'])
+        model.forest = model._grow_forest()
         return model
 
     class Model(DataDescriptor.Model):
@@ -92,11 +110,36 @@ class EIF(DataDescriptor):
         psi: int
         t: int
         random_state: int
+        n_jobs: int
+        eif_params: dict
+        X: np.array
         forest: ...
 
+        def __getstate__(self):
+            state = self.__dict__.copy()
+            state['forest'] = None
+            return state
+
+        def __setstate__(self, state):
+            self.__dict__.update(state)
+            self.forest = self._grow_forest()
+
+        def _grow_forest(self):
+            if resolve_n_jobs(self.n_jobs) > 1:
+                return None
+            return _grow_eif((self.X, self.psi, self.random_state, self.eif_params), (0, self.t))
+
         def _query(self, X):
-            # convert anomaly scores to normality scores
-            return 1 - self.forest.compute_paths(X_in=X)
+            X = np.require(X, dtype=np.float64, requirements=['C', 'W'])
+            if self.forest is not None:
+                # convert anomaly scores to normality scores
+                return 1 - self.forest.compute_paths(X_in=X)
+            blocks = np.array_split(np.arange(self.t), min(resolve_n_jobs(self.n_jobs), self.t))
+            scores = process_map(
+                _eif_block_scores, ((self.X, self.psi, self.random_state, self.eif_params), X),
+                [(block[0], len(block)) for block in blocks], self.n_jobs,
+            )
+            return 1 - _combine_scores(scores, [len(block) for block in blocks])
 
 
 class IF(DataDescriptor):
@@ -119,6 +162,17 @@ class IF(DataDescriptor):
     random_state : int = 0
         Random state to use.
 
+    n_jobs : int = 1
+        Number of processes to use. -1 means using all processors.
+        The trees are grown in groups of 10, with seeds drawn from `random_state` in advance,
+        so the result does not depend on `n_jobs`. Queries are scored in chunks.
+        The groups and the chunks are processed on a pool of `n_jobs` worker processes
+        that lasts for the duration of the construction or the query.
+        The fitted forests are passed to each worker process once per query.
+
+    chunk_size : int = 4096
+        Number of query instances scored at once by each process.
+
     preprocessors : iterable = ()
         Preprocessors to apply.
 
@@ -146,6 +200,8 @@ class IF(DataDescriptor):
             psi: int | Callable[[int], int] = 256,
             t: int = 100,
             random_state: int = 0,
+            n_jobs: int = 1,
+            chunk_size: int = 4096,
             preprocessors=(),
             **sklearn_params,
     ):
@@ -153,6 +209,8 @@ class IF(DataDescriptor):
         self.psi = psi
         self.t = t
         self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
         self.sklearn_params = sklearn_params
 
     def _construct(self, X):
@@ -160,10 +218,11 @@ class IF(DataDescriptor):
         model.psi = min(self.psi, X.shape[0])
         model.t = self.t
         model.random_state = self.random_state
-        model.forest = IsolationForest(
-            max_samples=model.psi, n_estimators=model.t, random_state=self.random_state,
-            **self.sklearn_params
-        ).fit(X)
+        model.n_jobs = self.n_jobs
+        model.chunk_size = self.chunk_size
+        sizes = [len(group) for group in np.array_split(np.arange(model.t), -(-model.t // _group_size))]
+        seeds = check_random_state(self.random_state).randint(np.iinfo(np.int32).max, size=len(sizes))
+        model.forests = process_map(_fit_if, (X, model.psi, self.sklearn_params), zip(sizes, seeds), self.n_jobs)
         return model
 
     class Model(DataDescriptor.Model):
@@ -171,8 +230,43 @@ class IF(DataDescriptor):
         psi: int
         t: int
         random_state: int
-        forest: IsolationForest
+        n_jobs: int
+        chunk_size: int
+        forests: list[IsolationForest]
 
         def _query(self, X):
-            # map from [-1, 0] to [0, 1]
-            return 1 + self.forest.score_samples(X)
+            return chunked_process_map(_if_scores, self.forests, X, self.chunk_size, self.n_jobs)
+
+
+def _grow_eif(target, block):
+    import eif
+    X, psi, random_state, eif_params = target
+    start, ntrees = block
+    return eif.iForest(
+        X, ntrees=ntrees, sample_size=psi, seed=random_state + start,
+        ExtensionLevel=X.shape[1] - 1, **eif_params
+    )
+
+
+def _eif_block_scores(shared, block):
+    target, X = shared
+    return _grow_eif(target, block).compute_paths(X_in=X)
+
+
+def _fit_if(shared, group):
+    X, psi, sklearn_params = shared
+    size, seed = group
+    return IsolationForest(max_samples=psi, n_estimators=size, random_state=seed, **sklearn_params).fit(X)
+
+
+def _combine_scores(scores, sizes):
+    # Isolation forests score a query as a power with as exponent the mean path length over all trees,
+    # negated and normalised by the same factor for any number of trees.
+    # Hence the score of several forests together is the geometric mean of their scores, weighted by size.
+    return np.exp(sum(size * np.log(score) for score, size in zip(scores, sizes)) / sum(sizes))
+
+
+def _if_scores(forests, X):
+    # scikit-learn's scores are negated anomaly scores; convert them to normality scores
+    scores = [-forest.score_samples(X) for forest in forests]
+    return 1 - _combine_scores(scores, [forest.n_estimators for forest in forests])
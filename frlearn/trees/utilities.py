@@ -0,0 +1,98 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable
+
+import numpy as np
+
+# Object shared by the tasks of a worker process, set by the initializer of its pool.
+_shared = None
+
+
+def resolve_n_jobs(n_jobs: int or None) -> int:
+    """
+    Helper method to obtain the number of processes to use, where -1 means using all processors,
+    and None means using one.
+    """
+    if n_jobs == -1:
+        return os.cpu_count() or 1
+    return max(n_jobs or 1, 1)
+
+
+def _initialise(shared):
+    global _shared
+    _shared = shared
+
+
+def _apply_shared(f: Callable, item):
+    return f(_shared, item)
+
+
+def process_map(f: Callable, shared, items: Iterable, n_jobs: int or None) -> list:
+    """
+    Helper method to apply `f(shared, item)` to each item on a pool of processes.
+
+    The pool is created for this call and shut down before it returns.
+    `shared` is passed to each worker process once, through the initializer of the pool,
+    rather than with each item.
+
+    Parameters
+    ----------
+    f: callable
+        Module-level function that takes `shared` and an item.
+
+    shared: object
+        Picklable object to pass to `f` with each item.
+
+    items: iterable
+        Picklable items.
+
+    n_jobs: int or None
+        Number of processes to use. If None or 1, or if there is only one item,
+        `f` is applied in the current process. If -1, the number of processors is used.
+
+    Returns
+    -------
+    results: list
+        The results of `f`, in the order of `items`.
+    """
+    items = list(items)
+    n_jobs = min(resolve_n_jobs(n_jobs), len(items))
+    if n_jobs <= 1:
+        return [f(shared, item) for item in items]
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_initialise, initargs=(shared, )) as executor:
+        return list(executor.map(_apply_shared, [f] * len(items), items))
+
+
+def chunked_process_map(f: Callable, obj, X, chunk_size: int, n_jobs: int or None) -> np.array:
+    """
+    Helper method to apply `f(obj, X)` to consecutive chunks of rows of `X`
+    on a pool of processes, and concatenate the results.
+    `obj` is passed to each worker process once, as with `process_map`.
+
+    Parameters
+    ----------
+    f: callable
+        Module-level function that takes `obj` and a chunk of `X` and returns an array with one value per row.
+
+    obj: object
+        Picklable object to pass to `f` with each chunk.
+
+    X: array shape=(q, m, )
+        Query instances.
+
+    chunk_size: int
+        Number of query instances per chunk.
+
+    n_jobs: int or None
+        Number of processes to use. If None or 1, or if `X` fits in one chunk,
+        `f` is applied to `X` directly in the current process. If -1, the number of processors is used.
+
+    Returns
+    -------
+    results: array shape=(q, )
+        The concatenated results of `f`.
+    """
+    if resolve_n_jobs(n_jobs) == 1 or len(X) <= chunk_size:
+        return f(obj, X)
+    chunks = [X[i:i + chunk_size] for i in range(0, len(X), chunk_size)]
+    return np.concatenate(process_map(f, obj, chunks, n_jobs))
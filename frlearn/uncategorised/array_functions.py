@@ -322,6 +322,9 @@ def _weighted_mean(a, weights, axis, type):
     if weights is None:
         return np.take(a, -1, axis=axis)
     w = weights(a.shape[axis])
+    if np.issubdtype(a.dtype, np.floating):
+        # Weights in the precision of the values, rather than upcasting them.
+        w = np.asarray(w, dtype=a.dtype)
     w = np.reshape(w, [-1] + ((len(a.shape) - axis - 1) % len(a.shape)) * [1])
     if type == 'arithmetic':
         return np.sum(w * a, axis=axis)
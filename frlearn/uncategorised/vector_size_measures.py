@@ -65,7 +65,7 @@ class MinkowskiSize:
             if self.unrooted:
                 result = np.sum(np.where(np.abs(u) < 1, 0, np.where(np.abs(u) > 1, np.inf, 1)), axis=axis)
             else:
-                result = np.max(u, axis=axis)
+                result = np.max(np.abs(u), axis=axis)
         else:
             result = np.sum(np.abs(u) ** self.p, axis=axis)
             if not self.unrooted:
@@ -5,6 +5,7 @@ from frlearn.neighbour_search_methods import BallTree
 from frlearn.classifiers import FRNN
 from sklearn.model_selection import KFold
 from sklearn.metrics import balanced_accuracy_score
+from scipy.stats import t
 from frlearn.base import select_class
 
 from .relations_base import DistanceFunction, DistanceFunctionFactory
@@ -21,11 +22,24 @@ def get_new_factories():
     return factories
 
 
+def minkowski_native_metric(size: MinkowskiSize, m):
+    """
+    Native metric equivalent to the dissimilarity induced by a rooted Minkowski size with `p >= 1`,
+    in the form returned by `native_metric`: the name of the metric, `p` and the scale factor.
+    This lets neighbour searches use the native metric instead of calling the wrapper for each pair of instances.
+    """
+    scale = 1/m**(1/size.p) if size.scale_by_dimensionality else 1
+    return 'minkowski', size.p, scale
+
+
 class ManhattanDistanceFactory(DistanceFunctionFactory):
     """
     Factory that returns a wrapper for frlearn's Manhattan distance
     """
 
+    def cache_key(self):
+        return ()
+
     def get_metric(self) -> DistanceFunction:
         return ManhattanDistanceFactory.ManhattanDistance()
 
@@ -42,12 +56,18 @@ class ManhattanDistanceFactory(DistanceFunctionFactory):
         def __call__(self, a, b):
             return self.dist(b - a)
 
+        def native_metric(self, m):
+            return minkowski_native_metric(self.dist, m)
+
 
 class EuclideanDistanceFactory(DistanceFunctionFactory):
     """
     Factory that returns a wrapper for frlearn's Euclidean distance
     """
 
+    def cache_key(self):
+        return ()
+
     def get_metric(self) -> DistanceFunction:
         return EuclideanDistanceFactory.EuclideanDistance()
 
@@ -64,12 +84,18 @@ class EuclideanDistanceFactory(DistanceFunctionFactory):
         def __call__(self, a, b):
             return self.dist(b - a)
 
+        def native_metric(self, m):
+            return minkowski_native_metric(self.dist, m)
+
 
 class ChebyshevDistanceFactory(DistanceFunctionFactory):
     """
     Factory that returns a wrapper for frlearn's Chebyshev distance
     """
 
+    def cache_key(self):
+        return ()
+
     def get_metric(self) -> DistanceFunction:
         return ChebyshevDistanceFactory.ChebyshevDistance()
 
@@ -86,18 +112,41 @@ class ChebyshevDistanceFactory(DistanceFunctionFactory):
         def __call__(self, a, b):
             return self.dist(b - a)
 
+        def native_metric(self, m):
+            return minkowski_native_metric(self.dist, m)
+
 
 class CorrelationFactory(DistanceFunctionFactory):
     """
     Factory that returns the fraction distance derived from the correlation.
+    If euclidean_search is True, the returned distance lets neighbour searches centre and unit-normalise
+    the instances once and search them with the native Euclidean distance,
+    which gives the same results up to rounding.
+    The correlation is undefined for instances at the averages. Their distance is 0 to each other,
+    and 1/2, that of uncorrelated instances, to all other instances.
     """
 
-    __slots__ = ('averages',)
+    __slots__ = ('averages', 'euclidean_search', )
+
+    def __init__(self, euclidean_search=False):
+        self.euclidean_search = euclidean_search
 
     def fit(self, X, y=None):
         self.averages = np.mean(X, axis=0)
 
+    def cache_key(self):
+        return (self.euclidean_search, )
+
+    def can_apply(self, X, y=None) -> bool:
+        # the distance is uninformative if all instances are at the averages, fitted or otherwise those of X
+        averages = getattr(self, 'averages', None)
+        if averages is None:
+            averages = np.mean(X, axis=0)
+        return bool(np.any(X != averages))
+
     def get_metric(self) -> DistanceFunction:
+        if self.euclidean_search:
+            return CorrelationFactory.EuclideanCorrelationDistance(self.averages)
         return CorrelationFactory.CorrelationDistance(self.averages)
 
     @staticmethod
@@ -115,17 +164,51 @@ class CorrelationFactory(DistanceFunctionFactory):
             self.averages = averages
 
         def __call__(self, a, b):
-            nom = np.sum(np.multiply(a - self.averages, b - self.averages))
-            den = np.sqrt(np.sum(np.square(a - self.averages)) * np.sum(np.square(b - self.averages)))
+            a, b = a - self.averages, b - self.averages
+            nom = np.sum(np.multiply(a, b))
+            den = np.sqrt(np.sum(np.square(a)) * np.sum(np.square(b)))
+            if den == 0:
+                return 0. if not (a.any() or b.any()) else .5
             return (1 - nom / den) / 2
 
+    class EuclideanCorrelationDistance(CorrelationDistance):
+        """
+        Correlation distance based on fraction conversion, which can be calculated from the Euclidean distance
+        between centred, unit-normalised instances.
+        """
+
+        def embed(self, X):
+            # Instances at the averages are embedded on an extra axis, at Euclidean distance sqrt(2),
+            # i.e. correlation distance 1/2, from all other instances.
+            X = X - self.averages
+            norms = np.linalg.norm(X, axis=-1, keepdims=True)
+            at_averages = norms == 0
+            X = np.divide(X, norms, out=np.zeros_like(X), where=~at_averages)
+            return np.concatenate([X, at_averages.astype(X.dtype)], axis=-1)
+
+        def from_euclidean(self, distances):
+            return unit_euclidean_to_cosine_distance(distances)
+
 
 class CosineMeasureFactory(DistanceFunctionFactory):
     """
     Factory that returns the classical normalised distance derived from the cosine similarity measure.
+    If euclidean_search is True, the returned distance lets neighbour searches unit-normalise
+    the instances once and search them with the native Euclidean distance,
+    which gives the same results up to rounding.
     """
 
+    __slots__ = ('euclidean_search', )
+
+    def __init__(self, euclidean_search=False):
+        self.euclidean_search = euclidean_search
+
+    def cache_key(self):
+        return (self.euclidean_search, )
+
     def get_metric(self) -> DistanceFunction:
+        if self.euclidean_search:
+            return CosineMeasureFactory.EuclideanCosineDistance()
         return CosineMeasureFactory.CosineDistance()
 
     def can_apply(self, X, y=None) -> bool:
@@ -139,6 +222,32 @@ class CosineMeasureFactory(DistanceFunctionFactory):
         def __call__(self, a, b):
             return (1 - np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))/2
 
+    class EuclideanCosineDistance(CosineDistance):
+        """
+        Cosine distance that can be calculated from the Euclidean distance between unit-normalised instances.
+        """
+
+        def embed(self, X):
+            return unit_normalise(X)
+
+        def from_euclidean(self, distances):
+            return unit_euclidean_to_cosine_distance(distances)
+
+
+def unit_normalise(X):
+    """
+    Divides each row of X by its Euclidean norm.
+    """
+    return X / np.linalg.norm(X, axis=-1, keepdims=True)
+
+
+def unit_euclidean_to_cosine_distance(distances):
+    """
+    Converts Euclidean distances between unit vectors into the cosine distance (1 - cos)/2.
+    For unit vectors u and v, ||u - v||^2 = 2 - 2 cos(u, v), so (1 - cos(u, v))/2 = ||u - v||^2 / 4.
+    """
+    return np.square(distances) / 4
+
 
 class CanberraFactory(DistanceFunctionFactory):
     """
@@ -150,6 +259,9 @@ class CanberraFactory(DistanceFunctionFactory):
     def fit(self, X, y=None):
         self.dimension = X.shape[1]
 
+    def cache_key(self):
+        return ()
+
     def get_metric(self) -> DistanceFunction:
         return CanberraFactory.CanberraDistance(self.dimension)
 
@@ -169,34 +281,55 @@ class CanberraFactory(DistanceFunctionFactory):
             #  in the canberra metric, we set 0/0 to be 0
             return np.sum(np.divide(nom, den, out=np.zeros_like(nom), where=den != 0))/self.dimension
 
+        def native_metric(self, m):
+            return 'canberra', None, 1/self.dimension
+
 
 class COMBOFactory(DistanceFunctionFactory):
     """
     Factory that selects the best distance for a given training set using cross-validation.
+
+    In racing mode, all distances are evaluated on the first race_min_folds folds, after which every fold
+    is only given to the distances that are not significantly worse than the current best one,
+    according to a one-sided paired t-test on the fold accuracies with significance level race_alpha.
+    race_min_folds should be at least 3, so that the test has at least 2 degrees of freedom.
+    If the differences in accuracy with the best distance are the same on each fold, the test does not apply,
+    and a distance is only dropped if it is worse by more than race_tolerance.
     """
 
-    __slots__ = ('distances', 'folds', 'fitted_factory', 'k', 'weights', 'verbose',)
+    __slots__ = ('distances', 'folds', 'fitted_factory', 'k', 'weights', 'verbose',
+                 'racing', 'race_min_folds', 'race_alpha', 'race_tolerance',)
 
     def __init__(self,
                  distances=None,
                  folds=5,
                  k=20,
                  weights=LinearWeights(),
-                 verbose=False
+                 verbose=False,
+                 racing=False,
+                 race_min_folds=3,
+                 race_alpha=0.05,
+                 race_tolerance=0.05
                  ):
         if distances is None:
             distances = get_new_factories()
+        if racing and not 3 <= race_min_folds <= folds:
+            raise ValueError('race_min_folds must be at least 3 and at most the number of folds.')
         self.distances = distances
         self.folds = folds
         self.k = k
         self.weights = weights
         self.verbose = verbose
+        self.racing = racing
+        self.race_min_folds = race_min_folds
+        self.race_alpha = race_alpha
+        self.race_tolerance = race_tolerance
 
     def fit(self, X, y=None):
         distances = self.distances.copy()
         accuracies = {f: [] for f in distances}
         kf = KFold(n_splits=self.folds, shuffle=True, random_state=0)
-        for train_index, test_index in kf.split(X, y):
+        for fold, (train_index, test_index) in enumerate(kf.split(X, y)):
             # get the train and test sets of this fold
             x_train, x_test = X[train_index], X[test_index]
             y_train, y_test = y[train_index], y[test_index]
@@ -206,24 +339,11 @@ class COMBOFactory(DistanceFunctionFactory):
 
             # calculate the accuracies for FRNN with each measure on this fold
             for measure in distances:
-                # fit the measure to the training set
-                # print(measure.get_name())
-                measure.fit(x_train, y_train)
-                # instantiate the FRNN classifier factory
-                clf = FRNN(preprocessors=(),
-                           nn_search=BallTree(),
-                           dissimilarity=measure.get_metric(),
-                           lower_k=self.k,
-                           upper_k=self.k,
-                           lower_weights=self.weights,
-                           upper_weights=self.weights)
-                # construct the model
-                model = clf(x_train, y_train)
-                # query on the test set
-                scores = model(x_test)
-                # select classes with the highest scores and calculate the accuracy.
-                classes = select_class(scores, labels=model.classes)
-                accuracies[measure].append(balanced_accuracy_score(y_test, classes))
+                accuracies[measure].append(self._fold_accuracy(measure, x_train, y_train, x_test, y_test))
+
+            # stop evaluating distances which are clearly worse than the best one so far
+            if self.racing and fold + 1 >= self.race_min_folds:
+                distances = self._drop_dominated(distances, accuracies)
 
         # select the distance with the best average accuracy which never failed
         avg_accuracies = {f: sum(accuracies[f]) / self.folds for f in distances}
@@ -237,6 +357,55 @@ class COMBOFactory(DistanceFunctionFactory):
         best.fit(X, y)
         self.fitted_factory = best
 
+    def cache_key(self):
+        keys = [f.cache_key() for f in self.distances]
+        if any(key is None for key in keys):
+            return None
+        return (tuple(zip(map(type, self.distances), keys)), self.folds, self.k, self.weights,
+                self.racing, self.race_min_folds, self.race_alpha, self.race_tolerance, )
+
+    def _fold_accuracy(self, measure, x_train, y_train, x_test, y_test):
+        # fit the measure to the training set
+        measure.fit(x_train, y_train)
+        # instantiate the FRNN classifier factory
+        clf = FRNN(preprocessors=(),
+                   nn_search=BallTree(),
+                   dissimilarity=measure.get_metric(),
+                   lower_k=self.k,
+                   upper_k=self.k,
+                   lower_weights=self.weights,
+                   upper_weights=self.weights)
+        # construct the model
+        model = clf(x_train, y_train)
+        # query on the test set
+        scores = model(x_test)
+        # select classes with the highest scores and calculate the accuracy.
+        classes = select_class(scores, labels=model.classes)
+        return balanced_accuracy_score(y_test, classes)
+
+    def _drop_dominated(self, distances, accuracies):
+        """
+        Racing step: removes the distances whose fold accuracies are significantly lower than those
+        of the distance with the best mean accuracy so far, using a one-sided paired t-test.
+        All remaining distances have been evaluated on the same folds.
+        """
+        if len(distances) < 2:
+            return distances
+        scores = np.array([accuracies[m] for m in distances])
+        n_folds = scores.shape[1]
+        differences = scores[np.argmax(np.mean(scores, axis=1))] - scores
+        mean_differences = np.mean(differences, axis=1)
+        std = np.std(differences, axis=1, ddof=1)
+        margin = t.ppf(1 - self.race_alpha, df=n_folds - 1) * std / np.sqrt(n_folds)
+        # without variance, the t-test is not evidence of a difference
+        margin[np.isclose(std, 0)] = self.race_tolerance
+        dominated = mean_differences > margin
+        if self.verbose:
+            for m, d in zip(distances, dominated):
+                if d:
+                    print(f'dropped {m.get_name()} after {n_folds} folds')
+        return [m for m, d in zip(distances, dominated) if not d]
+
     def get_metric(self) -> DistanceFunction:
         return self.fitted_factory.get_metric()
 
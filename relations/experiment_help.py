@@ -19,7 +19,9 @@ from sklearn.metrics import balanced_accuracy_score
 from frlearn.base import select_class
 from frlearn.classifiers import FRNN
 from frlearn.feature_preprocessors import RangeNormaliser
-from frlearn.neighbour_search_methods import BallTree
+from frlearn.neighbour_search_methods import BallTree, BruteForce, DistanceCache
+
+from .fit_cache import FitCache
 
 
 def compare_measures(folder_path,
@@ -28,10 +30,15 @@ def compare_measures(folder_path,
                      k=3,
                      remove_cat=True,
                      weights=LinearWeights(),
-                     normaliser=RangeNormaliser()):
+                     normaliser=RangeNormaliser(),
+                     cache: DistanceCache = None,
+                     fit_cache: FitCache = None):
     """
     This is a help function for comparing FRNN with different similarity relations on a dataset using cross-validation.
     Returns a 2D array containing the balanced accuracies of each measure on each fold of the dataset.
+    If a DistanceCache is given, the distances between the test and training instances of each fold are
+    calculated once per measure and stored, so that repeated comparisons look them up instead.
+    If a FitCache is given, measures that were already fitted to a training set restore their fitted state from it.
     -------
 
     """
@@ -52,24 +59,36 @@ def compare_measures(folder_path,
         for measure in distances:
             if measure.can_apply(x_train_n, y_train) and measure.can_apply(x_test_n, y_test):
                 # fit the measure to the training set
-                measure.fit(x_train_n, y_train)
+                if fit_cache is not None:
+                    fit_cache.fit(measure, x_train_n, y_train)
+                else:
+                    measure.fit(x_train_n, y_train)
+                metric = measure.get_metric()
+                nn_search = BallTree()
+                x_train_q, x_test_q = x_train_n, x_test_n
+                if cache is not None:
+                    # look up the distances from all instances to the training instances
+                    metric = cache(metric, np.concatenate([x_train_n, x_test_n]), n=len(x_train_n),
+                                   name=measure.get_name())
+                    x_train_q, x_test_q = metric.indices(0, len(x_train_n)), metric.indices(len(x_train_n))
+                    nn_search = BruteForce()
                 # instantiate the FRNN classifier factory
                 clf = FRNN(preprocessors=(),
-                           nn_search=BallTree(),
-                           dissimilarity=measure.get_metric(),
+                           nn_search=nn_search,
+                           dissimilarity=metric,
                            lower_k=k,
                            upper_k=k,
                            lower_weights=weights,
                            upper_weights=weights)
                 # construct the model
-                model = clf(x_train_n, y_train)
+                model = clf(x_train_q, y_train)
                 # query on the test set
-                scores = model(x_test_n)
+                scores = model(x_test_q)
                 # select classes with the highest scores and calculate the accuracy.
                 classes = select_class(scores, labels=model.classes)
                 fold_accuracies.append(balanced_accuracy_score(y_test, classes))
             else:
-                fold_accuracies.append(np.NaN)
+                fold_accuracies.append(np.nan)
         accuracies.append(fold_accuracies)
     return accuracies
 
@@ -84,7 +103,8 @@ def test_save(measures_to_test,
               weights=LinearWeights(),
               normaliser=RangeNormaliser(),
               k=20,
-              nr_of_folds=10
+              nr_of_folds=10,
+              fit_cache: FitCache = None
               ):
     for dataset_dir in datasets_folder.iterdir():
         if dataset_dir.name != ".gitignore":
@@ -118,8 +138,11 @@ def test_save(measures_to_test,
                         if not (fold_result_path / f"{measure.get_name()}_fold{fold + 1}.dat").is_file():
                             # check that we can apply the measure to both train and test sets
                             if measure.can_apply(x_train_n, y_train) and measure.can_apply(x_test_n, y_test):
-                                # fit the measure to the training set
-                                measure.fit(x_train_n, y_train)
+                                # fit the measure to the training set, or restore it from an earlier run
+                                if fit_cache is not None:
+                                    fit_cache.fit(measure, x_train_n, y_train)
+                                else:
+                                    measure.fit(x_train_n, y_train)
                                 # instantiate the FRNN classifier factory
                                 clf = FRNN(preprocessors=(),
                                            nn_search=BallTree(),
@@ -269,5 +292,5 @@ def calculate_score(data_folder,
                 # add scores to pandas dataframe
                 for s in wanted_measures:
                     frame.at[short_name, s] = \
-                        sum_of_metrics[s]/successful_results[s] if s in sum_of_metrics.keys() else np.NaN
+                        sum_of_metrics[s]/successful_results[s] if s in sum_of_metrics.keys() else np.nan
     return frame
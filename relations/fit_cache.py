@@ -0,0 +1,151 @@
+"""
+On-disk cache of fitted distance function factories.
+
+Classes:
+    FitCache
+"""
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+from .relations_base import DistanceFunctionFactory
+
+
+class FitCache:
+    """
+    Cache that stores the state that a DistanceFunctionFactory obtains by fitting it to a data set
+    (e.g. `matrix` and `max_d` of the Mahalanobis factories, `gamma` of the kernel factories,
+    or the selected factory of COMBOFactory) in a directory, and restores it when the same factory
+    is fitted to the same data set again, instead of repeating the fit.
+
+    Entries are keyed by a fingerprint of X and y, and of the class of the factory and its `cache_key()`,
+    which lists the hyperparameters that determine the result of its fit. Factories whose `cache_key()` is None
+    (e.g. those with warm_start, whose result depends on previous fits) are always fitted.
+    Each entry holds every attribute of the fitted factory, except those that cannot be pickled
+    and that the fit did not change, so that it can be restored into a fresh factory with the same key.
+    Random fits (e.g. the gradient kernel factories) become deterministic: they return the first result that was stored.
+    When the entries take up more than max_bytes, the least recently used ones are removed.
+    """
+
+    def __init__(self, directory, max_bytes=2**30):
+        """
+        Parameters
+        ----------
+        directory   directory in which to store the fitted states, created if it does not exist
+        max_bytes   maximum total size of the stored states
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def fit(self, factory: DistanceFunctionFactory, X, y=None):
+        """
+        Fit factory to (X, y), or restore the state it obtained from an identical earlier fit.
+
+        Parameters
+        ----------
+        factory     DistanceFunctionFactory to fit
+        X           conditional attribute values for the samples
+        y           classes for the samples
+
+        Returns
+        -------
+        True if the state was restored from the cache, False if the factory was fitted
+        """
+        key = factory.cache_key()
+        if key is None:
+            factory.fit(X, y)
+            return False
+        digest = hashlib.sha256(_fingerprint((type(factory), key)).encode())
+        digest.update(_fingerprint(X).encode())
+        digest.update(_fingerprint(y).encode())
+        path = os.path.join(self.directory, f'{digest.hexdigest()}.pickle')
+
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                fitted_state = pickle.load(f)
+            for name, value in fitted_state.items():
+                setattr(factory, name, pickle.loads(value))
+            os.utime(path)
+            return True
+
+        unfitted = {name: _fingerprint(value) for name, value in _state(factory).items()}
+        factory.fit(X, y)
+        fitted_state = {}
+        for name, value in _state(factory).items():
+            try:
+                fitted_state[name] = pickle.dumps(value)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                # e.g. a lambda, which a fresh factory with the same key already holds, unless the fit set it
+                if unfitted.get(name) != _fingerprint(value):
+                    return False
+        os.makedirs(self.directory, exist_ok=True)
+        partial_path = f'{path}.{os.getpid()}.partial'
+        with open(partial_path, 'wb') as f:
+            pickle.dump(fitted_state, f)
+        os.replace(partial_path, path)
+        self._evict()
+        return False
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+
+def _state(obj) -> dict:
+    """
+    Attributes of obj, including those stored in slots.
+    """
+    state = dict(getattr(obj, '__dict__', {}))
+    for cls in type(obj).__mro__:
+        slots = getattr(cls, '__slots__', ())
+        for name in [slots] if isinstance(slots, str) else slots:
+            if name not in ('__dict__', '__weakref__') and name not in state and hasattr(obj, name):
+                state[name] = getattr(obj, name)
+    return state
+
+
+def _fingerprint(value, seen=None) -> str:
+    """
+    Hash of value that only depends on its contents, also for arrays, functions and objects that cannot be pickled.
+    """
+    seen = set() if seen is None else seen
+    digest = hashlib.sha256()
+    if isinstance(value, np.ndarray):
+        digest.update(repr((value.shape, str(value.dtype))).encode())
+        digest.update(np.ascontiguousarray(value).data)
+    elif value is None or isinstance(value, (str, bytes, bool, int, float, complex, np.generic)):
+        digest.update(repr((type(value).__name__, value)).encode())
+    elif isinstance(value, type):
+        digest.update(f'{value.__module__}.{value.__qualname__}'.encode())
+    elif id(value) in seen:
+        digest.update(b'cycle')
+    else:
+        seen.add(id(value))
+        digest.update(f'{type(value).__module__}.{type(value).__qualname__}'.encode())
+        if isinstance(value, (list, tuple, set, frozenset)):
+            items = [_fingerprint(v, seen) for v in value]
+            digest.update(''.join(sorted(items) if isinstance(value, (set, frozenset)) else items).encode())
+        elif isinstance(value, dict):
+            items = sorted(_fingerprint(k, seen) + _fingerprint(v, seen) for k, v in value.items())
+            digest.update(''.join(items).encode())
+        elif hasattr(value, '__code__'):
+            # functions, including lambdas: their code, constants, defaults and closure
+            code = value.__code__
+            digest.update(code.co_code)
+            digest.update(_fingerprint([getattr(c, 'co_code', c) for c in code.co_consts], seen).encode())
+            digest.update(_fingerprint(value.__defaults__, seen).encode())
+            digest.update(_fingerprint([c.cell_contents for c in value.__closure__ or ()], seen).encode())
+        else:
+            digest.update(_fingerprint(_state(value), seen).encode())
+    return digest.hexdigest()
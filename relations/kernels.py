@@ -45,6 +45,9 @@ class KernelFactory(DistanceFunctionFactory, ABC):
         elif type(self.gamma) == int or type(self.gamma) == float:
             self._gamma = self.gamma
 
+    def cache_key(self):
+        return (self.kernel, self.gamma, )
+
     def get_metric(self) -> DistanceFunction:
         return KernelDistance(self.kernel(self._gamma))
 
@@ -213,7 +216,7 @@ class GradientKernelFactory(DistanceFunctionFactory, ABC):
         n_samples, self.n_features = X.shape
         self.X = X
         self.y = y
-        prev_delta = np.Infinity  # previous delta between the old and new values for gamma
+        prev_delta = np.inf  # previous delta between the old and new values for gamma
         it = 0  # iteration counter
         self.gamma = self.initial_gamma  # reset the value of gamma, learning should start from scratch
 
@@ -236,6 +239,10 @@ class GradientKernelFactory(DistanceFunctionFactory, ABC):
         if self.verbose:
             print(f'Iteration stopped on iteration {it} with final delta of {prev_delta} and gamma of {self.gamma}')
 
+    def cache_key(self):
+        return (self.kernel, self.gradient, self.initial_gamma, self.batch_size, self.k, self.weights,
+                self.learning_rate, self.max_its, self.precision, )
+
     def get_metric(self) -> DistanceFunction:
         return KernelDistance(lambda a, b: self.kernel(a, b, self.gamma))
 
@@ -1,3 +1,5 @@
+import itertools
+
 import numpy as np
 from abc import ABC
 
@@ -44,6 +46,16 @@ class MahalanobisDistanceFactory(DistanceFunctionFactory, ABC):
                 if d12 > self.max_d:
                     self.max_d = d12
 
+    def cache_key(self):
+        # factories that learn the matrix with a model also depend on its hyperparameters,
+        # and with warm_start, on previous fits
+        model = getattr(self, 'model', None)
+        if model is None:
+            return (self.squared, )
+        if model.warm_start:
+            return None
+        return (self.squared, model.get_params(), )
+
     def get_metric(self) -> DistanceFunction:
         return MahalanobisDistanceFunction(self.matrix, self.max_d, self.squared)
 
@@ -85,20 +97,43 @@ def neighbour_applier(y, k) -> bool:
     -------
     True if y the above holds.
     """
-    return k <= np.bincount(np.unique(y, return_inverse=True)[1]).min(initial=np.infty)
+    return k <= np.bincount(np.unique(y, return_inverse=True)[1]).min(initial=np.inf)
+
+
+def fit_folds(factory, X, y, folds):
+    """
+    Fits a factory on the training part of each fold in turn, so that a warm-started factory
+    (e.g. `NCAFactory(warm_start=True)`) chains its fits from one fold to the next.
+
+    Parameters
+    ----------
+    factory     DistanceFunctionFactory to fit
+    X           Data set
+    y           Labels
+    folds       Iterable of (train_index, test_index) pairs, e.g. `StratifiedKFold(...).split(X, y)`
+
+    Returns
+    -------
+    Generator that yields (train_index, test_index) after fitting the factory on that fold,
+    so the caller can use `factory.get_metric()` before the next fold is fitted.
+    """
+    for train_index, test_index in folds:
+        factory.fit(X[train_index], y[train_index])
+        yield train_index, test_index
 
 
 class NCAFactory(MahalanobisDistanceFactory):
     """
     Factory which uses a de-cythonized version of pyDML's NCA implementation.
     It divides by the maximum distance.
+    With `warm_start`, each fit continues from the transform learned by the previous fit.
     """
 
     __slots__ = ('model', 'matrix', 'squared', )
 
-    def __init__(self, squared=False):
+    def __init__(self, squared=False, warm_start=False):
         super(NCAFactory, self).__init__(squared=squared)
-        self.model = NCA()
+        self.model = NCA(warm_start=warm_start)
 
     def fit(self, X, y=None):
         self.model.fit(X=X, y=y)
@@ -117,14 +152,15 @@ class LMNNFactory(MahalanobisDistanceFactory):
     """
     Factory which uses a de-cythonized version of pyDML's LMNN implementation.
     It divides by the maximum distance.
+    With `warm_start`, each fit continues from the metric learned by the previous fit.
     """
 
     __slots__ = ('model', 'matrix', 'k', 'squared', )
 
-    def __init__(self, k, squared=False):
+    def __init__(self, k, squared=False, warm_start=False):
         super(LMNNFactory, self).__init__(squared=squared)
         self.k = k
-        self.model = LMNN(k=k)
+        self.model = LMNN(k=k, warm_start=warm_start)
 
     def fit(self, X, y=None):
         self.model.fit(X=X, y=y)
@@ -142,6 +178,7 @@ class LMNNFactory(MahalanobisDistanceFactory):
 class DMLMJFactory(MahalanobisDistanceFactory):
     """
     Factory which uses a de-cythonized version of pyDML's DMLMJ implementation.
+    With `warm_start`, each fit updates the scatter matrices of the previous fit with the neighbour pairs that changed.
     """
     __slots__ = ('model', 'matrix', 'k',)
 
@@ -150,13 +187,15 @@ class DMLMJFactory(MahalanobisDistanceFactory):
                  num_dims=None,
                  alpha=0.001,
                  reg_tol=1e-10,
-                 squared=False):
+                 squared=False,
+                 warm_start=False):
         super(DMLMJFactory, self).__init__(squared=squared)
         self.k = n_neighbors
         self.model = DMLMJ(num_dims=num_dims,
                            n_neighbors=n_neighbors,
                            alpha=alpha,
-                           reg_tol=reg_tol)
+                           reg_tol=reg_tol,
+                           warm_start=warm_start)
 
     def fit(self, X, y=None):
         self.model.fit(X=X, y=y)
@@ -171,14 +210,94 @@ class DMLMJFactory(MahalanobisDistanceFactory):
         return "dmlmj"
 
 
+class QuantisedRowIndex:
+    """
+    Hash index over the rows of a data matrix, which finds the same rows as `np.isclose(a, X).all(axis=1)`
+    without comparing `a` to every row of `X`.
+
+    Rows are hashed on their coordinates quantised to cells that are much wider than the `isclose` tolerance,
+    so a close row can only lie in the same cell as `a`, or in the adjacent cell for the (rare) coordinates
+    of `a` that lie within tolerance of a cell boundary. All candidate rows from these cells are then checked
+    with `np.isclose`, so hash collisions never produce false matches.
+    If the cell coordinates of the rows do not fit comfortably in 64-bit integers (i.e. their magnitude
+    is at least 2**62, e.g. for huge values, a tiny tolerance or non-finite values), the index falls back
+    to comparing `a` to every row, as it does for queries whose cell coordinates do not fit.
+    """
+
+    __slots__ = ('X', 'rtol', 'atol', 'tolerance', 'cell_size', 'buckets', 'max_ambiguous', )
+
+    def __init__(self, X, rtol=1e-05, atol=1e-08, cell_factor=1024, max_ambiguous=4):
+        """
+        Parameters
+        ----------
+        X               data matrix to index
+        rtol            relative tolerance, as in `np.isclose`
+        atol            absolute tolerance, as in `np.isclose`
+        cell_factor     width of the quantisation cells, as a multiple of the per-feature tolerance
+        max_ambiguous   maximum number of coordinates near a cell boundary for which adjacent cells are
+                        looked up, beyond which we fall back to a full scan
+        """
+        self.X = X
+        self.rtol = rtol
+        self.atol = atol
+        # upper bound for atol + rtol * |x| over all rows x, per feature
+        self.tolerance = atol + rtol * np.max(np.abs(X), axis=0)
+        self.cell_size = cell_factor * self.tolerance
+        self.max_ambiguous = max_ambiguous
+        self.buckets = None
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            cells = np.floor(X / self.cell_size)
+        if _fits_cells(cells):
+            self.buckets = dict()
+            for i, key in enumerate(cells.astype(np.int64)):
+                self.buckets.setdefault(key.tobytes(), []).append(i)
+
+    def __call__(self, a):
+        """
+        Returns the indices of the rows x of X for which `np.isclose(a, x).all()` holds, in increasing order.
+        """
+        if self.buckets is None:
+            return self._scan(a)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            lower = np.floor((a - self.tolerance) / self.cell_size)
+            upper = np.floor((a + self.tolerance) / self.cell_size)
+        if not (_fits_cells(lower) and _fits_cells(upper)):
+            return self._scan(a)
+        lower, upper = lower.astype(np.int64), upper.astype(np.int64)
+        ambiguous = np.flatnonzero(lower != upper)
+        if len(ambiguous) > self.max_ambiguous:
+            return self._scan(a)
+        candidates = []
+        for choice in itertools.product(*[(lower[j], upper[j]) for j in ambiguous]):
+            key = lower.copy()
+            key[ambiguous] = choice
+            candidates.extend(self.buckets.get(key.tobytes(), ()))
+        if not candidates:
+            return np.empty(0, dtype=int)
+        candidates = np.sort(candidates)
+        close = np.isclose(a, self.X[candidates], rtol=self.rtol, atol=self.atol).all(axis=1)
+        return candidates[close]
+
+    def _scan(self, a):
+        return np.flatnonzero(np.isclose(a, self.X, rtol=self.rtol, atol=self.atol).all(axis=1))
+
+
+def _fits_cells(cells) -> bool:
+    """
+    Checks whether quantised cell coordinates can be cast to int64 without overflow, with a safety margin.
+    This is False for non-finite coordinates.
+    """
+    return bool(np.all(np.abs(cells) < 2.**62))
+
+
 class ClassMahalanobisDistanceFunction(DistanceFunction):
     """
     Class specific Mahalanobis pseudo-metric that is normalised and can be squared or not.
     """
 
-    __slots__ = ('matrix_dict', 'overall_matrix', 'overall_max_d', 'max_d_dict', 'X', 'y', 'squared', )
+    __slots__ = ('matrix_dict', 'overall_matrix', 'overall_max_d', 'max_d_dict', 'X', 'y', 'squared', 'row_index', )
 
-    def __init__(self, matrix_dict, overall_matrix, max_d_dict, overall_max_d, X, y, squared):
+    def __init__(self, matrix_dict, overall_matrix, max_d_dict, overall_max_d, X, y, squared, row_index=None):
         self.matrix_dict = matrix_dict
         self.overall_matrix = overall_matrix
         self.max_d_dict = max_d_dict
@@ -186,35 +305,74 @@ class ClassMahalanobisDistanceFunction(DistanceFunction):
         self.X = X
         self.y = y
         self.squared = squared
+        self.row_index = row_index if row_index is not None else QuantisedRowIndex(X)
+
+    def _row_class(self, a):
+        """
+        Look for a sample in the training set and select its class.
+
+        Returns
+        -------
+        (found, c) where found indicates whether the sample occurs in the training set, and c is its class,
+        or None if it was not found or occurs with more than one class.
+        """
+        ind_array = self.row_index(a)
+        if len(ind_array) == 0:
+            return False, None
+        classes = self.y[ind_array]
+        if (classes == classes[0]).all():
+            return True, classes[0]
+        return True, None
+
+    def _matrix_and_max_d(self, c):
+        if c is None:
+            return self.overall_matrix, self.overall_max_d
+        return self.matrix_dict[c], self.max_d_dict[c]
+
+    def _distances(self, a, B, m, d):
+        diff = B - a
+        dist = np.einsum('ij,jk,ik->i', diff, m, diff)
+        if not self.squared:
+            dist = np.sqrt(dist)
+        return dist/d
 
     def __call__(self, a, b):
-        m = self.overall_matrix
-        d = self.overall_max_d
-        # look for one of the samples in the training set and select its class
-        ind_array = np.where(np.isclose(a, self.X).all(axis=1))[0]
-        if len(ind_array) > 0:
-            first_class = self.y[ind_array[0]]
-            i = 1
-            while i < len(ind_array) and self.y[ind_array[i]] == first_class:
-                i += 1
-            if i == len(ind_array):
-                m = self.matrix_dict[first_class]
-                d = self.max_d_dict[first_class]
-        else:
-            ind_array = np.where(np.isclose(b, self.X).all(axis=1))[0]
-            if len(ind_array) > 0:
-                first_class = self.y[ind_array[0]]
-                i = 1
-                while i < len(ind_array) and self.y[ind_array[i]] == first_class:
-                    i += 1
-                if i == len(ind_array):
-                    m = self.matrix_dict[first_class]
-                    d = self.max_d_dict[first_class]
+        found, c = self._row_class(a)
+        if not found:
+            _, c = self._row_class(b)
+        m, d = self._matrix_and_max_d(c)
         dist = np.matmul(np.matmul(np.transpose(a - b), m), (a - b))
         if not self.squared:
             dist = np.sqrt(dist)
         return dist/d
 
+    def pairwise(self, A, B):
+        """
+        Batch version of `__call__`, which resolves the class of each row of A and B only once.
+
+        Parameters
+        ----------
+        A   array of shape (n_A, m)
+        B   array of shape (n_B, m)
+
+        Returns
+        -------
+        array of shape (n_A, n_B) with the distance between each row of A and each row of B
+        """
+        # group the rows of B by their resolved class, for the rows of A that are not in the training set
+        B_groups = dict()
+        for j, b in enumerate(B):
+            B_groups.setdefault(self._row_class(b)[1], []).append(j)
+        dists = np.empty((len(A), len(B)))
+        for i, a in enumerate(A):
+            found, c = self._row_class(a)
+            if found:
+                dists[i] = self._distances(a, B, *self._matrix_and_max_d(c))
+            else:
+                for c, inds in B_groups.items():
+                    dists[i, inds] = self._distances(a, B[inds], *self._matrix_and_max_d(c))
+        return dists
+
 
 class ClassMahalanobisDistanceFactory(DistanceFunctionFactory):
     """
@@ -222,7 +380,7 @@ class ClassMahalanobisDistanceFactory(DistanceFunctionFactory):
     and with support for squared.
     """
 
-    __slots__ = ('matrix_dict', 'general_matrix', 'overal_max_d', 'max_d_dict', 'X', 'y',)
+    __slots__ = ('matrix_dict', 'general_matrix', 'overall_max_d', 'max_d_dict', 'X', 'y', 'squared', 'row_index',)
 
     def __init__(self, squared=False):
         self.general_matrix = None
@@ -231,7 +389,7 @@ class ClassMahalanobisDistanceFactory(DistanceFunctionFactory):
         self.squared = squared
 
     def fit(self, X, y=None):
-        if self.can_apply(X):
+        if self.can_apply(X, y):
             # general matrix
             self.general_matrix = np.linalg.inv(np.cov(X, rowvar=False))
             # general max distance
@@ -241,7 +399,7 @@ class ClassMahalanobisDistanceFactory(DistanceFunctionFactory):
                     d12 = np.matmul(np.matmul(np.transpose(x1 - x2), self.general_matrix), (x1 - x2))
                     if not self.squared:
                         d12 = np.sqrt(d12)
-                    if d12 > self.overal_max_d:
+                    if d12 > self.overall_max_d:
                         self.overall_max_d = d12
 
             # class specific matrix
@@ -280,15 +438,23 @@ class ClassMahalanobisDistanceFactory(DistanceFunctionFactory):
             # rest
             self.X = X
             self.y = y
+            self.row_index = QuantisedRowIndex(X)
+
+    def cache_key(self):
+        # the class specific matrices are only calculated by the first fit
+        if self.matrix_dict is not None:
+            return None
+        return (self.squared, )
 
     def get_metric(self) -> DistanceFunction:
         return ClassMahalanobisDistanceFunction(self.matrix_dict,
                                                 self.general_matrix,
                                                 self.max_d_dict,
-                                                self.overal_max_d,
+                                                self.overall_max_d,
                                                 self.X,
                                                 self.y,
-                                                self.squared)
+                                                self.squared,
+                                                self.row_index)
 
     def can_apply(self, X, y=None) -> bool:
         cov = np.cov(X, rowvar=False)
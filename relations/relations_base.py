@@ -33,6 +33,17 @@ class DistanceFunctionFactory(ABC):
     def fit(self, X, y=None):
         pass
 
+    def cache_key(self):
+        """
+        Hyperparameters that determine the result of fit, by which FitCache recognises identical fits.
+
+        Returns
+        -------
+        Tuple of the hyperparameters, or None if the result of fit cannot be cached,
+        e.g. because it also depends on previous fits
+        """
+        return None
+
     @abstractmethod
     def get_metric(self) -> DistanceFunction:
         pass
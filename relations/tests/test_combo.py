@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from sklearn.datasets import load_iris
+
+from relations.distances import (
+    CanberraFactory, ChebyshevDistanceFactory, COMBOFactory, EuclideanDistanceFactory, ManhattanDistanceFactory,
+)
+
+
+def test_drop_dominated():
+    factories = [ManhattanDistanceFactory(), EuclideanDistanceFactory(), ChebyshevDistanceFactory()]
+    combo = COMBOFactory(distances=factories, racing=True)
+    accuracies = {
+        factories[0]: [.9, .8, .9],
+        # worse by the same small amount on each fold, which is not evidence against it
+        factories[1]: [.89, .79, .89],
+        # consistently much worse
+        factories[2]: [.5, .45, .55],
+    }
+    assert combo._drop_dominated(factories, accuracies) == factories[:2]
+    # worse by the same large amount on each fold
+    accuracies[factories[1]] = [.8, .7, .8]
+    assert combo._drop_dominated(factories, accuracies) == factories[:1]
+
+
+def test_racing(monkeypatch):
+    X, y = load_iris(return_X_y=True)
+    factories = [ManhattanDistanceFactory(), EuclideanDistanceFactory(), CanberraFactory()]
+    combo = COMBOFactory(distances=factories, folds=4, k=5)
+    combo.fit(X, y)
+
+    calls = []
+    drop_dominated = COMBOFactory._drop_dominated
+
+    def record(self, distances, accuracies):
+        calls.append(len(accuracies[distances[0]]))
+        return drop_dominated(self, distances, accuracies)
+
+    monkeypatch.setattr(COMBOFactory, '_drop_dominated', record)
+    racing = COMBOFactory(distances=factories, folds=4, k=5, racing=True)
+    racing.fit(X, y)
+    # racing starts after race_min_folds folds
+    assert calls == [3, 4]
+    assert racing.fitted_factory is combo.fitted_factory
+    with pytest.raises(ValueError):
+        COMBOFactory(distances=factories, racing=True, race_min_folds=2)
@@ -0,0 +1,26 @@
+import numpy as np
+from sklearn.datasets import load_iris
+
+from frlearn.neighbour_search_methods import BallTree, BruteForce
+from frlearn.neighbours.neighbour_search_methods import pairwise_dissimilarities
+from relations.distances import CorrelationFactory
+
+
+def test_correlation_at_averages():
+    X, _ = load_iris(return_X_y=True)
+    factory = CorrelationFactory()
+    factory.fit(X)
+    # Query instances at the fitted averages, which need not be at the averages of the query instances.
+    Q = np.concatenate([X[:10], factory.averages[None, :], factory.averages[None, :]])
+    assert factory.can_apply(Q)
+    assert not factory.can_apply(np.repeat(factory.averages[None, :], 3, axis=0))
+
+    metric = factory.get_metric()
+    expected = np.array([[metric(a, b) for b in Q] for a in Q])
+    assert np.all(expected[-2:, :-2] == .5) and np.all(expected[-2:, -2:] == 0)
+    factory.euclidean_search = True
+    embedded = factory.get_metric()
+    np.testing.assert_allclose(pairwise_dissimilarities(Q, Q, embedded), expected, atol=1e-12)
+    for nn_search in [BallTree(), BruteForce()]:
+        _, distances = nn_search(Q, dissimilarity=embedded)(Q, k=3)
+        np.testing.assert_allclose(distances, np.sort(expected, axis=1)[:, :3], atol=1e-7)
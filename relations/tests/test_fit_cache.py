@@ -0,0 +1,68 @@
+import time
+
+import numpy as np
+from sklearn.datasets import load_iris
+
+from relations.distances import CanberraFactory
+from relations.fit_cache import FitCache
+from relations.mahalanobis import DMLMJFactory, MahalanobisCorrelationDistanceFactory
+
+
+def test_fit_cache_restores_into_fresh_factory(tmp_path):
+    X, _ = load_iris(return_X_y=True)
+    X2 = X[::2]
+    cache = FitCache(tmp_path)
+    factory = CanberraFactory()
+    assert not cache.fit(factory, X)
+    assert not cache.fit(factory, X2)
+
+    for data in (X, X2):
+        fresh = CanberraFactory()
+        assert cache.fit(fresh, data)
+        assert fresh.dimension == 4
+        metric = fresh.get_metric()
+        assert np.isfinite(metric(data[0], data[1]))
+
+
+def test_fit_cache_misses_after_hyperparameter_change(tmp_path):
+    X, y = load_iris(return_X_y=True)
+    cache = FitCache(tmp_path)
+    factory = MahalanobisCorrelationDistanceFactory()
+    assert not cache.fit(factory, X, y)
+    fresh = MahalanobisCorrelationDistanceFactory()
+    assert cache.fit(fresh, X, y)
+    np.testing.assert_array_equal(fresh.matrix, factory.matrix)
+    assert fresh.max_d == factory.max_d
+
+    squared = MahalanobisCorrelationDistanceFactory()
+    squared.squared = True
+    assert not cache.fit(squared, X, y)
+    assert np.isclose(squared.max_d, factory.max_d ** 2)
+
+    factory = DMLMJFactory(n_neighbors=3)
+    assert not cache.fit(factory, X, y)
+    assert cache.fit(DMLMJFactory(n_neighbors=3), X, y)
+    factory.model.alpha = 0.1
+    assert not cache.fit(factory, X, y)
+    assert not cache.fit(DMLMJFactory(n_neighbors=3, warm_start=True), X, y)
+
+
+def test_fit_cache_evicts_least_recently_used(tmp_path):
+    X, _ = load_iris(return_X_y=True)
+    data = [X[:50], X[50:100], X[100:]]
+    cache = FitCache(tmp_path)
+    cache.fit(CanberraFactory(), data[0])
+    entry_size = sum(path.stat().st_size for path in tmp_path.iterdir())
+    cache.max_bytes = 2 * entry_size
+
+    # filesystem timestamps can be coarse, so wait between uses to order them
+    time.sleep(.05)
+    cache.fit(CanberraFactory(), data[1])
+    time.sleep(.05)
+    assert cache.fit(CanberraFactory(), data[0])
+    time.sleep(.05)
+    cache.fit(CanberraFactory(), data[2])
+    assert len(list(tmp_path.iterdir())) == 2
+    assert cache.fit(CanberraFactory(), data[0])
+    assert cache.fit(CanberraFactory(), data[2])
+    assert not cache.fit(CanberraFactory(), data[1])
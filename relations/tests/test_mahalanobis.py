@@ -0,0 +1,20 @@
+import warnings
+
+import numpy as np
+from sklearn.datasets import load_iris
+
+from relations.mahalanobis import QuantisedRowIndex
+
+
+def test_quantised_row_index():
+    X, _ = load_iris(return_X_y=True)
+    queries = np.concatenate([X[::7], X[::7] + 1e-9, X[::7] + 1e-3, [[1e300, 0, 0, 0], [np.inf, 0, 0, 0]]])
+    # with a fine resolution, the cell coordinates of large values do not fit in 64-bit integers
+    large = np.concatenate([X, [[1e15, 0, 0, 0], [3e15, 0, 0, 0]]])
+    for data, rtol in [(X, 1e-05), (large, 0)]:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            index = QuantisedRowIndex(data, rtol=rtol)
+            for a in np.concatenate([queries, large[-2:]]):
+                expected = np.flatnonzero(np.isclose(a, data, rtol=rtol, atol=1e-08).all(axis=1))
+                np.testing.assert_array_equal(index(a), expected)
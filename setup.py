@@ -58,6 +58,6 @@ setup(name=DISTNAME,
       long_description=LONG_DESCRIPTION,
       zip_safe=False,  # the package can run out of an .egg file
       classifiers=CLASSIFIERS,
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks']),
       install_requires=INSTALL_REQUIRES,
       extras_require=EXTRAS_REQUIRE)